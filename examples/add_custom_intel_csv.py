@@ -8,15 +8,26 @@ Sample program to add custom intelligence from a CSV file.
 """
 
 import argparse
+import atexit
 import ConfigParser
+import os
 import os.path
 import logging
 import csv
 import collections
+import itertools
+import json
 import socket
+import tempfile
+import threading
+import time
 
 from papi_client import papi_client
 from papi_client import loader
+from papi_client import metrics
+from papi_client import bulk
+from papi_client import reconcile
+from papi_client import validation
 from papi_client.api import intel 
 
 
@@ -168,6 +179,119 @@ class CSVFormat(object):
         return IntelEntry(**values)
 
     def parse_csv(self, csv_file, skip=0, logger=None):
+        for _line_num, entry in self.parse_csv_numbered(csv_file, skip, logger):
+            yield entry
+
+    def key_pos(self):
+        """
+        Position of the ip or domain column
+        """
+        if self._ip_pos is not None:
+            return self._ip_pos
+        return self._domain_pos
+
+    def parse_csv_numbered(self, csv_file, skip=0, logger=None, keep=None):
+        """
+        Like parse_csv, but yields (line number, entry) tuples
+
+        :param keep: optional callable(value) called with the ip/domain of
+            every line before it is validated, so that rejected lines
+            are known too
+        """
+        for line_num, line in self.__numbered_lines(csv_file, skip, logger):
+            if keep and line[self.key_pos()]:
+                keep(line[self.key_pos()])
+            yield line_num, self.parse_line(line, line_num, logger)
+
+    def parse_csv_batched(self, csv_file, skip=0, logger=None,
+                          batch_rows=10000, keep=None):
+        """
+        Like parse_csv_numbered, but validates batch_rows lines at a time
+        with a column-wise BatchValidator, which is much faster for large
+        feeds. Rejected lines are logged as a summary per batch.
+        """
+        validator = validation.BatchValidator(allow_ipv6=False,
+                                              impact_step=False)
+        reader = csv.reader(csv_file)
+        line_num = 0
+        while True:
+            lines = list(itertools.islice(reader, batch_rows))
+            if not lines:
+                break
+            # line number is 1-indexed, as is more common in editors
+            first = line_num + 1
+            line_num += len(lines)
+            if line_num <= skip:
+                continue
+            if first <= skip:
+                lines = lines[skip - first + 1:]
+                first = skip + 1
+
+            line_nums = range(first, line_num + 1)
+            lengths = map(len, lines)
+            short = [i for i, length in enumerate(lengths)
+                     if length <= self._max_pos]
+            if short:
+                for i in short:
+                    if logger:
+                        if lengths[i]:
+                            logger.error("Invalid line %s: not enough csv "
+                                         "parts", line_nums[i])
+                        else:
+                            logger.warning("Skipping empty line %s",
+                                           line_nums[i])
+                short = set(short)
+                line_nums = [n for i, n in enumerate(line_nums)
+                             if i not in short]
+                lines = [l for i, l in enumerate(lines) if i not in short]
+                if not lines:
+                    continue
+
+            for numbered_entry in self.__validate_batch(
+                    validator, line_nums, lines, logger, keep):
+                yield numbered_entry
+
+    def __validate_batch(self, validator, line_nums, lines, logger, keep):
+        # transpose rows into columns
+        columns = zip(*lines)
+        column = lambda pos: columns[pos] if pos is not None else None
+        if keep:
+            for value in column(self.key_pos()):
+                if value:
+                    keep(value)
+        result = validator.validate(ips=column(self._ip_pos),
+                                    domains=column(self._domain_pos),
+                                    impacts=column(self._impact_pos))
+        if logger:
+            counts = result.reason_counts()
+            if counts:
+                logger.error("Lines %s-%s: rejected %s", line_nums[0],
+                             line_nums[-1], counts)
+
+        impacts = None
+        if result.impacts is not None:
+            # like parse_line, an invalid impact only drops the impact
+            impacts = [impact or None for impact in result.impacts]
+
+        none = itertools.repeat(None)
+        entries = map(IntelEntry._make, itertools.izip(
+            column(self._ip_pos) or none,
+            column(self._domain_pos) or none,
+            impacts or none,
+            column(self._source_pos) or none,
+            column(self._comment_pos) or none))
+
+        impact_reasons = (validation.INVALID_IMPACT, validation.IMPACT_STEP)
+        for index, reason in result.rejected():
+            if reason in impact_reasons:
+                continue
+            if logger:
+                logger.debug("Invalid line %s: %s", line_nums[index],
+                             validation.REASON_NAMES[reason])
+            entries[index] = None
+        return itertools.izip(line_nums, entries)
+
+    def __numbered_lines(self, csv_file, skip, logger):
         reader = csv.reader(csv_file)
         line_num = 0
         for line in reader:
@@ -176,16 +300,223 @@ class CSVFormat(object):
             if line_num <= skip:
                 continue
             if not line:
-                logger.warning("Skipping empty line %s", line_num)
+                if logger:
+                    logger.warning("Skipping empty line %s", line_num)
                 continue
             
             if self._max_pos >= len(line):
                 if logger:
                     logger.error("Invalid line %s: not enough csv parts", line_num)
                 continue
-            entry = self.parse_line(line, line_num, logger)
+            yield line_num, line
+
+
+# Streaming pipeline stages. Each stage consumes and yields
+# (line number, entry) tuples, so that the feed never has to be in memory
+# as a whole and the upload starts while the file is still being read.
+
+MAX_SOURCE_LENGTH = 45
+MAX_COMMENT_LENGTH = 255
+
+
+def override_fields(numbered_entries, impact=None, source=None, comment=None):
+    overrides = {}
+    if impact:
+        overrides["impact"] = impact
+    if source:
+        overrides["source"] = source
+    if comment:
+        overrides["comment"] = comment
+    for line_num, entry in numbered_entries:
+        if entry is not None and overrides:
+            entry = entry._replace(**overrides)
+        yield line_num, entry
+
+
+def validate_entries(numbered_entries, stats, logger=None):
+    for line_num, entry in numbered_entries:
+        error = None
+        if entry is None:
+            error = "unparsable"
+        elif not entry.ip and not entry.domain:
+            error = "no ip or domain"
+        elif entry.source and len(entry.source) > MAX_SOURCE_LENGTH:
+            error = "source longer than %d characters" % MAX_SOURCE_LENGTH
+        elif entry.comment and len(entry.comment) > MAX_COMMENT_LENGTH:
+            error = "comment longer than %d characters" % MAX_COMMENT_LENGTH
+        if error:
+            stats["invalid"] += 1
+            if logger and entry is not None:
+                logger.error("Invalid line %s: %s", line_num, error)
+            continue
+        yield line_num, entry
+
+
+def dedupe_entries(numbered_entries, stats, logger=None):
+    """
+    Drop repeated ips/domains, keeping the first occurrence.
+
+    Memory grows with the number of distinct ips/domains, not entries.
+    """
+    seen = set()
+    for line_num, entry in numbered_entries:
+        value = entry.ip or entry.domain
+        if value in seen:
+            stats["duplicates"] += 1
+            if logger:
+                logger.debug("Skipping duplicate %s on line %s", value,
+                             line_num)
+            continue
+        seen.add(value)
+        yield line_num, entry
+
+
+def to_request_entries(numbered_entries):
+    # if we pass the namedtuples through,
+    # simplejson serializes them correctly (like dictionaries)
+    # but plain json does not
+    for line_num, entry in numbered_entries:
+        # remove anything we're not setting
+        yield line_num, intel.purge_none(dict(entry._asdict()))
+
+
+def parse_entries(csv_format, csv_file, args, skip, stats, feed_diff=None,
+                  logger=None):
+    """
+    Build the pipeline from the lines of csv_file to the entries to send.
+
+    With --delete-missing, the ip/domain of every line is recorded in
+    feed_diff before validation, so that entries whose line was rejected
+    are not deleted from the blacklist.
+    """
+    keep = feed_diff.keep if args.delete_missing else None
+    if args.row_validation:
+        entries = csv_format.parse_csv_numbered(csv_file, skip=skip,
+                                                logger=logger, keep=keep)
+    else:
+        entries = csv_format.parse_csv_batched(csv_file, skip=skip,
+                                               logger=logger, keep=keep)
+    entries = override_fields(entries, args.impact, args.source, args.comment)
+    entries = validate_entries(entries, stats, logger)
+    entries = dedupe_entries(entries, stats, logger)
+    if args.limit:
+        entries = itertools.islice(entries, args.limit)
+    entries = to_request_entries(entries)
+    if feed_diff is not None:
+        entries = reconcile_entries(entries, feed_diff, logger)
+    return entries
+
+
+def reconcile_entries(numbered_entries, feed_diff, logger=None):
+    """
+    Drop entries that are already blacklisted exactly like this.
+    """
+    for line_num, entry in numbered_entries:
+        if feed_diff.changed(entry):
+            yield line_num, entry
+        elif logger:
+            logger.debug("Skipping unchanged entry on line %s", line_num)
+
+
+class Checkpoint(object):
+    """
+    Tracks which input lines have been uploaded and persists the line
+    number up to which everything was uploaded, so that an interrupted
+    import can be resumed.
+
+    Batches complete out of order; the checkpoint only advances over a
+    contiguous run of successful batches. Line numbers are only kept for
+    entries that are in flight, and once a batch failed nothing after it is
+    kept, so memory stays bounded.
+    """
+    def __init__(self, path=None, input_file=None, logger=None):
+        self._path = path
+        self._input_file = input_file
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._lines = {}      # entry position -> line number
+        self._done = {}       # batch index -> BatchResult, not yet contiguous
+        self._next_batch = 0
+        # first entry position of the earliest failed batch: the checkpoint
+        # cannot advance past it
+        self._failed_from = None
+        self.line = 0
+        self.uploaded = 0
+        self.failed = 0
+
+    def load(self):
+        """
+        :return: line number recorded for this input, 0 if none
+        """
+        if not self._path or not os.path.isfile(self._path):
+            return 0
+        with open(self._path) as f:
+            data = json.load(f)
+        if data.get("input") != os.path.abspath(self._input_file):
+            if self._logger:
+                self._logger.warning("Checkpoint %s is for %s, ignoring it",
+                                     self._path, data.get("input"))
+            return 0
+        return data["line"]
+
+    def track(self, numbered_entries):
+        """
+        Pipeline stage remembering the line number of every entry passed on
+        """
+        for position, (line_num, entry) in enumerate(numbered_entries):
+            with self._lock:
+                if self._failed_from is None:
+                    self._lines[position] = line_num
             yield entry
 
+    def batch_done(self, result):
+        """
+        Progress callback for the BulkUploader
+        """
+        with self._lock:
+            if result.ok():
+                self.uploaded += result.count
+            else:
+                self.failed += result.count
+                if self._failed_from is None or \
+                        result.first < self._failed_from:
+                    self.__drop_from(result.first)
+            if self._failed_from is not None and \
+                    result.first >= self._failed_from:
+                return
+            self._done[result.index] = result
+            advanced = False
+            while self._next_batch in self._done:
+                done = self._done.pop(self._next_batch)
+                self.line = self._lines[done.last()]
+                for position in range(done.first, done.last() + 1):
+                    del self._lines[position]
+                self._next_batch += 1
+                advanced = True
+            if advanced:
+                self.__save()
+
+    def __drop_from(self, position):
+        """
+        Forget line numbers and completed batches from position on
+        """
+        self._failed_from = position
+        for later in [p for p in self._lines if p >= position]:
+            del self._lines[later]
+        for index in [i for i, done in self._done.iteritems()
+                      if done.first > position]:
+            del self._done[index]
+
+    def __save(self):
+        if not self._path:
+            return
+        directory = os.path.dirname(os.path.abspath(self._path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"input": os.path.abspath(self._input_file),
+                       "line": self.line}, f)
+        os.rename(tmp_path, self._path)
+
 
 def main():
     parser = argparse.ArgumentParser()
@@ -226,9 +557,36 @@ def main():
     parser.add_argument("--test", default=False, action="store_true",
                         help="Don't actually run the add, just print out "
                         "the entries that would be added")
+    parser.add_argument("--batch-size", type=int, default=1000,
+                        help="Send at most this many entries per request")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="Number of requests in flight at the same time")
+    parser.add_argument("--row-validation", default=False,
+                        action="store_true",
+                        help="Validate line by line instead of in batches; "
+                        "slower, but logs every invalid line as it is read")
+    parser.add_argument("--checkpoint",
+                        help="Record progress in this file, so that an "
+                        "interrupted import can be continued with --resume")
+    parser.add_argument("--resume", default=False, action="store_true",
+                        help="Skip the lines already uploaded according to "
+                        "the --checkpoint file")
+    parser.add_argument("--reconcile", default=False, action="store_true",
+                        help="Fetch the current blacklist first and only "
+                        "send entries that are new or changed")
+    parser.add_argument("--delete-missing", default=False,
+                        action="store_true",
+                        help="With --reconcile, also delete blacklisted "
+                        "entries that are not in the input file")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="Write PAPI request metrics in the Prometheus "
+                        "text format to FILE ('-' for stdout) when done")
 
     args = parser.parse_args()
 
+    if args.metrics:
+        atexit.register(metrics.dump, args.metrics)
+
     # Python logger...
     logger = logging.getLogger()
     sh = logging.StreamHandler()
@@ -250,62 +608,121 @@ def main():
         if not CSVFormat.parse_impact(args.impact):
             logger.error("Invalid impact %s", args.impact)
             exit(1)
-    
-    entries = [e for e in csv_format.parse_csv(open(args.input_file),
-                                               skip=args.skip_header,
-                                               logger=logger)]
-    
-    if args.impact:
-        entries = map(lambda e:e._replace(impact=args.impact), entries)
-    
-    if args.source:
-        entries = map(lambda e:e._replace(source=args.source), entries)
-    
-    if args.comment:
-        entries = map(lambda e:e._replace(comment=args.comment), entries)
-    
-    logger.info("Parsed %s feed entries", len(entries))
-    
-    if args.limit:
-        entries = entries[:args.limit]
-    
-    
 
-    # if we pass the namedtuples through,
-    # simplejson serializes them correctly (like dictionaries)
-    # but plain json does not
-    entries = [dict(e._asdict()) for e in entries]
-    # remove anything we're not setting
-    for e in entries:
-        intel.purge_none(e)
+    checkpoint = Checkpoint(args.checkpoint, args.input_file, logger)
+    skip = args.skip_header
+    if args.resume:
+        if not args.checkpoint:
+            logger.error("--resume requires --checkpoint")
+            return 1
+        checkpoint.line = checkpoint.load()
+        skip = max(skip, checkpoint.line)
+        logger.info("Resuming after line %s", skip)
 
-    print entries[:10]
+    if args.delete_missing and not args.reconcile:
+        logger.error("--delete-missing requires --reconcile")
+        return 1
+    if args.delete_missing and (args.limit or args.resume or
+                                args.skip_header > 1):
+        # the input would not be the complete blacklist
+        logger.error("--delete-missing cannot be combined with --limit, "
+                     "--resume or skipping more than one header line")
+        return 1
 
-    base_client = papi_client.PapiClientFactory.client_from_config(config_parser, "papi", logger)
-    client = loader.PapiClientCollection(base_client=base_client,
-                                          conf=config_parser,
-                                          logger=logger)
-    client.load_view("intel")
     intel_type = csv_format.intel_type()
-    
-    
-    
-    logger.info("Adding %s %s entries through intelligence API for key '%s'",
-                len(entries),
+
+    client = None
+    feed_diff = None
+    if args.reconcile or not args.test:
+        base_client = papi_client.PapiClientFactory.client_from_config(config_parser, "papi", logger)
+        client = loader.PapiClientCollection(base_client=base_client,
+                                              conf=config_parser,
+                                              logger=logger)
+        client.load_view("intel")
+    if args.reconcile:
+        reconciler = reconcile.Reconciler(client.intel,  # pylint: disable=E1101
+                                          logger=logger)
+        feed_diff = reconciler.diff(intel_type.lower(), args.key)
+
+    stats = collections.Counter()
+    csv_file = open(args.input_file)
+    entries = parse_entries(csv_format, csv_file, args, skip, stats,
+                            feed_diff, logger)
+
+    if args.test:
+        count = 0
+        for line_num, entry in entries:
+            if count < 10:
+                print line_num, entry
+            count += 1
+        if feed_diff is not None:
+            logger.info("Reconciled against the current blacklist: %s",
+                        feed_diff.counts())
+        logger.info("STOP: we are in test mode. Would add %s %s entries "
+                    "(%s invalid, %s duplicates)", count, intel_type,
+                    stats["invalid"], stats["duplicates"])
+        return 0
+
+    start = time.time()
+
+    def progress(result):
+        checkpoint.batch_done(result)
+        elapsed = max(time.time() - start, 0.001)
+        logger.info("Uploaded %s entries (%s failed), %.0f entries/s, "
+                    "complete up to line %s", checkpoint.uploaded,
+                    checkpoint.failed, checkpoint.uploaded / elapsed,
+                    checkpoint.line)
+
+    uploader = bulk.BulkUploader(client.intel,  # pylint: disable=E1101
+                                 max_entries=args.batch_size,
+                                 workers=args.workers,
+                                 progress=progress,
+                                 logger=logger)
+
+    logger.info("Adding %s entries through intelligence API for key '%s'",
                 intel_type,
                 args.key)
-    
-    if args.test:
-        logger.info("STOP: we are in test mode")
-    else:
+
+    if intel_type == "IP":
+        report = uploader.add_ip(checkpoint.track(entries), args.key)
+    elif intel_type == "DOMAIN":
+        report = uploader.add_domain(checkpoint.track(entries), args.key)
+    csv_file.close()
+
+    delete_report = None
+    if args.delete_missing:
+        deletions = feed_diff.deletions()
+        logger.info("Deleting %s %s entries not in %s", len(deletions),
+                    intel_type, args.input_file)
+        # no progress callback, the checkpoint only covers the adds
+        delete_uploader = bulk.BulkUploader(
+            client.intel,  # pylint: disable=E1101
+            max_entries=args.batch_size, workers=args.workers,
+            logger=logger)
         if intel_type == "IP":
-            result = client.intel.add_ip(entries, args.key)  # pylint: disable=E1101
+            delete_report = delete_uploader.delete_ip(deletions, args.key)
         elif intel_type == "DOMAIN":
-            result = client.intel.add_domain(entries, args.key)  # pylint: disable=E1101
-        
-        print result
-    
+            delete_report = delete_uploader.delete_domain(deletions,
+                                                          args.key)
+    if feed_diff is not None:
+        logger.info("Reconciled against the current blacklist: %s",
+                    feed_diff.counts())
+
+    summary = report.summary()
+    logger.info("Added %s of %s entries in %s batches (%s invalid, "
+                "%s duplicates skipped)", summary["entries"] -
+                summary["failed_entries"], summary["entries"],
+                summary["batches"], stats["invalid"], stats["duplicates"])
+    if not report.ok():
+        logger.error("%s batches failed; everything up to line %s was "
+                     "uploaded", summary["failed_batches"], checkpoint.line)
+        return 1
+    if delete_report is not None and not delete_report.ok():
+        logger.error("Deleting %s entries failed",
+                     delete_report.summary()["failed_entries"])
+        return 1
+    return 0
     
     
 if __name__ == "__main__":
-    main()
+    exit(main())
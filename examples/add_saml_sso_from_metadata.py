@@ -19,6 +19,7 @@ from urlparse import urlparse
 
 from papi_client import papi_client
 from papi_client import loader
+from papi_client import rollout
 
 
 class MissingValue(Exception):
@@ -186,8 +187,8 @@ def get_papi_client(config_parser, logger):
 class SAMLApplianceConfiguration(object):
 
     def __init__(
-            self, appliance_uuid, config_index, metadata=None, display_name=None):
-        self._appliance_uuid = appliance_uuid
+            self, appliance_uuids, config_index, metadata=None, display_name=None):
+        self._appliance_uuids = appliance_uuids
         self._config_index = config_index
         self._metadata = metadata
         self._display_name = display_name
@@ -206,17 +207,27 @@ class SAMLApplianceConfiguration(object):
             sso_config_key: dumps(sso_config_settings)
         }
 
-    def add_sso(self, client):
+    def add_sso(self, client, logger=None):
         settings = self._get_config_settings()
-        client.appliance_mgmt.configure(
-            self._appliance_uuid,
-            settings=settings)
+        return self._configure(client, settings, logger)
 
-    def delete_sso(self, client):
+    def delete_sso(self, client, logger=None):
         settings = self._get_config_settings(is_add=False)
-        client.appliance_mgmt.configure(
-            self._appliance_uuid,
-            settings=settings)
+        return self._configure(client, settings, logger)
+
+    def _configure(self, client, settings, logger):
+        """
+        Configure all appliances and wait for their actions
+
+        :return: rollout.RolloutReport
+        """
+        appliance_rollout = rollout.Rollout(client.appliance_mgmt,
+                                            logger=logger)
+        return appliance_rollout.run(self._appliance_uuids, settings=settings)
+
+
+def appliance_uuids(string):
+    return [uuid.strip() for uuid in string.split(",") if uuid.strip()]
 
 
 def url_or_file(string):
@@ -234,8 +245,9 @@ def main():
     # Parser for add mode
     add_parser = subparsers.add_parser('add')
     add_parser.add_argument("appliance_uuid",
-                            type=str,
-                            help="Specify the appliance UUID to configure.")
+                            type=appliance_uuids,
+                            help="Specify the appliance UUID to configure, or "
+                                 "several separated by commas.")
     add_parser.add_argument("url_or_file",
                             type=url_or_file,
                             help="Specify file location of metadata or specify "
@@ -268,8 +280,9 @@ def main():
     # Parser for delete mode
     delete_parser = subparsers.add_parser("delete")
     delete_parser.add_argument("appliance_uuid",
-                               type=str,
-                               help="Specify the appliance UUID to configure.")
+                               type=appliance_uuids,
+                               help="Specify the appliance UUID to configure, "
+                                    "or several separated by commas.")
     delete_parser.add_argument("config_index",
                                type=int,
                                choices=xrange(0, 4),
@@ -289,8 +302,8 @@ def main():
         if args.mode == "delete":
             saml_configuration = SAMLApplianceConfiguration(
                 args.appliance_uuid, args.config_index)
-            saml_configuration.delete_sso(client)
-            return 0
+            report = saml_configuration.delete_sso(client, logger)
+            return 0 if report.ok() else 1
 
         if args.url_or_file.get('url', None):
             xml_content = xml_read_from_url(args.url_or_file['url'],
@@ -305,14 +318,16 @@ def main():
         if not display_name:
             display_name = urlparse(metadata.entity_id).netloc  # pylint: disable=E1101
 
-        logger.info("Adding SSO configuration (index %d) for appliance %s" %
-                    (args.config_index, args.appliance_uuid))
+        logger.info("Adding SSO configuration (index %d) for appliances %s" %
+                    (args.config_index, ", ".join(args.appliance_uuid)))
 
         saml_configuration = SAMLApplianceConfiguration(args.appliance_uuid,
                                                         args.config_index,
                                                         metadata=metadata,
                                                         display_name=display_name)
-        saml_configuration.add_sso(client)
+        report = saml_configuration.add_sso(client, logger)
+        if not report.ok():
+            return 1
 
     except (MissingValue, InvalidXML, InvalidFile, InvalidURL) as e:
         logger.error(e.message)
@@ -321,4 +336,4 @@ def main():
     return 0
 
 if __name__ == "__main__":
-    main()
+    exit(main())
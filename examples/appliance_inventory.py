@@ -0,0 +1,98 @@
+#!/usr/bin/python
+"""
+Sample program to keep a local inventory of the appliance configurations
+and to query it.
+
+    appliance_inventory.py DIRECTORY refresh
+    appliance_inventory.py DIRECTORY find sso_saml2_enabled1 true
+    appliance_inventory.py DIRECTORY values software_version
+"""
+
+import argparse
+import ConfigParser
+import json
+import os.path
+import logging
+
+from papi_client import papi_client
+from papi_client import loader
+from papi_client import inventory
+
+
+def parse_value(value):
+    """
+    Values are given as JSON (true, 3, "x"); anything else is a string
+    """
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--config", type=str, dest="config",
+                        default="papi_client.ini")
+    parser.add_argument("directory", help="Directory holding the inventory")
+    subparsers = parser.add_subparsers(dest="command")
+
+    refresh_parser = subparsers.add_parser(
+        "refresh", help="Fetch the configurations that changed")
+    refresh_parser.add_argument("--full", default=False, action="store_true",
+                                help="Fetch all configurations")
+    refresh_parser.add_argument("--concurrency", type=int, default=8,
+                                help="Configurations fetched at the same time")
+
+    find_parser = subparsers.add_parser(
+        "find", help="List the appliances having a setting")
+    find_parser.add_argument("setting")
+    find_parser.add_argument("value", type=parse_value)
+
+    values_parser = subparsers.add_parser(
+        "values", help="List the values of a setting and their appliances")
+    values_parser.add_argument("setting")
+
+    args = parser.parse_args()
+
+    # Python logger...
+    logger = logging.getLogger()
+    sh = logging.StreamHandler()
+    logger.setLevel(logging.INFO)
+    sh.setLevel(logging.INFO)
+    logger.addHandler(sh)
+
+    if args.command != "refresh":
+        snapshot = inventory.Inventory(args.directory, logger).snapshot()
+        if args.command == "find":
+            for uuid in snapshot.find(args.setting, args.value):
+                print uuid
+        else:
+            for value, uuids in snapshot.values(args.setting):
+                print "%s: %s" % (json.dumps(value), ", ".join(uuids))
+        return 0
+
+    config_fn = os.path.expanduser(args.config)
+    if not os.path.isfile(config_fn):
+        logger.error("config %s not found", args.config)
+        return 1
+
+    config_parser = ConfigParser.ConfigParser()
+    config_parser.read(config_fn)
+
+    base_client = papi_client.PapiClientFactory.client_from_config(config_parser, "papi", logger)
+    client = loader.PapiClientCollection(base_client=base_client,
+                                          conf=config_parser,
+                                          logger=logger)
+    client.load_view("appliance_mgmt")
+
+    appliance_inventory = inventory.Inventory(args.directory, logger,
+                                              concurrency=args.concurrency)
+    snapshot = appliance_inventory.refresh(
+        client.appliance_mgmt, full=args.full)  # pylint: disable=E1101
+    for uuid, error in sorted(snapshot.failed().items()):
+        logger.error("%s: %s", uuid, error)
+    return 1 if snapshot.failed() else 0
+
+
+if __name__ == "__main__":
+    exit(main())
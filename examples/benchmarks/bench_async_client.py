@@ -0,0 +1,67 @@
+#!/usr/bin/python
+"""
+Compare sequential get_ip lookups with the concurrent AsyncPapiClient.
+
+Runs against a local stub server with a fixed per-request latency, e.g.:
+
+    PYTHONPATH=../lib python -m benchmarks.bench_async_client -n 500
+"""
+import argparse
+import time
+
+from papi_client import async_client
+from papi_client import papi_client
+from papi_client.api import intel
+
+from benchmarks import stub_server
+
+
+def make_client(url, concurrency):
+    return papi_client.PapiClient(
+        url=url,
+        login_params={"username": "bench", "password": "bench"},
+        pool_maxsize=concurrency
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--requests", type=int, default=200)
+    parser.add_argument("-c", "--concurrency", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="stub server latency per request in seconds")
+    args = parser.parse_args()
+
+    server = stub_server.StubServer(latency=args.latency).start()
+    ips = ["10.0.%d.%d" % (i / 256, i % 256) for i in range(args.requests)]
+    try:
+        view = intel.PapiClientIntel(make_client(server.url(), 1))
+        start = time.time()
+        for ip in ips:
+            view.get_ip(ip)
+        sequential = time.time() - start
+
+        client = async_client.AsyncPapiClient(
+            make_client(server.url(), args.concurrency),
+            concurrency=args.concurrency)
+        view = intel.PapiClientIntel(client)
+        start = time.time()
+        futures = [view.get_ip(ip) for ip in ips]
+        for future in futures:
+            future.result()
+        concurrent = time.time() - start
+        client.close()
+    finally:
+        server.stop()
+
+    print "%d get_ip lookups, %.0f ms stub latency" % (args.requests,
+                                                        args.latency * 1000)
+    print "sequential:       %6.2fs %8.1f req/s" % (
+        sequential, args.requests / sequential)
+    print "concurrent (%3d): %6.2fs %8.1f req/s" % (
+        args.concurrency, concurrent, args.requests / concurrent)
+    print "speedup:          %6.1fx" % (sequential / concurrent)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/python
+"""
+Compare calling analysis_completed() for every completion with putting it
+into a CompletionQueue, for a burst of completions of which some are
+rescores of the same task. The view sleeps for a fixed latency per request
+instead of talking to a server:
+
+    PYTHONPATH=..:../lib python -m benchmarks.bench_completion_queue -n 2000
+"""
+import argparse
+import random
+import shutil
+import tempfile
+import time
+
+from papi_client import completion_queue
+from papi_client import metrics
+
+
+class SleepingPostprocessing(object):
+    def __init__(self, latency):
+        self.latency = latency
+        self.requests = 0
+
+    def analysis_completed(self, uuid, score, licenses, raw=False):
+        self.requests += 1
+        time.sleep(self.latency)
+
+
+def burst(completions, rescore_ratio):
+    tasks = []
+    for i in range(completions):
+        if tasks and random.random() < rescore_ratio:
+            uuid = random.choice(tasks)
+        else:
+            uuid = "%032x" % i
+            tasks.append(uuid)
+        yield uuid, random.randint(0, 100), ["license-b", "license-a"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("-n", "--completions", type=int, default=2000)
+    parser.add_argument("--rescores", type=float, default=0.2,
+                        help="fraction of completions rescoring a task")
+    parser.add_argument("--latency", type=float, default=0.005,
+                        help="seconds per analysis_completed request")
+    parser.add_argument("-w", "--workers", type=int, default=8)
+    parser.add_argument("--fsync", default=False, action="store_true")
+    args = parser.parse_args()
+
+    random.seed(1)
+    notifications = list(burst(args.completions, args.rescores))
+
+    view = SleepingPostprocessing(args.latency)
+    start = time.time()
+    for uuid, score, licenses in notifications:
+        view.analysis_completed(uuid, score, licenses)
+    direct = time.time() - start
+    print "direct:  producer %8.1f ms, %d requests" % (direct * 1e3,
+                                                       view.requests)
+
+    directory = tempfile.mkdtemp()
+    try:
+        view = SleepingPostprocessing(args.latency)
+        queue = completion_queue.CompletionQueue(
+            view, directory, workers=args.workers, fsync=args.fsync,
+            registry=metrics.MetricsRegistry())
+        start = time.time()
+        for uuid, score, licenses in notifications:
+            queue.put(uuid, score, licenses)
+        produced = time.time() - start
+        queue.flush()
+        drained = time.time() - start
+        queue.close()
+        print "queued:  producer %8.1f ms (%.1f us per put), drained after " \
+              "%.1f ms, %d requests" % (produced * 1e3,
+                                        produced / len(notifications) * 1e6,
+                                        drained * 1e3, view.requests)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/python
+"""
+Compare the cost of a log record after many requests, with a ContextFilter
+added per request (as the intel views used to) and with the request context
+set once per request.
+
+    PYTHONPATH=..:../lib python -m benchmarks.bench_log_context -n 100000
+"""
+import argparse
+import logging
+import time
+
+from django.conf import settings
+if not settings.configured:
+    # ipware reads its settings on import
+    settings.configure()
+
+from ipware.ip import get_ip
+
+from intel import ll_logger
+
+
+class FakeUser(object):
+    username = "analyst"
+
+    def is_authenticated(self):
+        return True
+
+
+class FakeRequest(object):
+    def __init__(self, number):
+        self.META = {"REMOTE_ADDR": "10.0.%d.%d" % (number // 256 % 256,
+                                                   number % 256)}
+        self.user = FakeUser()
+
+
+class LegacyContextFilter(logging.Filter):
+    """
+    The filter previously added to the shared logger for every request
+    """
+    def __init__(self, request, overrides={}):
+        self.request = request
+        self.overrides = overrides
+
+    def filter(self, record):
+        record.ip = get_ip(self.request)
+        if record.ip is None:
+            record.ip = "None"
+        if self.request.user.is_authenticated():
+            record.user = self.request.user.username
+        else:
+            record.user = self.overrides.get("user", "AnonymousUser")
+        return True
+
+
+def make_logger(name):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    handler = logging.NullHandler()
+    handler.setFormatter(logging.Formatter(
+        "%(levelname)s user(%(user)s) ip(%(ip)s) %(message)s"))
+    logger.addHandler(handler)
+    return logger
+
+
+def record_cost(logger, records):
+    """
+    Seconds per log record at the current state of the logger
+    """
+    start = time.time()
+    for _ in range(records):
+        logger.info("call(List_ip): {}")
+    return (time.time() - start) / records
+
+
+def run(logger, requests, checkpoint, records, start_request, end_request):
+    """
+    Simulate requests logging one record each; the cost per record is
+    measured inside every checkpoint-th request.
+    """
+    costs = []
+    for number in range(1, requests + 1):
+        start_request(logger, FakeRequest(number))
+        logger.info("call(Add_ip): []")
+        if number % checkpoint == 0:
+            costs.append((number, record_cost(logger, records)))
+        end_request(logger)
+    return costs
+
+
+def legacy_start(logger, request):
+    logger.addFilter(LegacyContextFilter(request))
+
+
+def context_start(logger, request):
+    ll_logger.set_context(request)
+
+
+def context_end(logger):
+    ll_logger.clear_context()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("-n", "--requests", type=int, default=100000)
+    parser.add_argument("--legacy-requests", type=int, default=5000,
+                        help="requests to simulate with the per-request "
+                             "filters, whose total cost grows quadratically")
+    parser.add_argument("--checkpoints", type=int, default=5)
+    parser.add_argument("--records", type=int, default=1000,
+                        help="log records timed at every checkpoint")
+    args = parser.parse_args()
+
+    legacy_costs = run(make_logger("bench.legacy"), args.legacy_requests,
+                       max(1, args.legacy_requests // args.checkpoints),
+                       args.records, legacy_start, lambda logger: None)
+
+    context_logger = make_logger("bench.context")
+    context_logger.addFilter(ll_logger.ContextFilter())
+    context_costs = run(context_logger, args.requests,
+                        max(1, args.requests // args.checkpoints),
+                        args.records, context_start, context_end)
+
+    print "filter per request:"
+    for number, cost in legacy_costs:
+        print "  after %7d requests: %8.1f us/record" % (number, cost * 1e6)
+    print "request context:"
+    for number, cost in context_costs:
+        print "  after %7d requests: %8.1f us/record" % (number, cost * 1e6)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+"""
+Compare per-row CSV validation with the column-wise BatchValidator.
+
+    PYTHONPATH=../lib python -m benchmarks.bench_validation -n 1000000
+"""
+import argparse
+import csv
+import random
+import StringIO
+import tempfile
+import time
+
+from papi_client import validation
+
+from add_custom_intel_csv import CSVFormat
+
+
+def make_feed(rows, invalid_ratio):
+    random.seed(4711)
+    lines = []
+    for i in range(rows):
+        ip = "%d.%d.%d.%d" % (random.randint(1, 223), random.randint(0, 255),
+                              random.randint(0, 255), random.randint(1, 254))
+        impact = str(random.choice(range(10, 101, 10)))
+        if random.random() < invalid_ratio:
+            if i % 2:
+                ip = "300.1.2.%d" % (i % 256)
+            else:
+                impact = "high"
+        lines.append("%s,%s,bench feed,line %d" % (ip, impact, i))
+    return "\n".join(lines) + "\n"
+
+
+def timed(fn):
+    start = time.time()
+    count = sum(1 for _line_num, entry in fn() if entry is not None)
+    return time.time() - start, count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--rows", type=int, default=200000)
+    parser.add_argument("--invalid", type=float, default=0.05,
+                        help="ratio of invalid rows")
+    parser.add_argument("--batch-rows", type=int, default=10000)
+    args = parser.parse_args()
+
+    feed = make_feed(args.rows, args.invalid)
+    csv_format = CSVFormat.from_format_string("IP,IMPACT,SOURCE,COMMENT")
+
+    # Validation only, on rows that were already read
+    rows = list(csv.reader(StringIO.StringIO(feed)))
+    start = time.time()
+    row_count = sum(1 for i, line in enumerate(rows)
+                    if csv_format.parse_line(line, i) is not None)
+    row = time.time() - start
+
+    validator = validation.BatchValidator(allow_ipv6=False, impact_step=False)
+    start = time.time()
+    batched_count = 0
+    for i in range(0, len(rows), args.batch_rows):
+        columns = zip(*rows[i:i + args.batch_rows])
+        result = validator.validate(ips=columns[0], impacts=columns[1],
+                                    sources=columns[2], comments=columns[3])
+        batched_count += len(result.accepted())
+    batched = time.time() - start
+    del rows, columns
+
+    # Whole CSV parsing pipeline, reading from a real file
+    with tempfile.NamedTemporaryFile(suffix=".csv") as csv_file:
+        csv_file.write(feed)
+        csv_file.flush()
+        with open(csv_file.name) as f:
+            row_csv, row_csv_count = timed(
+                lambda: csv_format.parse_csv_numbered(f))
+        with open(csv_file.name) as f:
+            batched_csv, batched_csv_count = timed(
+                lambda: csv_format.parse_csv_batched(
+                    f, batch_rows=args.batch_rows))
+    assert row_csv_count == batched_csv_count, (row_csv_count,
+                                                batched_csv_count)
+
+    print "%d rows, %.0f%% invalid, %d ip-valid, %d fully valid" % (
+        args.rows, args.invalid * 100, row_count, batched_count)
+    print "validation only:"
+    print "  per-row: %6.2fs %10.0f rows/s" % (row, args.rows / row)
+    print "  batched: %6.2fs %10.0f rows/s" % (batched, args.rows / batched)
+    print "  speedup: %6.1fx" % (row / batched)
+    print "read and validate CSV:"
+    print "  per-row: %6.2fs %10.0f rows/s" % (row_csv, args.rows / row_csv)
+    print "  batched: %6.2fs %10.0f rows/s" % (batched_csv,
+                                                args.rows / batched_csv)
+    print "  speedup: %6.1fx" % (row_csv / batched_csv)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/python
+"""
+Compare building a PapiClientCollection with all views by scanning and
+importing papi_client.api (as load_all_views() used to) with the view
+registry, in a running process and at the start of a new one (what
+papi_shell.py does before it starts IPython).
+
+    PYTHONPATH=..:../lib python -m benchmarks.bench_view_loading -n 10000
+"""
+import argparse
+import ConfigParser
+import pkgutil
+import subprocess
+import sys
+import time
+
+import papi_client.api
+from papi_client import loader
+
+
+def legacy_load_all_views(collection):
+    """
+    load_all_views() before the registry: import every module of
+    papi_client.api and look for the view class in it
+    """
+    info = [i for i in pkgutil.iter_modules(papi_client.api.__path__)]
+    names = [i[1] for i in info if not i[2]]
+    for name in names:
+        module = loader.import_module("papi_client.api.%s" % name)
+        view = loader.PapiViewLoader.get_view_from_module(
+            module, collection.base_client(), conf=None)
+        collection.add_view(name, view)
+
+
+def registry_load_all_views(collection):
+    collection.load_all_views()
+
+
+VARIANTS = {
+    "legacy": legacy_load_all_views,
+    "registry": registry_load_all_views,
+}
+
+
+def build(load, use_views):
+    collection = loader.PapiClientCollection(
+        base_client="stub", conf=ConfigParser.ConfigParser())
+    load(collection)
+    if use_views == "one":
+        collection.view("intel")
+    elif use_views == "all":
+        for name in collection.list_views():
+            collection.view(name).description()
+    return collection
+
+
+def construction_cost(load, use_views, collections):
+    start = time.time()
+    for _ in range(collections):
+        build(load, use_views)
+    return (time.time() - start) / collections
+
+
+def startup_costs(variants, runs):
+    """
+    Median seconds to start a python process building one collection and
+    describing all its views, as papi_shell.py does. The variants take
+    turns so that drifting machine load affects all of them alike.
+    """
+    times = dict((variant, []) for variant in variants)
+    for _ in range(runs):
+        for variant in variants:
+            command = [sys.executable, "-m", "benchmarks.bench_view_loading",
+                       "--child", variant]
+            start = time.time()
+            subprocess.check_call(command)
+            times[variant].append(time.time() - start)
+    return dict((variant, sorted(t)[len(t) // 2])
+                for variant, t in times.items())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("-n", "--collections", type=int, default=10000)
+    parser.add_argument("--runs", type=int, default=20,
+                        help="processes started per variant")
+    parser.add_argument("--child", choices=sorted(VARIANTS) + ["none"],
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        if args.child != "none":
+            build(VARIANTS[args.child], "all")
+        return
+
+    print "collection construction (in a running process):"
+    for use_views in ["none", "one", "all"]:
+        for variant in sorted(VARIANTS):
+            cost = construction_cost(VARIANTS[variant], use_views,
+                                     args.collections)
+            print "  %-8s using %-4s views: %8.1f us" % (variant, use_views,
+                                                         cost * 1e6)
+
+    print "process start, shell without IPython:"
+    variants = ["none"] + sorted(VARIANTS)
+    costs = startup_costs(variants, args.runs)
+    for variant in variants:
+        cost = costs[variant]
+        label = "imports only" if variant == "none" else variant
+        print "  %-12s %8.1f ms" % (label, cost * 1e3)
+
+
+if __name__ == "__main__":
+    main()
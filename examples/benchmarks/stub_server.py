@@ -0,0 +1,92 @@
+#!/usr/bin/python
+"""
+Local stand-in for a Lastline manager, used by the benchmarks.
+
+Every request is answered after `latency` seconds with a successful PAPI
+JSON response, so the benchmarks measure client behaviour and not the
+performance of a real manager.
+"""
+import BaseHTTPServer
+import SocketServer
+import json
+import threading
+import time
+import urlparse
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # keep-alive, so that connection reuse can be measured
+    protocol_version = "HTTP/1.1"
+    # send headers and body in one packet instead of tripping over
+    # Nagle/delayed ACK on every response
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def __reply(self):
+        length = int(self.headers.getheader("content-length") or 0)
+        if length:
+            self.rfile.read(length)
+
+        path = urlparse.urlparse(self.path).path
+        if not path.endswith("/login"):
+            time.sleep(self.server.latency)
+        self.server.count(path)
+
+        body = json.dumps({"success": 1, "data": self.server.data_for(path)})
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Set-Cookie", "PHPSESSID=stub; Path=/")
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = __reply
+    do_POST = __reply
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Threaded stub server on a free local port.
+
+    :param latency: seconds to wait before answering an API call
+    :param responses: dict mapping a path suffix such as "ip/get.json" to
+        the data returned for it
+    """
+    daemon_threads = True
+    request_queue_size = 128
+    allow_reuse_address = True
+
+    def __init__(self, latency=0.02, responses=None):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0),
+                                           StubHandler)
+        self.latency = latency
+        self.responses = responses or {}
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def url(self):
+        return "http://127.0.0.1:%d/papi" % self.server_address[1]
+
+    def count(self, path):
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def data_for(self, path):
+        for suffix, data in self.responses.items():
+            if path.endswith(suffix):
+                return data
+        return {}
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,217 @@
+#!/usr/bin/python
+"""
+Unit tests for waiting for appliance actions
+"""
+import threading
+import unittest
+
+from papi_client import actions
+from papi_client import papi_client
+from papi_client.api import appliance_mgmt
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TimedApplianceMgmt(object):
+    """
+    Actions complete `duration` seconds after they were added
+    """
+    def __init__(self, clock, duration):
+        self.clock = clock
+        self.duration = duration
+        self.started = {}
+        self.status_requests = 0
+
+    def get_action_status(self, action_uuid, user_id=None):
+        self.status_requests += 1
+        if self.clock.time() - self.started[action_uuid] < self.duration:
+            return {"status": "RUNNING"}
+        return {"status": "SUCCESS"}
+
+
+class CountingApplianceMgmt(object):
+    """
+    Actions complete after `polls` status requests with the outcome
+    configured for them
+    """
+    def __init__(self, polls=3, outcomes=None):
+        self.polls = polls
+        self.outcomes = outcomes or {}
+        self.requests = {}
+        self.lock = threading.Lock()
+
+    def get_action_status(self, action_uuid, user_id=None):
+        with self.lock:
+            key = (user_id, action_uuid)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            if self.requests[key] < self.polls:
+                return {"status": "RUNNING"}
+        outcome = self.outcomes.get(action_uuid, "SUCCESS")
+        if outcome == "UNREACHABLE":
+            raise papi_client.CommunicationError("timed out")
+        return {"status": outcome}
+
+    def total(self):
+        with self.lock:
+            return sum(self.requests.values())
+
+
+class TestActionOutcome(unittest.TestCase):
+
+    def test_outcomes(self):
+        self.assertEqual(actions.action_outcome({"status": "done"}),
+                         actions.SUCCEEDED)
+        self.assertEqual(actions.action_outcome({"state": "ERROR"}),
+                         actions.FAILED)
+        self.assertEqual(actions.action_outcome("QUEUED"), actions.PENDING)
+        self.assertEqual(actions.action_outcome(None), actions.PENDING)
+        self.assertEqual(actions.action_uuid_of("UUID"), "UUID")
+        self.assertEqual(actions.action_uuid_of({"action_uuid": "U"}), "U")
+        with self.assertRaises(actions.Error):
+            actions.action_uuid_of({"success": 1})
+
+
+class TestActionPoller(unittest.TestCase):
+
+    def test_shared_adaptive_polling(self):
+        clock = FakeClock()
+        api = TimedApplianceMgmt(clock, duration=600)
+        poller = actions.ActionPoller(api, min_interval=2, max_interval=60,
+                                      backoff=0.25, clock=clock.time,
+                                      sleep=clock.sleep)
+        done = []
+        for i in range(50):
+            api.started["action-%d" % i] = clock.time()
+            poller.add("action-%d" % i, lambda *args: done.append(args[:2]),
+                       user_id=i % 3)
+        poller.wait()
+
+        self.assertEqual(len(done), 50)
+        self.assertEqual(set(outcome for _, outcome in done),
+                         set([actions.SUCCEEDED]))
+        # one sleep per round for all actions, which get rarer with age:
+        # polling every 2 seconds would take 300 rounds
+        polls_per_action = api.status_requests / 50
+        self.assertEqual(api.status_requests, polls_per_action * 50)
+        self.assertTrue(polls_per_action < 30, polls_per_action)
+        self.assertEqual(len(clock.sleeps), polls_per_action)
+        self.assertEqual(max(clock.sleeps), 60)
+        self.assertEqual(poller.requests(), api.status_requests)
+        self.assertEqual(poller.pending(), 0)
+
+    def test_intervals(self):
+        poller = actions.ActionPoller(None, min_interval=2, max_interval=60,
+                                      backoff=0.5)
+        self.assertEqual(poller.interval(0), 2)
+        self.assertEqual(poller.interval(10), 5)
+        self.assertEqual(poller.interval(1000), 60)
+        with self.assertRaises(papi_client.InvalidArgument):
+            actions.ActionPoller(None, min_interval=0)
+
+
+class TestActionTracker(unittest.TestCase):
+
+    def tracker(self, api, **kwargs):
+        kwargs.setdefault("min_interval", 0.001)
+        kwargs.setdefault("max_interval", 0.005)
+        tracker = actions.ActionTracker(api, **kwargs)
+        self.addCleanup(tracker.close)
+        return tracker
+
+    def test_waiters_share_requests(self):
+        api = CountingApplianceMgmt(polls=3)
+        tracker = self.tracker(api)
+        futures = [tracker.track("action-%d" % (i % 5), user_id=i % 2)
+                   for i in range(200)]
+        for future in futures:
+            self.assertEqual(future.result(timeout=5), {"status": "SUCCESS"})
+
+        # 5 actions of 2 users, each polled until it completed
+        self.assertEqual(len(api.requests), 10)
+        self.assertEqual(api.total(), 10 * 3)
+        self.assertEqual(tracker.requests(), 30)
+        self.assertEqual(tracker.pending(), 0)
+
+        # new waiters for a completed action poll again
+        self.assertEqual(tracker.track("action-0", user_id=0).result(5),
+                         {"status": "SUCCESS"})
+
+    def test_callbacks_and_failures(self):
+        api = CountingApplianceMgmt(polls=2, outcomes={"bad": "FAILED"})
+        tracker = self.tracker(api)
+        done = threading.Event()
+        seen = []
+
+        def callback(future):
+            seen.append(future.exception())
+            done.set()
+
+        def broken_callback(future):
+            raise ValueError("bug")
+
+        future = tracker.track("bad", callback=callback)
+        tracker.track("good", callback=broken_callback)
+        self.assertTrue(done.wait(5))
+        self.assertTrue(isinstance(seen[0], actions.ActionFailed))
+        with self.assertRaises(actions.ActionFailed):
+            future.result()
+        # the poller survived the broken callback
+        self.assertEqual(tracker.track("other").result(timeout=5),
+                         {"status": "SUCCESS"})
+
+    def test_timeout(self):
+        api = CountingApplianceMgmt(polls=1, outcomes={"a": "UNREACHABLE"})
+        tracker = self.tracker(api, timeout=0.02)
+        error = tracker.track("a").exception(timeout=5)
+        self.assertTrue(isinstance(error, actions.ActionTimeout))
+        self.assertIn("timed out", str(error))
+
+    def test_close(self):
+        api = CountingApplianceMgmt(polls=10 ** 6)
+        tracker = self.tracker(api)
+        future = tracker.track("a")
+        tracker.close()
+        self.assertTrue(isinstance(future.exception(timeout=5),
+                                   actions.TrackerClosed))
+        with self.assertRaises(actions.TrackerClosed):
+            tracker.track("b")
+
+
+class FakeBaseClient(object):
+    def __init__(self):
+        self.requests = []
+
+    def do_request(self, method, module, function, params=None, fmt="JSON",
+                   raw=False):
+        self.requests.append((function, params))
+        return {"status": "DONE"}
+
+
+class TestViewTracking(unittest.TestCase):
+
+    def test_track_action(self):
+        base_client = FakeBaseClient()
+        view = appliance_mgmt.PapiClientApplianceMgmt(base_client)
+        view.set_action_tracker(actions.ActionTracker(view,
+                                                      min_interval=0.001))
+        self.addCleanup(view.action_tracker().close)
+
+        result = view.track_action("A" * 32, user_id=3).result(timeout=5)
+        self.assertEqual(result, {"status": "DONE"})
+        self.assertEqual(base_client.requests, [
+            ("action/status", {"action_uuid": "A" * 32, "user_id": 3})])
+
+
+if __name__ == "__main__":
+    exit(unittest.main())
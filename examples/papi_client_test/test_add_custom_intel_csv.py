@@ -0,0 +1,68 @@
+#!/usr/bin/python
+"""
+Unit tests for the pipeline of CSV intel imports
+"""
+import argparse
+import StringIO
+import unittest
+
+from add_custom_intel_csv import CSVFormat, parse_entries
+from papi_client import reconcile
+
+
+def import_args(**kwargs):
+    args = dict(row_validation=False, delete_missing=False, impact=None,
+                source=None, comment=None, limit=None)
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+class TestParseEntries(unittest.TestCase):
+
+    def setUp(self):
+        self.csv_format = CSVFormat.from_format_string("DOMAIN,IMPACT")
+        # latin-1 encoded, which the batch validator rejects
+        self.rejected = "b\xfcro.example.com"
+        self.feed_diff = reconcile.FeedDiff("domain", {
+            "kept.example.com": {"domain": "kept.example.com", "impact": 50},
+            "gone.example.com": {"domain": "gone.example.com", "impact": 50},
+            self.rejected: {"domain": self.rejected, "impact": 50},
+        })
+        self.csv_file = StringIO.StringIO(
+            "kept.example.com,50\n"
+            "%s,50\n"
+            "new.example.com,50\n" % self.rejected)
+
+    def entries(self, **kwargs):
+        stats = {"invalid": 0, "duplicates": 0}
+        entries = parse_entries(self.csv_format, self.csv_file,
+                                import_args(**kwargs), 0, stats,
+                                self.feed_diff)
+        return [entry["domain"] for _line_num, entry in entries], stats
+
+    def test_delete_missing_keeps_rejected_lines(self):
+        sent, stats = self.entries(delete_missing=True)
+        self.assertEqual(sent, ["new.example.com"])
+        self.assertEqual(stats["invalid"], 1)
+        self.assertEqual(self.feed_diff.deletions(), ["gone.example.com"])
+
+    def test_rejected_lines_only_kept_for_delete_missing(self):
+        self.entries()
+        self.assertEqual(self.feed_diff.deletions(),
+                         sorted(["gone.example.com", self.rejected]))
+
+    def test_keep_before_validation(self):
+        csv_format = CSVFormat.from_format_string("IP")
+        for parse in (csv_format.parse_csv_numbered,
+                      csv_format.parse_csv_batched):
+            kept = []
+            entries = list(parse(StringIO.StringIO("10.0.0.1\n10.0.0.2x\n"),
+                                 keep=kept.append))
+            self.assertEqual([entry.ip if entry else None
+                              for _line_num, entry in entries],
+                             ["10.0.0.1", None])
+            self.assertEqual(kept, ["10.0.0.1", "10.0.0.2x"])
+
+
+if __name__ == "__main__":
+    exit(unittest.main())
@@ -0,0 +1,116 @@
+#!/usr/bin/python
+"""
+Unit tests for the worker pool and the concurrent client
+"""
+import threading
+import unittest
+
+from papi_client import async_client
+from papi_client import papi_client
+from papi_client import workers
+from papi_client.api import intel
+
+
+class FakeClient(object):
+    """
+    Stands in for a PapiClient and records requests
+    """
+    def __init__(self):
+        self.logins = 0
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def is_logged_in(self):
+        return self.logins > 0
+
+    def login(self, raw=False):
+        with self.lock:
+            self.logins += 1
+
+    def do_request(self, method, module, function, params=None, data=None,
+                   files=None, url=None, fmt="JSON", raw=False, stream=False,
+                   output=None, chunk_size=None, resume=True):
+        with self.lock:
+            self.requests.append((method, module, function, params))
+        if function == "ip/fail":
+            raise papi_client.ApiError("failed", 4711)
+        return params
+
+
+class TestWorkers(unittest.TestCase):
+
+    def test_map_keeps_order(self):
+        with workers.WorkerPool(workers=4) as pool:
+            self.assertEqual(pool.map(lambda x: x * 2, range(20)),
+                             range(0, 40, 2))
+
+    def test_exception_reraised(self):
+        with workers.WorkerPool(workers=1) as pool:
+            future = pool.submit(int, "not a number")
+        self.assertIsInstance(future.exception(), ValueError)
+        with self.assertRaises(ValueError):
+            future.result()
+
+    def test_timeout(self):
+        event = threading.Event()
+        with workers.WorkerPool(workers=1) as pool:
+            future = pool.submit(event.wait)
+            with self.assertRaises(workers.TimeoutError):
+                future.result(timeout=0.01)
+            event.set()
+        self.assertTrue(future.done())
+
+    def test_callback(self):
+        done = []
+        future = workers.Future()
+        future.add_done_callback(lambda f: done.append(f.result()))
+        future.set_result(3)
+        future.add_done_callback(lambda f: done.append(f.result()))
+        self.assertEqual(done, [3, 3])
+
+    def test_fan_out(self):
+        futures = workers.fan_out(lambda x: x + 1, [1, 2, 3], concurrency=2)
+        self.assertEqual([f.result() for f in futures], [2, 3, 4])
+
+    def test_submit_after_shutdown(self):
+        pool = workers.WorkerPool(workers=1)
+        pool.shutdown()
+        with self.assertRaises(workers.PoolShutdown):
+            pool.submit(int, "1")
+
+
+class TestAsyncPapiClient(unittest.TestCase):
+
+    def setUp(self):
+        self.base_client = FakeClient()
+        self.client = async_client.AsyncPapiClient(self.base_client,
+                                                   concurrency=4)
+        self.intel = intel.PapiClientIntel(self.client)
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_view_returns_futures(self):
+        futures = [self.intel.get_ip("10.0.0.%d" % i) for i in range(10)]
+        results = [f.result() for f in futures]
+        self.assertEqual([r["ip"] for r in results],
+                         ["10.0.0.%d" % i for i in range(10)])
+        self.assertEqual(self.base_client.logins, 1)
+        self.assertEqual(len(self.base_client.requests), 10)
+
+    def test_key_params(self):
+        result = self.intel.list_ip(key="LICENSE").result()
+        self.assertEqual(result, {"key": "LICENSE"})
+
+    def test_error(self):
+        future = self.client.do_request("GET", "intel", "ip/fail")
+        with self.assertRaises(papi_client.ApiError):
+            future.result()
+
+    def test_map(self):
+        futures = self.client.map(lambda x: x * 2, [1, 2])
+        self.assertEqual([f.result() for f in futures], [2, 4])
+
+
+if __name__ == "__main__":
+    exit(unittest.main())
@@ -0,0 +1,106 @@
+#!/usr/bin/python
+"""
+Unit tests for circuit breakers
+"""
+import unittest
+
+import requests
+
+from papi_client import breaker
+from papi_client import papi_client
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FailingSession(object):
+    """
+    Fails every request with a connection error
+    """
+    def __init__(self):
+        self.requests = 0
+        self.cookies = requests.cookies.RequestsCookieJar()
+        self.headers = {}
+
+    def request(self, method, url, **kwargs):
+        self.requests += 1
+        raise requests.ConnectionError("connection refused")
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.breaker = breaker.CircuitBreaker("test", failure_threshold=3,
+                                              reset_timeout=30,
+                                              clock=self.clock)
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state(), breaker.CLOSED)
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state(), breaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.retry_in(), 30)
+
+    def test_half_open_probe(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state(), breaker.HALF_OPEN)
+        # only one probe at a time
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state(), breaker.OPEN)
+
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state(), breaker.CLOSED)
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.stats()["opened"], 2)
+
+    def test_registry(self):
+        first = breaker.get_breaker("https://registry-test", reset_timeout=5)
+        self.assertIs(breaker.get_breaker("https://registry-test"), first)
+        self.assertIn("https://registry-test", breaker.breakers())
+
+
+class TestClientFailsFast(unittest.TestCase):
+
+    def setUp(self):
+        self.session_factory = requests.session
+        self.session = FailingSession()
+        requests.session = lambda: self.session
+
+    def tearDown(self):
+        requests.session = self.session_factory
+
+    def test_fail_fast(self):
+        circuit = breaker.CircuitBreaker("test", failure_threshold=2)
+        c = papi_client.PapiClient(
+            url="https://non-reachable-test-url",
+            login_params={"username": "test", "password": "test1234"},
+            circuit_breaker=circuit)
+
+        for _ in range(2):
+            with self.assertRaises(papi_client.CommunicationError):
+                c.login()
+        self.assertTrue(circuit.is_open())
+        with self.assertRaises(papi_client.CircuitOpenError):
+            c.ping()
+        self.assertEqual(self.session.requests, 2)
+
+
+if __name__ == "__main__":
+    exit(unittest.main())
@@ -0,0 +1,121 @@
+#!/usr/bin/python
+"""
+Unit tests for the bulk uploader
+"""
+import threading
+import unittest
+
+from papi_client import bulk
+from papi_client import papi_client
+
+
+class FakeIntel(object):
+    """
+    Stands in for a PapiClientIntel and records the batches it receives
+    """
+    def __init__(self, failures=None):
+        self.calls = []
+        self.lock = threading.Lock()
+        # first entry of a batch (as str) -> number of times to fail it
+        self.failures = failures or {}
+
+    def __record(self, function, batch, key):
+        with self.lock:
+            self.calls.append((function, list(batch), key))
+            first = str(batch[0])
+            remaining = self.failures.get(first, 0)
+            if remaining:
+                self.failures[first] = remaining - 1
+                raise papi_client.CommunicationError("timeout")
+        return {"count": len(batch)}
+
+    def add_ip(self, entries, key=None):
+        return self.__record("add_ip", entries, key)
+
+    def delete_domain(self, domains, key=None):
+        return self.__record("delete_domain", domains, key)
+
+    def add_ids_rule(self, entries, key=None):
+        if entries[0].get("rule") == "bad":
+            raise papi_client.ApiError("invalid rule", 4711)
+        if entries[0].get("rule") == "crash":
+            raise TypeError("unexpected entry")
+        return self.__record("add_ids_rule", entries, key)
+
+
+class TestBulkUploader(unittest.TestCase):
+
+    def test_batches_by_count(self):
+        view = FakeIntel()
+        uploader = bulk.BulkUploader(view, max_entries=3, workers=2,
+                                     retry_delay=0)
+        entries = [{"ip": "10.0.0.%d" % i} for i in range(10)]
+        report = uploader.add_ip(iter(entries), key="KEY")
+
+        self.assertTrue(report.ok())
+        self.assertEqual([len(c[1]) for c in sorted(view.calls)],
+                         [3, 3, 3, 1])
+        self.assertTrue(all(c[2] == "KEY" for c in view.calls))
+        summary = report.summary()
+        self.assertEqual(summary["batches"], 4)
+        self.assertEqual(summary["entries"], 10)
+        self.assertEqual([r.first for r in report.results()], [0, 3, 6, 9])
+
+    def test_batches_by_size(self):
+        uploader = bulk.BulkUploader(FakeIntel(), max_entries=100,
+                                     max_bytes=10)
+        batches = list(uploader.batches(["aaaa", "bbbb", "cccccccccccc", "d"],
+                                        bulk.csv_size))
+        self.assertEqual([b.entries for b in batches],
+                         [["aaaa", "bbbb"], ["cccccccccccc"], ["d"]])
+
+    def test_retry_only_failed_batch(self):
+        view = FakeIntel(failures={"c": 1})
+        uploader = bulk.BulkUploader(view, max_entries=2, workers=2,
+                                     retry_delay=0)
+        report = uploader.delete_domain(["a", "b", "c", "d", "e"])
+
+        self.assertTrue(report.ok())
+        sent = [c[1][0] for c in view.calls]
+        self.assertEqual(sorted(sent), ["a", "c", "c", "e"])
+        self.assertEqual([r.attempts for r in report.results()], [1, 2, 1])
+        self.assertEqual(report.summary()["retries"], 1)
+
+    def test_failed_batch_reported(self):
+        view = FakeIntel(failures={"c": 5})
+        progress = []
+        uploader = bulk.BulkUploader(view, max_entries=2, max_attempts=2,
+                                     retry_delay=0, progress=progress.append)
+        report = uploader.delete_domain(["a", "b", "c", "d"])
+
+        self.assertFalse(report.ok())
+        self.assertEqual(report.failed_entries(), ["c", "d"])
+        self.assertEqual(len(progress), 2)
+        self.assertIsInstance(report.failed()[0].error,
+                              papi_client.CommunicationError)
+
+    def test_api_error_not_retried(self):
+        uploader = bulk.BulkUploader(FakeIntel(), max_entries=1,
+                                     retry_delay=0)
+        report = uploader.add_ids_rule([{"rule": "ok"}, {"rule": "bad"}])
+        self.assertEqual([r.attempts for r in report.results()], [1, 1])
+        self.assertEqual(report.failed_entries(), [{"rule": "bad"}])
+
+    def test_unexpected_error_reported(self):
+        uploader = bulk.BulkUploader(FakeIntel(), max_entries=1, workers=2,
+                                     retry_delay=0)
+        rules = [{"rule": "crash"}, {"rule": "ok"}, {"rule": "crash"}]
+        report = uploader.add_ids_rule(rules)
+        self.assertFalse(report.ok())
+        self.assertEqual(report.summary()["batches"], 3)
+        self.assertEqual([r.index for r in report.failed()], [0, 2])
+        self.assertIsInstance(report.failed()[1].error, TypeError)
+
+    def test_empty(self):
+        report = bulk.BulkUploader(FakeIntel()).add_ip([])
+        self.assertTrue(report.ok())
+        self.assertEqual(report.summary()["batches"], 0)
+
+
+if __name__ == "__main__":
+    exit(unittest.main())
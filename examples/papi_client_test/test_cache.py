@@ -0,0 +1,155 @@
+#!/usr/bin/python
+"""
+Unit tests for the response cache
+"""
+import shutil
+import tempfile
+import time
+import unittest
+
+from papi_client import async_client
+from papi_client import cache
+from papi_client import loader
+from papi_client import papi_client
+from papi_client import workers
+
+
+class CountingClient(object):
+    """
+    Stands in for a PapiClient, counting requests per function
+    """
+    def __init__(self):
+        self.calls = []
+
+    def do_request(self, method, module, function, params=None, data=None,
+                   files=None, url=None, fmt="JSON", raw=False, stream=False,
+                   output=None, chunk_size=None, resume=True):
+        self.calls.append(function)
+        if function == "ip/fail":
+            raise papi_client.ApiError("failed", 4711)
+        return {"function": function, "params": params,
+                "count": len(self.calls)}
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.client = CountingClient()
+        self.cache = cache.ResponseCache(cache.LRUCache())
+        collection = loader.PapiClientCollection(self.client, None,
+                                                  cache=self.cache)
+        collection.load_view("intel")
+        collection.load_view("appliance_mgmt")
+        self.intel = collection.intel
+        self.appliance_mgmt = collection.appliance_mgmt
+
+    def test_read_cached(self):
+        first = self.intel.list_ip(key="A")
+        self.assertEqual(self.intel.list_ip(key="A"), first)
+        self.assertEqual(self.client.calls, ["ip/list"])
+        self.intel.list_ip(key="B")
+        self.assertEqual(len(self.client.calls), 2)
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    def test_uncached_function(self):
+        self.intel.feed_ip()
+        self.intel.feed_ip()
+        self.assertEqual(self.client.calls, ["ip/feed", "ip/feed"])
+
+    def test_write_invalidates_scope(self):
+        self.intel.list_ip(key="A")
+        self.intel.list_ip(key="B")
+        self.intel.add_ip([{"ip": "10.0.0.1"}], key="A")
+        self.intel.list_ip(key="A")
+        self.intel.list_ip(key="B")
+        self.assertEqual(self.client.calls,
+                         ["ip/list", "ip/list", "ip/add", "ip/list"])
+
+    def test_write_invalidates_unscoped_reads(self):
+        self.intel.get_ip("10.0.0.1", key="A", inherit_scope=True)
+        self.appliance_mgmt.get_overview()
+        self.intel.delete_ip(["10.0.0.1"], key="B")
+        self.intel.get_ip("10.0.0.1", key="A", inherit_scope=True)
+        self.appliance_mgmt.get_overview()
+        self.assertEqual(self.client.calls.count("ip/get"), 2)
+        self.assertEqual(self.client.calls.count("overview"), 1)
+
+    def test_cached_value_is_a_copy(self):
+        self.intel.list_ip()["count"] = 4711
+        self.assertEqual(self.intel.list_ip()["count"], 1)
+
+    def test_ttl(self):
+        self.cache.set_ttl("intel", "ip/list", 0.01)
+        self.intel.list_ip()
+        time.sleep(0.02)
+        self.intel.list_ip()
+        self.assertEqual(self.client.calls, ["ip/list", "ip/list"])
+
+    def test_lru_eviction(self):
+        lru = cache.LRUCache(max_entries=2)
+        lru.set("a", 1, 60)
+        lru.set("b", 2, 60)
+        lru.get("a")
+        lru.set("c", 3, 60)
+        self.assertEqual(lru.get("b"), (False, None))
+        self.assertEqual(lru.get("a"), (True, 1))
+
+        # replacing an entry makes it the most recently used one
+        lru.set("c", 4, 60)
+        lru.set("d", 5, 60)
+        self.assertEqual(lru.get("a"), (False, None))
+        self.assertEqual(lru.get("c"), (True, 4))
+        self.assertEqual(len(lru), 2)
+        lru.clear()
+        self.assertEqual(len(lru), 0)
+        lru.set("e", 6, 60)
+        self.assertEqual(lru.get("e"), (True, 6))
+
+    def test_async_hits_are_futures(self):
+        self.client.is_logged_in = lambda: True
+        base_client = async_client.AsyncPapiClient(self.client, concurrency=2)
+        self.addCleanup(base_client.close)
+        collection = loader.PapiClientCollection(base_client, None,
+                                                  cache=self.cache)
+        collection.load_view("intel")
+
+        miss = collection.intel.list_ip(key="A")
+        first = miss.result(timeout=5)
+        # the response is stored by a callback of the Future
+        while not self.cache.stats()["stores"]:
+            time.sleep(0.001)
+        hit = collection.intel.list_ip(key="A")
+        self.assertTrue(isinstance(hit, workers.Future))
+        self.assertEqual(hit.result(timeout=5), first)
+        self.assertEqual(self.client.calls, ["ip/list"])
+
+
+class TestFileCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_shared_between_instances(self):
+        first = cache.FileCache(self.directory)
+        second = cache.FileCache(self.directory)
+        first.set("key", {"a": [1, 2]}, 60)
+        self.assertEqual(second.get("key"), (True, {"a": [1, 2]}))
+
+        token = first.generation("intel|A")
+        self.assertEqual(second.generation("intel|A"), token)
+        second.bump("intel|A")
+        self.assertNotEqual(first.generation("intel|A"), token)
+
+    def test_prune(self):
+        file_cache = cache.FileCache(self.directory)
+        file_cache.set("old", 1, -1)
+        file_cache.set("new", 2, 60)
+        self.assertEqual(file_cache.prune(), 1)
+        self.assertEqual(file_cache.get("new"), (True, 2))
+
+
+if __name__ == "__main__":
+    exit(unittest.main())
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+"""
+Unit tests for the checkpoint of resumable CSV intel imports
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from add_custom_intel_csv import Checkpoint
+from papi_client import bulk
+
+
+def batch_result(index, first, count, error=None):
+    batch = bulk.Batch(index, first, range(count), count)
+    return bulk.BatchResult(batch, 1, 0, error=error)
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "import.checkpoint")
+        self.input_file = os.path.join(self.directory, "feed.csv")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def checkpoint(self, lines=12):
+        """
+        Checkpoint which tracked `lines` entries, on every other input line
+        """
+        checkpoint = Checkpoint(self.path, self.input_file)
+        numbered = [(2 * position + 1, "entry") for position in range(lines)]
+        self.assertEqual(len(list(checkpoint.track(numbered))), lines)
+        return checkpoint
+
+    def saved(self):
+        with open(self.path) as f:
+            return json.load(f)
+
+    def test_out_of_order(self):
+        checkpoint = self.checkpoint()
+        checkpoint.batch_done(batch_result(1, 4, 4))
+        checkpoint.batch_done(batch_result(2, 8, 4))
+        self.assertEqual(checkpoint.line, 0)
+        self.assertFalse(os.path.exists(self.path))
+
+        checkpoint.batch_done(batch_result(0, 0, 4))
+        # entry 11 is on line 23
+        self.assertEqual(checkpoint.line, 23)
+        self.assertEqual(self.saved(), {"input": self.input_file,
+                                        "line": 23})
+        self.assertEqual(checkpoint.uploaded, 12)
+        self.assertEqual(checkpoint._lines, {})  # pylint: disable=W0212
+        self.assertEqual(checkpoint._done, {})  # pylint: disable=W0212
+
+    def test_failed_batch(self):
+        checkpoint = self.checkpoint()
+        checkpoint.batch_done(batch_result(2, 8, 4))
+        checkpoint.batch_done(batch_result(1, 4, 4, error=ValueError("bad")))
+        checkpoint.batch_done(batch_result(0, 0, 4))
+        self.assertEqual(checkpoint.line, 7)
+        self.assertEqual((checkpoint.uploaded, checkpoint.failed), (8, 4))
+
+        # nothing after the failed batch is kept any more
+        more = [(100 + position, "entry") for position in range(4)]
+        self.assertEqual(len(list(checkpoint.track(more))), 4)
+        checkpoint.batch_done(batch_result(3, 12, 4))
+        self.assertEqual(checkpoint.line, 7)
+        self.assertEqual(checkpoint._lines, {})  # pylint: disable=W0212
+        self.assertEqual(checkpoint._done, {})  # pylint: disable=W0212
+        self.assertEqual(self.saved()["line"], 7)
+
+    def test_resume(self):
+        checkpoint = self.checkpoint()
+        checkpoint.batch_done(batch_result(0, 0, 4))
+        self.assertEqual(Checkpoint(self.path, self.input_file).load(), 7)
+        # checkpoints of other inputs are ignored
+        other = os.path.join(self.directory, "other.csv")
+        self.assertEqual(Checkpoint(self.path, other).load(), 0)
+        self.assertEqual(Checkpoint(None, self.input_file).load(), 0)
+
+
+if __name__ == "__main__":
+    exit(unittest.main())
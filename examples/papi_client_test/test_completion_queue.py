@@ -0,0 +1,179 @@
+#!/usr/bin/python
+"""
+Unit tests for the analysis_completed notification queue
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from papi_client import completion_queue
+from papi_client import metrics
+from papi_client import papi_client
+
+
+class FakePostprocessing(object):
+    """
+    Records analysis_completed() calls; failures are consumed per uuid
+    """
+    def __init__(self):
+        self.sent = []
+        self.failures = {}
+        self.gate = None
+        self.lock = threading.Lock()
+
+    def analysis_completed(self, uuid, score, licenses, raw=False):
+        if self.gate is not None:
+            self.gate.wait()
+        with self.lock:
+            failures = self.failures.get(uuid)
+            if failures:
+                raise failures.pop(0)
+            self.sent.append((uuid, score, licenses))
+
+
+class TestCompletionQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.view = FakePostprocessing()
+        self.registry = metrics.MetricsRegistry()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def queue(self, **kwargs):
+        kwargs.setdefault("workers", 2)
+        kwargs.setdefault("retry_delay", 0.001)
+        queue = completion_queue.CompletionQueue(
+            self.view, self.directory, registry=self.registry, **kwargs)
+        self.addCleanup(queue.close)
+        return queue
+
+    def journal(self):
+        with open(os.path.join(self.directory,
+                               completion_queue.JOURNAL_FILE)) as f:
+            return f.read().splitlines()
+
+    def test_send(self):
+        queue = self.queue()
+        for i in range(20):
+            queue.put("task-%d" % i, i, ["b", "a"])
+        self.assertTrue(queue.flush(timeout=5))
+
+        self.assertEqual(sorted(self.view.sent),
+                         sorted(("task-%d" % i, i, ["a", "b"])
+                                for i in range(20)))
+        stats = queue.stats()
+        self.assertEqual((stats["sent"], stats["queued"], stats["in_flight"]),
+                         (20, 0, 0))
+        self.assertEqual(self.registry.get(
+            "papi_completion_queue_sent_total").value(), 20)
+        self.assertEqual(self.registry.get(
+            "papi_completion_queue_lag_seconds").value()["count"], 20)
+
+    def test_coalesce_rescores(self):
+        queue = self.queue(start=False)
+        queue.put("task", 10, ["a"])
+        queue.put("other", 0, ["a"])
+        queue.put("task", 70, ["a"])
+        queue.put("task", 40, ["a", "b"])
+        queue.start()
+        self.assertTrue(queue.flush(timeout=5))
+
+        self.assertEqual(sorted(self.view.sent),
+                         [("other", 0, ["a"]), ("task", 40, ["a", "b"])])
+        self.assertEqual(queue.stats()["coalesced"], 2)
+        self.assertEqual(self.registry.get(
+            "papi_completion_queue_enqueued_total").value(), 4)
+
+    def test_rescore_while_sending(self):
+        self.view.gate = threading.Event()
+        queue = self.queue(workers=1)
+        queue.put("task", 10, ["a"])
+        while not queue.stats()["in_flight"]:
+            time.sleep(0.001)
+        queue.put("task", 90, ["a"])
+        self.view.gate.set()
+        self.assertTrue(queue.flush(timeout=5))
+        self.assertEqual(self.view.sent, [("task", 10, ["a"]),
+                                          ("task", 90, ["a"])])
+
+    def test_resume_from_journal(self):
+        queue = self.queue(start=False)
+        queue.put("task-1", 10, ["a"])
+        queue.put("task-2", 20, ["a"])
+        queue.put("task-1", 30, ["a"])
+        queue.close()
+        # a process dying in the middle of a write
+        with open(os.path.join(self.directory,
+                               completion_queue.JOURNAL_FILE), "a") as f:
+            f.write('{"seq": 4, "uu')
+
+        queue = self.queue()
+        self.assertTrue(queue.flush(timeout=5))
+        self.assertEqual(self.view.sent, [("task-2", 20, ["a"]),
+                                          ("task-1", 30, ["a"])])
+        queue.close()
+
+        # nothing is sent again
+        self.view.sent = []
+        queue = self.queue()
+        self.assertTrue(queue.flush(timeout=5))
+        self.assertEqual(self.view.sent, [])
+        self.assertEqual(self.journal(), [])
+
+    def test_retry(self):
+        self.view.failures["task"] = [papi_client.CommunicationError("down"),
+                                      papi_client.CommunicationError("down")]
+        self.view.failures["unknown"] = [papi_client.ApiError("no such task")]
+        queue = self.queue()
+        queue.put("task", 10, ["a"])
+        queue.put("unknown", 10, ["a"])
+        self.assertTrue(queue.flush(timeout=5))
+
+        self.assertEqual(self.view.sent, [("task", 10, ["a"])])
+        self.assertEqual(queue.stats()["failed"], 1)
+        self.assertEqual(self.registry.get(
+            "papi_completion_queue_retries_total").value(), 2)
+        self.assertEqual(self.registry.get(
+            "papi_completion_queue_failed_total").value(), 1)
+
+    def test_unexpected_error(self):
+        self.view.failures["task"] = [TypeError("bug")]
+        queue = self.queue(workers=1)
+        queue.put("task", 10, ["a"])
+        queue.put("other", 20, ["a"])
+        self.assertTrue(queue.flush(timeout=5))
+        # the sender survived and sent the next notification
+        self.assertEqual(self.view.sent, [("other", 20, ["a"])])
+        self.assertEqual((queue.stats()["failed"], queue.stats()["in_flight"]),
+                         (1, 0))
+
+    def test_max_attempts(self):
+        self.view.failures["task"] = [
+            papi_client.CommunicationError("down") for _ in range(3)]
+        queue = self.queue(max_attempts=2)
+        queue.put("task", 10, ["a"])
+        self.assertTrue(queue.flush(timeout=5))
+        self.assertEqual(self.view.sent, [])
+        self.assertEqual(queue.stats()["failed"], 1)
+
+    def test_compaction(self):
+        queue = self.queue(compact_after=10)
+        for i in range(30):
+            queue.put("task-%d" % i, 1, ["a"])
+        self.assertTrue(queue.flush(timeout=5))
+        self.assertTrue(len(self.journal()) < 20, len(self.journal()))
+
+    def test_closed(self):
+        queue = self.queue()
+        queue.close()
+        with self.assertRaises(completion_queue.QueueClosed):
+            queue.put("task", 1, [])
+
+
+if __name__ == "__main__":
+    exit(unittest.main())
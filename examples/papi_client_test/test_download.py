@@ -0,0 +1,182 @@
+#!/usr/bin/python
+"""
+Unit tests for streamed downloads
+"""
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+
+import requests
+
+from papi_client import async_client
+from papi_client import papi_client
+from papi_client import retry
+from papi_client.api import intel
+
+
+BODY = "".join(chr(ord("a") + i % 26) for i in range(1000))
+
+
+class FakeResponse(object):
+    """
+    Streams body in chunks, failing after break_after bytes
+    """
+    def __init__(self, body, status_code=200, headers=None, break_after=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+        self.break_after = break_after
+        self.closed = False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError("%d error" % self.status_code,
+                                     response=self)
+
+    @property
+    def content(self):
+        raise AssertionError("streamed body read at once")
+
+    def iter_content(self, chunk_size):
+        for offset in range(0, len(self.body), chunk_size):
+            if self.break_after is not None and offset >= self.break_after:
+                raise requests.ConnectionError("connection reset")
+            yield self.body[offset:offset + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+class LoginResponse(object):
+    status_code = 200
+    headers = {}
+    content = ""
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"success": 1, "data": None}
+
+
+class FakeSession(object):
+    """
+    Answers logins and returns the scripted responses for all other requests
+    """
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+        self.cookies = requests.cookies.RequestsCookieJar()
+        self.headers = {}
+
+    def request(self, method, url, **kwargs):
+        if url.endswith("/login"):
+            return LoginResponse()
+        self.requests.append(kwargs)
+        return self.responses.pop(0)
+
+
+class TestDownload(unittest.TestCase):
+
+    def setUp(self):
+        self.session_factory = requests.session
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        requests.session = self.session_factory
+        shutil.rmtree(self.directory)
+
+    def make_client(self, responses):
+        self.session = FakeSession(responses)
+        requests.session = lambda: self.session
+        return papi_client.PapiClient(
+            url="https://non-reachable-test-url",
+            login_params={"username": "test", "password": "test1234"},
+            retry_policy=retry.RetryPolicy(max_attempts=3))
+
+    def test_stream(self):
+        c = self.make_client([FakeResponse(BODY)])
+        chunks = list(c.do_request("GET", "report", "get", fmt="PDF",
+                                   raw=True, stream=True, chunk_size=128))
+        self.assertEqual(len(chunks), 8)
+        self.assertEqual("".join(chunks), BODY)
+        self.assertTrue(self.session.requests[0]["stream"])
+
+    def test_async_client(self):
+        c = self.make_client([FakeResponse(BODY), FakeResponse(BODY)])
+        client = async_client.AsyncPapiClient(c, concurrency=2)
+        self.addCleanup(client.close)
+        view = intel.PapiClientIntel(client)
+
+        path = os.path.join(self.directory, "feed.json")
+        # pylint: disable=W0212
+        self.assertEqual(view._download("ip/feed", output=path).result(5),
+                         len(BODY))
+        with open(path) as f:
+            self.assertEqual(f.read(), BODY)
+        chunks = view._download("ip/feed").result(5)
+        self.assertEqual("".join(chunks), BODY)
+        self.assertTrue(all(kwargs["stream"] for kwargs in
+                            self.session.requests))
+
+    def test_status_checked(self):
+        responses = [FakeResponse("", status_code=404) for _ in range(3)]
+        c = self.make_client(responses)
+        with self.assertRaises(papi_client.CommunicationError):
+            c.do_request("GET", "report", "get", fmt="PDF", raw=True,
+                         stream=True)
+        self.assertTrue(all(response.closed for response in responses))
+        with self.assertRaises(papi_client.InvalidArgument):
+            c.do_request("GET", "report", "get", stream=True)
+
+    def test_resume_with_range(self):
+        headers = {"ETag": '"v1"'}
+        c = self.make_client([
+            FakeResponse(BODY, headers=headers, break_after=300),
+            FakeResponse(BODY[384:], status_code=206,
+                         headers={"Content-Range": "bytes 384-999/1000"}),
+        ])
+        output = StringIO.StringIO()
+        written = c.do_request("GET", "report", "get", fmt="XML", raw=True,
+                               output=output, chunk_size=128)
+        self.assertEqual(written, 1000)
+        self.assertEqual(output.getvalue(), BODY)
+        self.assertEqual(self.session.requests[1]["headers"],
+                         {"Range": "bytes=384-", "If-Range": '"v1"'})
+
+    def test_resume_without_range_support(self):
+        headers = {"Last-Modified": "Thu, 01 Jan 2015 00:00:00 GMT"}
+        c = self.make_client([
+            FakeResponse(BODY, headers=headers, break_after=300),
+            FakeResponse(BODY, headers=headers),
+        ])
+        path = os.path.join(self.directory, "report.xml")
+        c.do_request("GET", "report", "get", fmt="XML", raw=True,
+                     output=path, chunk_size=128)
+        with open(path) as f:
+            self.assertEqual(f.read(), BODY)
+
+    def test_changed_while_resuming(self):
+        c = self.make_client([
+            FakeResponse(BODY, headers={"ETag": '"v1"'}, break_after=300),
+            FakeResponse(BODY.upper(), headers={"ETag": '"v2"'}),
+        ])
+        path = os.path.join(self.directory, "report.xml")
+        with self.assertRaises(papi_client.Error):
+            c.do_request("GET", "report", "get", fmt="XML", raw=True,
+                         output=path, chunk_size=128)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_no_resume_without_validator(self):
+        c = self.make_client([FakeResponse(BODY, break_after=300)])
+        chunks = c.do_request("GET", "report", "get", fmt="XML", raw=True,
+                              stream=True, chunk_size=128)
+        with self.assertRaises(papi_client.CommunicationError):
+            list(chunks)
+        self.assertEqual(len(self.session.requests), 1)
+
+
+if __name__ == "__main__":
+    exit(unittest.main())
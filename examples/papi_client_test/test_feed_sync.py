@@ -0,0 +1,116 @@
+#!/usr/bin/python
+"""
+Unit tests for the feed mirror
+"""
+import shutil
+import tempfile
+import unittest
+
+from papi_client import feed_sync
+from papi_client import papi_client
+
+
+class FakeIntel(object):
+    """
+    Returns queued feed responses and records the versions asked for
+    """
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.versions = []
+
+    def feed_ip(self, key=None, current_version=None):
+        self.versions.append(current_version)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def ip(address, impact=50):
+    return {"ip": address, "impact": impact}
+
+
+class TestFeedMirror(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.mirror = feed_sync.FeedMirror(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def addresses(self, mirror=None, key=None):
+        mirror = mirror or self.mirror
+        return sorted(e["ip"] for e in mirror.entries("ip", key))
+
+    def test_full_then_delta(self):
+        view = FakeIntel(
+            {"version": "v1", "entries": [ip("1.1.1.1"), ip("2.2.2.2")]},
+            {"version": "v2", "add": [ip("3.3.3.3")], "remove": ["1.1.1.1"]},
+            None,
+        )
+        self.mirror.sync(view, "ip")
+        self.mirror.sync(view, "ip")
+        state = self.mirror.sync(view, "ip")
+
+        self.assertEqual(view.versions, [None, "v1", "v2"])
+        self.assertEqual(state.version, "v2")
+        self.assertEqual(self.addresses(), ["2.2.2.2", "3.3.3.3"])
+        # a fresh mirror on the same directory sees the same data
+        self.assertEqual(self.addresses(feed_sync.FeedMirror(self.directory)),
+                         ["2.2.2.2", "3.3.3.3"])
+
+    def test_rejected_delta_full_resync(self):
+        view = FakeIntel(
+            {"version": "v1", "entries": [ip("1.1.1.1")]},
+            papi_client.ApiError("unknown version", 4711),
+            {"version": "v7", "entries": [ip("9.9.9.9")]},
+        )
+        self.mirror.sync(view, "ip")
+        self.mirror.sync(view, "ip")
+        self.assertEqual(view.versions, [None, "v1", None])
+        self.assertEqual(self.addresses(), ["9.9.9.9"])
+
+    def test_inconsistent_delta_full_resync(self):
+        view = FakeIntel(
+            {"version": "v1", "entries": [ip("1.1.1.1")]},
+            {"version": "v2", "remove": ["8.8.8.8"]},
+            {"version": "v2", "entries": [ip("1.1.1.1")]},
+        )
+        self.mirror.sync(view, "ip")
+        state = self.mirror.sync(view, "ip")
+        self.assertEqual(view.versions, [None, "v1", None])
+        self.assertEqual(state.version, "v2")
+
+    def test_scopes_are_separate(self):
+        view = FakeIntel(
+            {"version": "g1", "entries": [ip("1.1.1.1")]},
+            {"version": "k1", "entries": [ip("2.2.2.2")]},
+        )
+        self.mirror.sync(view, "ip")
+        self.mirror.sync(view, "ip", papi_client.KeyIds(3, 4))
+        self.assertEqual(self.addresses(), ["1.1.1.1"])
+        self.assertEqual(self.addresses(key=papi_client.KeyIds(3, 4)),
+                         ["2.2.2.2"])
+
+    def test_refresh_and_invalidate(self):
+        view = FakeIntel(
+            {"version": "v1", "entries": [ip("1.1.1.1")]},
+            {"version": "v2", "add": [ip("2.2.2.2")]},
+        )
+        self.mirror.refresh(view, "ip", max_age=60)
+        self.mirror.refresh(view, "ip", max_age=60)
+        self.assertEqual(view.versions, [None])
+
+        self.mirror.invalidate("ip")
+        entries = self.mirror.refresh(view, "ip", max_age=60)
+        self.assertEqual(view.versions, [None, "v1"])
+        self.assertEqual(len(entries), 2)
+
+    def test_unknown_feed(self):
+        with self.assertRaises(papi_client.InvalidArgument):
+            self.mirror.entries("url")
+
+
+if __name__ == "__main__":
+    exit(unittest.main())
@@ -0,0 +1,132 @@
+#!/usr/bin/python
+"""
+Unit tests for the appliance inventory
+"""
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from papi_client import inventory
+from papi_client import papi_client
+
+
+class FakeApplianceMgmt(object):
+    """
+    Serves an overview and configurations, records configuration requests
+    """
+    def __init__(self, appliances):
+        self.appliances = appliances
+        self.fail = set()
+        self.fetched = []
+        self.lock = threading.Lock()
+
+    def get_overview(self, user_id=None):
+        return [dict(overview, appliance_uuid=uuid)
+                for uuid, (overview, _) in self.appliances.items()]
+
+    def get_configuration(self, appliance_uuid, user_id=None):
+        with self.lock:
+            self.fetched.append(appliance_uuid)
+        if appliance_uuid in self.fail:
+            raise papi_client.CommunicationError("timed out")
+        return self.appliances[appliance_uuid][1]
+
+
+def appliance(version, sso, last_seen=1):
+    return ({"software_version": version, "last_seen": last_seen},
+            {"software_version": version, "auto_update": True,
+             "settings": {"sso_saml2_enabled1": sso}})
+
+
+class TestInventory(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.api = FakeApplianceMgmt({
+            "a1": appliance("7.1", True),
+            "a2": appliance("7.1", False),
+            "a3": appliance("7.2", True),
+        })
+        self.inventory = inventory.Inventory(self.directory, concurrency=2,
+                                             keep=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_refresh_and_query(self):
+        snapshot = self.inventory.refresh(self.api)
+        self.assertEqual(snapshot.version, 1)
+        self.assertEqual(sorted(self.api.fetched), ["a1", "a2", "a3"])
+        self.assertEqual(snapshot.find("sso_saml2_enabled1", True),
+                         ["a1", "a3"])
+        self.assertEqual(snapshot.find("software_version", "7.2"), ["a3"])
+        self.assertEqual(snapshot.values("software_version"),
+                         [("7.1", ["a1", "a2"]), ("7.2", ["a3"])])
+
+        # answered from disk by another reader
+        reader = inventory.Inventory(self.directory)
+        self.assertEqual(reader.snapshot().find("sso_saml2_enabled1", False),
+                         ["a2"])
+
+    def test_incremental_refresh(self):
+        self.inventory.refresh(self.api)
+        self.api.fetched = []
+        self.api.appliances["a1"] = appliance("7.1", True, last_seen=2)
+        self.api.appliances["a2"] = appliance("7.2", False)
+        self.api.appliances["a4"] = appliance("7.2", False)
+        del self.api.appliances["a3"]
+
+        snapshot = self.inventory.refresh(self.api)
+        self.assertEqual(sorted(self.api.fetched), ["a2", "a4"])
+        self.assertEqual(snapshot.uuids(), ["a1", "a2", "a4"])
+        self.assertEqual(snapshot.find("software_version", "7.2"),
+                         ["a2", "a4"])
+
+        self.inventory.refresh(self.api, full=True)
+        self.assertEqual(self.inventory.versions(), [2, 3])
+        with self.assertRaises(inventory.Error):
+            self.inventory.snapshot(1)
+
+    def test_failed_fetch(self):
+        self.inventory.refresh(self.api)
+        self.api.appliances["a1"] = appliance("7.2", True)
+        self.api.fail.add("a1")
+
+        snapshot = self.inventory.refresh(self.api)
+        self.assertEqual(snapshot.failed().keys(), ["a1"])
+        # the last known configuration is kept
+        self.assertEqual(snapshot.configuration("a1")["software_version"],
+                         "7.1")
+
+        self.api.fail.clear()
+        self.api.fetched = []
+        snapshot = self.inventory.refresh(self.api)
+        self.assertEqual(self.api.fetched, ["a1"])
+        self.assertEqual(snapshot.failed(), {})
+
+    def test_overview_formats(self):
+        by_uuid = {"a1": {"name": "sensor"}}
+        self.assertEqual(inventory.overview_appliances(by_uuid), by_uuid)
+        self.assertEqual(inventory.overview_appliances(
+            {"appliances": [{"uuid": "a1", "name": "sensor"}]}).keys(),
+            ["a1"])
+        with self.assertRaises(inventory.Error):
+            inventory.overview_appliances([{"name": "sensor"}])
+
+    def test_concurrent_refresh(self):
+        stale = self.inventory.refresh(self.api)
+        self.inventory.refresh(self.api)
+        # another process that read version 1 before version 2 was written
+        other = inventory.Inventory(self.directory)
+        other.snapshot = lambda version=None: stale
+        with self.assertRaises(inventory.Error):
+            other.refresh(self.api)
+        self.assertEqual(self.inventory.versions(), [1, 2])
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ["snapshot-1.json", "snapshot-2.json"])
+
+
+if __name__ == "__main__":
+    exit(unittest.main())
@@ -6,6 +6,10 @@ Unit tests for the loader
      Copyright 2014 Lastline, Inc.  All Rights Reserved.
 """
 import ConfigParser
+import os
+import shutil
+import sys
+import tempfile
 import unittest
 import logging
 import mox
@@ -82,6 +86,47 @@ class TestLoader(unittest.TestCase):
         with self.assertRaises(loader.NoSuchView):
             client.view("nosuchview")
 
+    def test_views_created_on_access(self):
+        client = self.test_load_all()
+        self.assertNotIn("appliance_mgmt", client.__dict__)
+        view = client.view("appliance_mgmt")
+        self.assertIs(client.appliance_mgmt, view)  # pylint: disable=E1101
+        with self.assertRaises(loader.DuplicateView):
+            client.load_view("appliance_mgmt")
+        with self.assertRaises(loader.NoSuchView):
+            client.load_view("nosuchview")
+
+    def test_register_view(self):
+        self.stubs.Set(loader, "_registry",
+                       loader.ViewRegistry(loader.BUILTIN_VIEWS))
+
+        class PapiClientTest(loader.PapiViewClient):
+            def __init__(self, base_client, logger=None):
+                loader.PapiViewClient.__init__(self, "registry_test",
+                                               base_client, logger)
+
+        loader.register_view("registry_test", PapiClientTest)
+        self.assertIn("registry_test", loader.registered_views())
+        client = loader.PapiClientCollection(base_client="stub",
+                                             conf=ConfigParser.ConfigParser(),
+                                             logger=self.logger)
+        client.load_view("registry_test")
+        self.assertIsInstance(client.registry_test,  # pylint: disable=E1101
+                              PapiClientTest)
+
+    def test_entry_point(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        os.mkdir(os.path.join(directory, "extra_views-1.0.dist-info"))
+        with open(os.path.join(directory, "extra_views-1.0.dist-info",
+                               "entry_points.txt"), "w") as f:
+            f.write("[papi_client.views]\n"
+                    "extra_intel = papi_client.api.intel:PapiClientIntel\n")
+        self.stubs.Set(sys, "path", [directory])
+        registry = loader.ViewRegistry(loader.BUILTIN_VIEWS)
+        self.assertIn("extra_intel", registry.names())
+        self.assertIs(registry.get("extra_intel"), intel.PapiClientIntel)
+
 
 class TestFactory(unittest.TestCase):
     """
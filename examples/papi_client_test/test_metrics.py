@@ -0,0 +1,142 @@
+#!/usr/bin/python
+"""
+Unit tests for request metrics
+"""
+import unittest
+
+import requests
+
+from papi_client import metrics
+from papi_client import papi_client
+
+
+class FakeRequest(object):
+    def __init__(self, body):
+        self.body = body
+
+
+class FakeResponse(object):
+    def __init__(self, body, sent=None):
+        self.status_code = 200
+        self.headers = {}
+        self.body = body
+        self.content = "x" * 10
+        self.request = FakeRequest(sent)
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.body
+
+
+class FakeSession(object):
+    """
+    Answers logins and returns the scripted outcomes for all other requests
+    """
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.cookies = requests.cookies.RequestsCookieJar()
+        self.headers = {}
+
+    def request(self, method, url, **kwargs):
+        if url.endswith("/login"):
+            return FakeResponse({"success": 1, "data": None})
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+class TestRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics.MetricsRegistry()
+
+    def test_counter(self):
+        counter = self.registry.counter("test_total", "Test", ("code",))
+        counter.inc(("a",))
+        counter.inc(("a",), 2)
+        counter.inc((None,))
+        self.assertIs(self.registry.counter("test_total", "Test", ("code",)),
+                      counter)
+        self.assertEqual(counter.value(("a",)), 3)
+        self.assertEqual(self.registry.render_prometheus(),
+                         '# HELP test_total Test\n'
+                         '# TYPE test_total counter\n'
+                         'test_total{code=""} 1\n'
+                         'test_total{code="a"} 3\n')
+        with self.assertRaises(metrics.Error):
+            self.registry.histogram("test_total", "Test", ("code",))
+        with self.assertRaises(metrics.Error):
+            counter.inc(("a", "b"))
+
+    def test_histogram(self):
+        histogram = self.registry.histogram("test_seconds", "Test",
+                                            ("f",), buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value, ('say "hi"',))
+        value = histogram.value(('say "hi"',))
+        self.assertEqual(value["count"], 4)
+        self.assertEqual(value["buckets"],
+                         [(0.1, 2), (1, 3), (float("inf"), 4)])
+        text = self.registry.render_prometheus()
+        self.assertIn('test_seconds_bucket{f="say \\"hi\\"",le="0.1"} 2\n',
+                      text)
+        self.assertIn('test_seconds_bucket{f="say \\"hi\\"",le="+Inf"} 4\n',
+                      text)
+        self.assertIn('test_seconds_sum{f="say \\"hi\\""} 3.65\n', text)
+        self.assertIn('test_seconds_count{f="say \\"hi\\""} 4\n', text)
+        snapshot = self.registry.snapshot()["test_seconds"]
+        self.assertEqual(snapshot[0]["labels"], {"f": 'say "hi"'})
+        self.assertEqual(snapshot[0]["buckets"][-1], ["+Inf", 4])
+
+
+class TestClientMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.session_factory = requests.session
+
+    def tearDown(self):
+        requests.session = self.session_factory
+
+    def test_requests_recorded(self):
+        self.session = FakeSession([
+            FakeResponse({"success": 1, "data": "ok"}, sent="a=1"),
+            requests.ConnectionError("reset"),
+            FakeResponse({"success": 0, "error": "no",
+                          "error_code": 3001}),
+        ])
+        requests.session = lambda: self.session
+        client_metrics = metrics.ClientMetrics(metrics.MetricsRegistry())
+        c = papi_client.PapiClient(
+            url="https://non-reachable-test-url",
+            login_params={"username": "test", "password": "test1234"},
+            metrics=client_metrics)
+
+        self.assertEqual(c.do_request("POST", "intel", "ip/add"), "ok")
+        with self.assertRaises(papi_client.ApiError):
+            c.ping()
+
+        duration = client_metrics.request_duration
+        self.assertEqual(duration.value(("intel", "ip/add", "POST"))["count"],
+                         1)
+        self.assertEqual(duration.value(("", "ping", "GET"))["count"], 2)
+        self.assertEqual(duration.value(("", "login", "POST"))["count"], 2)
+        self.assertEqual(
+            client_metrics.request_bytes.value(("intel", "ip/add")), 3)
+        self.assertEqual(
+            client_metrics.response_bytes.value(("intel", "ip/add")), 10)
+        self.assertEqual(client_metrics.retries.value(("", "ping")), 1)
+        self.assertEqual(client_metrics.logins.value(("success",)), 2)
+        self.assertEqual(
+            client_metrics.communication_errors.value(("", "ping")), 1)
+        self.assertEqual(
+            client_metrics.api_errors.value(("", "ping", 3001)), 1)
+        self.assertIn('papi_api_errors_total{module="",function="ping",'
+                      'error_code="3001"} 1',
+                      client_metrics.registry.render_prometheus())
+
+
+if __name__ == "__main__":
+    exit(unittest.main())
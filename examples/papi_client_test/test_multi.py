@@ -0,0 +1,80 @@
+#!/usr/bin/python
+"""
+Unit tests for driving several managers through one collection
+"""
+import threading
+import unittest
+
+from papi_client import loader
+from papi_client import multi
+from papi_client import papi_client
+from papi_client import workers
+
+
+class FakeClient(object):
+    """
+    Stands in for the PapiClient of one manager
+    """
+    def __init__(self, name, event=None, error=None):
+        self.name = name
+        self.event = event
+        self.error = error
+
+    def do_request(self, method, module, function, params=None, data=None,
+                   files=None, url=None, fmt="JSON", raw=False):
+        if self.event is not None:
+            self.event.wait()
+        if self.error is not None:
+            raise self.error
+        return {"manager": self.name, "function": function}
+
+
+class TestMultiPapiClientCollection(unittest.TestCase):
+
+    def setUp(self):
+        self.event = threading.Event()
+        self.multi = multi.MultiPapiClientCollection(
+            [(name, loader.PapiClientCollection(client, None))
+             for name, client in [
+                 ("a", FakeClient("a")),
+                 ("b", FakeClient("b", error=papi_client.ApiError(
+                     "denied", 4711))),
+                 ("slow", FakeClient("slow", event=self.event))]],
+            timeout=5, timeouts={"slow": 0.05})
+        self.multi.load_view("intel")
+
+    def tearDown(self):
+        self.event.set()
+        self.multi.close()
+
+    def test_per_target_results(self):
+        results = self.multi.intel.list_ip()
+        self.assertEqual(results.keys(), ["a", "b", "slow"])
+        self.assertEqual(results.results(),
+                         {"a": {"manager": "a", "function": "ip/list"}})
+        self.assertFalse(results.ok())
+        self.assertIsInstance(results["b"].error, papi_client.ApiError)
+        self.assertTrue(results["slow"].timed_out())
+        with self.assertRaises(papi_client.ApiError):
+            results.raise_for_errors()
+
+    def test_slow_target_does_not_stall_others(self):
+        results = self.multi.fan_out(lambda c: c.intel.ping()["manager"])
+        self.assertEqual(results["a"].result, "a")
+        self.assertIsInstance(results["slow"].error, workers.TimeoutError)
+
+    def test_views(self):
+        self.assertEqual(self.multi.list_views(), ["intel"])
+        self.assertEqual(self.multi.collection("a").base_client().name, "a")
+        with self.assertRaises(multi.NoSuchTarget):
+            self.multi.collection("c")
+        with self.assertRaises(loader.DuplicateView):
+            self.multi.load_view("intel")
+
+    def test_no_targets(self):
+        with self.assertRaises(papi_client.InvalidArgument):
+            multi.MultiPapiClientCollection([])
+
+
+if __name__ == "__main__":
+    exit(unittest.main())
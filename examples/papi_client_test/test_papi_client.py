@@ -12,6 +12,8 @@ import ConfigParser
 import ddt
 import logging
 import mox
+import threading
+import time
 import unittest
 
 from papi_client import papi_client
@@ -89,6 +91,28 @@ class TestPapiClientFactory(unittest.TestCase):
         self.assertIs(c, mock)
         self.mock.VerifyAll()
 
+    def test_pool_options_forwarded(self):
+        self.conf.set("papi", "auth_method", "license")
+        self.conf.set("papi", "api_key", "E" * 20)
+        self.conf.set("papi", "api_token", "TickTock")
+        self.conf.set("papi", "pool_maxsize", "32")
+        self.conf.set("papi", "pool_block", "true")
+        mock = papi_client.PapiClient(
+            url="https://xyz.not.reachable.local",
+            login_params={"api_key": "E" * 20, "api_token": "TickTock"},
+            verify_ssl=True,
+            timeout=60,
+            logger=None,
+            proxies=None,
+            pool_maxsize=32,
+            pool_block=True
+        )
+
+        self.mock.ReplayAll()
+        c = papi_client.PapiClientFactory.client_from_config(self.conf, "papi")
+        self.assertIs(c, mock)
+        self.mock.VerifyAll()
+
 @ddt.ddt
 class TestPapiClient(unittest.TestCase):
     """
@@ -249,6 +273,140 @@ class TestPapiClient(unittest.TestCase):
         c.login()
         self.mock.VerifyAll()
 
+    def test_login_handler(self):
+        c = self.make_test_client()
+        calls = []
+
+        def handler(client, login):
+            calls.append(client)
+            login()
+        c.set_login_handler(handler)
+
+        call = requests.session()
+        call.AndReturn(self.session)  # pylint: disable=E1101
+        self.mock_login()
+
+        self.mock.ReplayAll()
+        c.login()
+        self.assertEqual(calls, [c])
+        self.assertTrue(c.is_logged_in())
+        self.mock.VerifyAll()
+
+    def test_set_cookies(self):
+        c = self.make_test_client()
+        call = requests.session()
+        call.AndReturn(requests.Session())  # pylint: disable=E1101
+        cookies = [{"name": "PHPSESSID", "value": "abc",
+                    "domain": "non-reachable-test-url", "path": "/",
+                    "expires": None}]
+
+        self.mock.ReplayAll()
+        self.assertEqual(c.get_cookies(), [])
+        c.set_cookies(cookies)
+        self.assertTrue(c.is_logged_in())
+        self.assertEqual(c.get_cookies(), cookies)
+        self.mock.VerifyAll()
+
+    def test_single_flight_login(self):
+        c = self.make_test_client()
+        release = threading.Event()
+        logins = []
+
+        def handler(client, login):
+            logins.append(client)
+            release.wait()
+            client.set_cookies([{"name": "PHPSESSID", "value": "abc"}])
+
+        c.set_login_handler(handler)
+        call = requests.session()
+        call.AndReturn(requests.Session())  # pylint: disable=E1101
+        self.mock.ReplayAll()
+
+        threads = [threading.Thread(target=c.login) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(logins), 1)
+        stats = c.login_stats()
+        self.assertEqual(stats["logins"], 1)
+        self.assertEqual(stats["joined_logins"], 4)
+        self.assertIsNotNone(stats["last_login_seconds"])
+        self.mock.VerifyAll()
+
+    def test_renew_expired_session(self):
+        c = papi_client.PapiClient(
+            url="https://non-reachable-test-url",
+            login_params={"username": "test", "password": "test1234"},
+            session_max_age=60
+        )
+        session = requests.Session()
+        call = requests.session()
+        call.AndReturn(session)  # pylint: disable=E1101
+        self.mock.StubOutWithMock(session, "request")
+        logins = []
+        c.set_login_handler(lambda client, login: logins.append(client))
+
+        call = session.request(
+            method="GET",
+            url="https://non-reachable-test-url/foobar/ping.json",
+            data=mox.IgnoreArg(),
+            params=None,
+            files=None,
+            verify=True,
+            timeout=60,
+            proxies=None
+        )
+        response = self.make_response()
+        response.raise_for_status()
+        response.json().AndReturn({"success": 1, "data": "pong"})
+        call.AndReturn(response)  # pylint: disable=E1101
+
+        self.mock.ReplayAll()
+        c.set_cookies([{"name": "PHPSESSID", "value": "abc"}])
+        # pretend the session was established before the server expires it
+        c._PapiClient__session_started -= 61  # pylint: disable=W0212
+        self.assertEqual(c.ping(module="foobar"), "pong")
+        self.assertEqual(logins, [c])
+        self.mock.VerifyAll()
+
+    def test_restored_session_is_logged_in(self):
+        c = papi_client.PapiClient(
+            url="https://non-reachable-test-url",
+            login_params={"username": "test", "password": "test1234"}
+        )
+        session = requests.Session()
+        call = requests.session()
+        call.AndReturn(session)  # pylint: disable=E1101
+        self.mock.StubOutWithMock(session, "request")
+        logins = []
+        c.set_login_handler(lambda client, login: logins.append(client))
+
+        # only the ping, no login request
+        call = session.request(
+            method="GET",
+            url="https://non-reachable-test-url/foobar/ping.json",
+            data=mox.IgnoreArg(),
+            params=None,
+            files=None,
+            verify=True,
+            timeout=60,
+            proxies=None
+        )
+        response = self.make_response()
+        response.raise_for_status()
+        response.json().AndReturn({"success": 1, "data": "pong"})
+        call.AndReturn(response)  # pylint: disable=E1101
+
+        self.mock.ReplayAll()
+        c.set_cookies([{"name": "PHPSESSID", "value": "abc"}])
+        self.assertEqual(c.ping(module="foobar"), "pong")
+        self.assertEqual(logins, [])
+        self.mock.VerifyAll()
+
     def test_login_failure(self):
         call = requests.session()
         call.AndReturn(self.session)  # pylint: disable=E1101
@@ -388,6 +546,71 @@ class TestPapiClient(unittest.TestCase):
         self.assertEqual(ret, "pong")
         self.mock.VerifyAll()
 
+    def test_communication_error_keeps_session(self):
+        c = self.make_test_client()
+
+        call = requests.session()
+        call.AndReturn(self.session)  # pylint: disable=E1101
+
+        self.mock_login()
+
+        call = self.session.request(
+            method="GET",
+            url="https://non-reachable-test-url/foobar/ping.json",
+            data=mox.IgnoreArg(),
+            params=None,
+            files=None,
+            verify=True,
+            timeout=60,
+            proxies=None
+        )
+        call.AndRaise(requests.ConnectionError("reset by peer"))
+
+        # The session and its connection pool survive, only the cookies
+        # are dropped before logging in again.
+        self.session.cookies.clear()
+        self.mock_login()
+
+        call = self.session.request(
+            method="GET",
+            url="https://non-reachable-test-url/foobar/ping.json",
+            data=mox.IgnoreArg(),
+            params=None,
+            files=None,
+            verify=True,
+            timeout=60,
+            proxies=None
+        )
+        response = self.make_response()
+        response.raise_for_status()
+        response.json().AndReturn({"success": 1, "data": "pong"})
+        call.AndReturn(response)  # pylint: disable=E1101
+
+        self.mock.ReplayAll()
+        ret = c.do_request(
+            method="GET",
+            module="foobar",
+            function="ping",
+        )
+        self.assertEqual(ret, "pong")
+        self.mock.VerifyAll()
+
+    def test_pool_configured(self):
+        self.mock.UnsetStubs()
+        c = papi_client.PapiClient(
+            url="https://non-reachable-test-url",
+            login_params={"username": "test", "password": "test1234"},
+            pool_maxsize=3,
+            pool_block=True,
+            keep_alive=False
+        )
+        session = c._PapiClient__new_session()  # pylint: disable=E1101
+        adapter = session.get_adapter("https://non-reachable-test-url")
+        self.assertEqual(adapter._pool_maxsize, 3)  # pylint: disable=W0212
+        self.assertTrue(adapter._pool_block)  # pylint: disable=W0212
+        self.assertEqual(session.headers["Connection"], "close")
+        self.assertEqual(c.pool_stats()["established"], 0)
+
     @ddt.data(
         {"success": 0, "error_code": 4711},
         {"success": 0, "error_code": 4711, "error": "Eau de Cologne"},
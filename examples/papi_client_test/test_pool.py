@@ -0,0 +1,90 @@
+#!/usr/bin/python
+"""
+Unit tests for the client pool
+"""
+import threading
+import unittest
+
+from papi_client import papi_client
+from papi_client import pool
+
+
+class Factory(object):
+    def __init__(self, fail=False):
+        self.created = []
+        self.fail = fail
+
+    def __call__(self):
+        if self.fail:
+            raise papi_client.CommunicationError("down")
+        obj = object()
+        self.created.append(obj)
+        return obj
+
+
+class TestPapiClientPool(unittest.TestCase):
+
+    def test_lazy_creation_and_reuse(self):
+        factory = Factory()
+        p = pool.PapiClientPool(factory, size=2)
+        self.assertEqual(factory.created, [])
+
+        obj = p.acquire()
+        p.release(obj)
+        self.assertIs(p.acquire(), obj)
+        self.assertEqual(len(factory.created), 1)
+
+        stats = p.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["creations"], 1)
+        self.assertEqual(stats["in_use"], 1)
+
+    def test_exhausted(self):
+        p = pool.PapiClientPool(Factory(), size=1, timeout=0.01)
+        p.acquire()
+        with self.assertRaises(pool.PoolExhausted):
+            p.acquire()
+        self.assertEqual(p.stats()["waits"], 1)
+
+    def test_waiter_gets_released_object(self):
+        p = pool.PapiClientPool(Factory(), size=1)
+        obj = p.acquire()
+        got = []
+        t = threading.Thread(target=lambda: got.append(p.acquire(timeout=5)))
+        t.start()
+        p.release(obj)
+        t.join()
+        self.assertEqual(got, [obj])
+
+    def test_health_check_discards(self):
+        factory = Factory()
+        p = pool.PapiClientPool(factory, size=1, check_interval=0,
+                                health_check=lambda obj: False)
+        p.release(p.acquire())
+        p.acquire()
+        self.assertEqual(len(factory.created), 2)
+        self.assertEqual(p.stats()["discards"], 1)
+
+    def test_failed_creation_frees_slot(self):
+        factory = Factory(fail=True)
+        p = pool.PapiClientPool(factory, size=1, timeout=0.01)
+        with self.assertRaises(papi_client.CommunicationError):
+            p.acquire()
+        factory.fail = False
+        p.acquire()
+        self.assertEqual(len(factory.created), 1)
+
+    def test_borrow_discards_on_communication_error(self):
+        factory = Factory()
+        p = pool.PapiClientPool(factory, size=1)
+        with self.assertRaises(papi_client.CommunicationError):
+            with p.borrow():
+                raise papi_client.CommunicationError("reset")
+        with p.borrow() as obj:
+            self.assertIs(obj, factory.created[1])
+        self.assertEqual(p.stats()["idle"], 1)
+
+
+if __name__ == "__main__":
+    exit(unittest.main())
@@ -0,0 +1,90 @@
+#!/usr/bin/python
+"""
+Unit tests for reconciling feeds with the current blacklist
+"""
+import unittest
+
+from papi_client import bulk
+from papi_client import reconcile
+
+
+class FakeIntelView(object):
+    """
+    Stands in for PapiClientIntel, keeping the blacklist in a dict
+    """
+    def __init__(self, ips):
+        self.ips = dict((entry["ip"], entry) for entry in ips)
+        self.added = []
+        self.deleted = []
+
+    def list_ip(self, key=None):
+        return self.ips.values()
+
+    def add_ip(self, entries, key=None):
+        self.added.extend(entries)
+        for entry in entries:
+            self.ips[entry["ip"]] = entry
+
+    def delete_ip(self, ips, key=None):
+        self.deleted.extend(ips)
+        for ip in ips:
+            del self.ips[ip]
+
+
+class TestReconcile(unittest.TestCase):
+
+    def setUp(self):
+        self.view = FakeIntelView([
+            {"ip": "10.0.0.1", "impact": 10, "source": "feed",
+             "comment": "old"},
+            {"ip": "10.0.0.2", "impact": 20, "source": "feed"},
+            {"ip": "10.0.0.3", "impact": 30, "source": "feed"},
+        ])
+        uploader = bulk.BulkUploader(self.view, max_entries=2, workers=2)
+        self.reconciler = reconcile.Reconciler(self.view, uploader=uploader)
+        self.feed = [
+            {"ip": "10.0.0.1", "impact": 10, "source": "feed"},
+            {"ip": "10.0.0.2", "impact": 50, "source": "feed"},
+            {"ip": "10.0.0.4", "impact": 10},
+        ]
+
+    def test_only_changes_sent(self):
+        report = self.reconciler.reconcile("ip", iter(self.feed))
+        self.assertTrue(report.ok())
+        self.assertEqual(sorted(e["ip"] for e in self.view.added),
+                         ["10.0.0.2", "10.0.0.4"])
+        self.assertEqual(self.view.deleted, [])
+        self.assertEqual(report.counts(), {"add": 1, "update": 1,
+                                           "unchanged": 1, "delete": 0})
+
+    def test_delete_missing(self):
+        report = self.reconciler.reconcile("ip", self.feed, delete=True)
+        self.assertEqual(self.view.deleted, ["10.0.0.3"])
+        self.assertEqual(report.counts()["delete"], 1)
+        self.assertEqual(sorted(self.view.ips),
+                         ["10.0.0.1", "10.0.0.2", "10.0.0.4"])
+
+    def test_second_run_sends_nothing(self):
+        self.reconciler.reconcile("ip", self.feed)
+        self.view.added = []
+        report = self.reconciler.reconcile("ip", self.feed)
+        self.assertEqual(self.view.added, [])
+        self.assertEqual(report.counts()["unchanged"], 3)
+
+    def test_diff_counts(self):
+        diff = reconcile.FeedDiff("ip", self.view.ips)
+        self.assertEqual(len(list(diff.changes(self.feed))), 2)
+        self.assertEqual(diff.counts()["missing"], 1)
+        self.assertEqual(diff.deletions(), ["10.0.0.3"])
+
+    def test_kept_entries_not_deleted(self):
+        diff = reconcile.FeedDiff("ip", self.view.ips)
+        # e.g. a row of the feed that failed validation
+        diff.keep("10.0.0.3")
+        self.assertEqual(len(list(diff.changes(self.feed))), 2)
+        self.assertEqual(diff.deletions(), [])
+        self.assertEqual(diff.counts()["missing"], 0)
+
+
+if __name__ == "__main__":
+    exit(unittest.main())
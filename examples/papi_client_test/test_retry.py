@@ -0,0 +1,137 @@
+#!/usr/bin/python
+"""
+Unit tests for retry policies
+"""
+import time
+import unittest
+
+import requests
+
+from papi_client import papi_client
+from papi_client import retry
+
+
+class FakeResponse(object):
+    def __init__(self, status_code=200, body=None, headers=None):
+        self.status_code = status_code
+        self.body = body if body is not None else {"success": 1, "data": "ok"}
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError("%d error" % self.status_code,
+                                     response=self)
+
+    def json(self):
+        return self.body
+
+
+class FakeSession(object):
+    """
+    Answers logins and returns the scripted outcomes for all other requests
+    """
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.requests = []
+        self.cookies = requests.cookies.RequestsCookieJar()
+        self.headers = {}
+
+    def request(self, method, url, **kwargs):
+        if url.endswith("/login"):
+            return FakeResponse()
+        self.requests.append((method, url))
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def test_default_retries_once(self):
+        policy = retry.RetryPolicy()
+        self.assertTrue(policy.should_retry(1, "POST"))
+        self.assertFalse(policy.should_retry(2, "GET"))
+        self.assertEqual(policy.delay(1), 0)
+
+    def test_backoff(self):
+        policy = retry.RetryPolicy(max_attempts=5, backoff=0.5, max_backoff=3)
+        self.assertEqual([policy.delay(a) for a in range(1, 5)],
+                         [0.5, 1, 2, 3])
+        policy.jitter = True
+        for attempt in range(1, 5):
+            self.assertTrue(0 <= policy.delay(attempt) <= 3)
+
+    def test_retry_after(self):
+        policy = retry.RetryPolicy(max_retry_after=10)
+        self.assertEqual(policy.delay(1, retry_after=4), 4)
+        self.assertIsNone(policy.delay(1, retry_after=11))
+        self.assertFalse(policy.should_retry(1, "GET", delay=None))
+
+        error = papi_client.CommunicationError(requests.HTTPError(
+            response=FakeResponse(503, headers={"Retry-After": "7"})))
+        self.assertEqual(retry.retry_after(error), 7)
+        self.assertTrue(retry.not_processed(error))
+        error = papi_client.CommunicationError(requests.HTTPError(
+            response=FakeResponse(
+                503, headers={"Retry-After": "Thu, 01 Jan 2015 00:01:00 GMT"})))
+        self.assertEqual(retry.retry_after(error, now=1420070400), 60)
+
+    def test_non_idempotent(self):
+        policy = retry.RetryPolicy(retry_non_idempotent=False)
+        self.assertFalse(policy.should_retry(1, "POST"))
+        self.assertTrue(policy.should_retry(1, "POST", processed=False))
+        self.assertTrue(policy.should_retry(1, "GET"))
+
+    def test_budget(self):
+        budget = retry.RetryBudget(ratio=0.5, min_retries=1, window=60)
+        for _ in range(4):
+            budget.request_sent()
+        self.assertEqual([budget.acquire() for _ in range(3)],
+                         [True, True, False])
+        self.assertEqual(budget.stats()["exhausted"], 1)
+
+
+class TestDoRequestRetries(unittest.TestCase):
+
+    def setUp(self):
+        self.session_factory = requests.session
+
+    def tearDown(self):
+        requests.session = self.session_factory
+
+    def make_client(self, outcomes, **policy):
+        self.session = FakeSession(outcomes)
+        requests.session = lambda: self.session
+        return papi_client.PapiClient(
+            url="https://non-reachable-test-url",
+            login_params={"username": "test", "password": "test1234"},
+            retry_policy=retry.RetryPolicy(**policy))
+
+    def test_retries_with_backoff(self):
+        c = self.make_client([requests.ConnectionError("reset"),
+                              requests.ConnectionError("reset"),
+                              FakeResponse()],
+                             max_attempts=3, backoff=0.05)
+        start = time.time()
+        self.assertEqual(c.ping(), "ok")
+        self.assertGreaterEqual(time.time() - start, 0.15)
+        self.assertEqual(len(self.session.requests), 3)
+
+    def test_post_not_retried(self):
+        c = self.make_client([requests.ConnectionError("reset")],
+                             max_attempts=3, retry_non_idempotent=False)
+        with self.assertRaises(papi_client.CommunicationError):
+            c.do_request("POST", "intel", "ip/add")
+        self.assertEqual(len(self.session.requests), 1)
+
+    def test_post_retried_when_throttled(self):
+        c = self.make_client([FakeResponse(429, headers={"Retry-After": "0"}),
+                              FakeResponse()],
+                             max_attempts=3, retry_non_idempotent=False)
+        self.assertEqual(c.do_request("POST", "intel", "ip/add"), "ok")
+        self.assertEqual(len(self.session.requests), 2)
+
+
+if __name__ == "__main__":
+    exit(unittest.main())
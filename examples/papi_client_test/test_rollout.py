@@ -0,0 +1,195 @@
+#!/usr/bin/python
+"""
+Unit tests for the configuration rollout
+"""
+import threading
+import unittest
+
+from papi_client import actions
+from papi_client import papi_client
+from papi_client import rollout
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeApplianceMgmt(object):
+    """
+    Starts an action per configure() that completes after `duration`
+    seconds with the outcome configured for the appliance
+    """
+    def __init__(self, clock, duration=10, outcomes=None):
+        self.clock = clock
+        self.duration = duration
+        self.outcomes = outcomes or {}
+        self.configured = []
+        self.status_requests = 0
+        self.actions = {}
+        self.lock = threading.Lock()
+
+    def configure(self, appliance_uuid, software_version=None,
+                  auto_update=None, settings=None, user_id=None):
+        outcome = self.outcomes.get(appliance_uuid, "SUCCESS")
+        if outcome == "REJECT":
+            raise papi_client.ApiError("no such appliance")
+        with self.lock:
+            self.configured.append((appliance_uuid, settings, user_id))
+            action_uuid = "action-%s" % appliance_uuid
+            self.actions[action_uuid] = (self.clock.time(), outcome)
+        return {"action_uuid": action_uuid}
+
+    def get_action_status(self, action_uuid, user_id=None):
+        with self.lock:
+            self.status_requests += 1
+            started, outcome = self.actions[action_uuid]
+        if outcome == "UNREACHABLE":
+            raise papi_client.CommunicationError("timed out")
+        if outcome == "STUCK" or \
+                self.clock.time() - started < self.duration:
+            return {"status": "RUNNING"}
+        return {"status": outcome}
+
+
+class TrackedApplianceMgmt(FakeApplianceMgmt):
+    """
+    FakeApplianceMgmt with an ActionTracker, like PapiClientApplianceMgmt
+    """
+    def __init__(self, clock, **kwargs):
+        FakeApplianceMgmt.__init__(self, clock, **kwargs)
+        self.tracker = actions.ActionTracker(self, min_interval=0.001,
+                                             max_interval=0.005)
+
+    def action_tracker(self):
+        return self.tracker
+
+
+class TestRollout(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def rollout(self, api, **kwargs):
+        kwargs.setdefault("concurrency", 2)
+        return rollout.Rollout(api, clock=self.clock.time,
+                               sleep=self.clock.sleep, **kwargs)
+
+    def test_all_succeed(self):
+        api = FakeApplianceMgmt(self.clock)
+        uuids = ["a%d" % i for i in range(5)]
+        report = self.rollout(api, wave_size=2).run(
+            uuids, settings={"x": 1}, user_id=3)
+
+        self.assertTrue(report.ok())
+        self.assertEqual([r.appliance_uuid for r in report.results()], uuids)
+        self.assertEqual(sorted(api.configured),
+                         [(uuid, {"x": 1}, 3) for uuid in uuids])
+        self.assertEqual([r.wave for r in report.results()], [0, 0, 1, 1, 2])
+        summary = report.summary()
+        self.assertEqual((summary["succeeded"], summary["waves"],
+                          summary["stopped"]), (5, 3, None))
+        result = report.result("a0")
+        self.assertEqual(result.action_uuid, "action-a0")
+        self.assertEqual(result.status, {"status": "SUCCESS"})
+        self.assertTrue(result.duration() >= 10)
+
+    def test_waves_are_sequential(self):
+        api = FakeApplianceMgmt(self.clock)
+        report = self.rollout(api, wave_size=2).run(["a", "b", "c"])
+        # the second wave starts after the first one completed
+        self.assertTrue(report.result("c").started >=
+                        report.result("b").finished)
+
+    def test_per_appliance_arguments(self):
+        api = FakeApplianceMgmt(self.clock)
+        self.rollout(api).run({"a": {"settings": {"x": 2}}, "b": None},
+                              settings={"x": 1})
+        self.assertEqual(sorted(api.configured),
+                         [("a", {"x": 2}, None), ("b", {"x": 1}, None)])
+
+    def test_stop_on_failure_rate(self):
+        outcomes = dict(("a%d" % i, "FAILED") for i in range(3))
+        outcomes["a3"] = "REJECT"
+        api = FakeApplianceMgmt(self.clock, outcomes=outcomes)
+        uuids = ["a%d" % i for i in range(10)]
+        report = self.rollout(api, wave_size=4, max_failure_rate=0.5,
+                              min_done=2).run(uuids)
+
+        self.assertFalse(report.ok())
+        self.assertEqual([r.appliance_uuid for r in report.failed()],
+                         ["a0", "a1", "a2", "a3"])
+        self.assertTrue(isinstance(report.result("a0").error,
+                                   actions.ActionFailed))
+        self.assertTrue(isinstance(report.result("a3").error,
+                                   papi_client.ApiError))
+        # no request went out after the first wave
+        self.assertEqual(len(report.skipped()), 6)
+        self.assertEqual(len(api.configured), 3)
+        self.assertEqual(report.stopped(), "2 of 2 appliances failed")
+
+    def test_failures_below_threshold(self):
+        api = FakeApplianceMgmt(self.clock, outcomes={"a1": "FAILED"})
+        uuids = ["a%d" % i for i in range(6)]
+        report = self.rollout(api, wave_size=3, max_failure_rate=0.4,
+                              min_done=3).run(uuids)
+        self.assertEqual(report.stopped(), None)
+        self.assertEqual(len(report.succeeded()), 5)
+
+    def test_action_timeout(self):
+        api = FakeApplianceMgmt(self.clock, outcomes={"a": "STUCK",
+                                                      "b": "UNREACHABLE"})
+        report = self.rollout(api, action_timeout=300,
+                              max_failure_rate=None).run(["a", "b", "c"])
+        for uuid in ["a", "b"]:
+            self.assertTrue(isinstance(report.result(uuid).error,
+                                       actions.ActionTimeout))
+        self.assertIn("timed out", str(report.result("b").error))
+        self.assertTrue(report.result("c").ok())
+        self.assertTrue(self.clock.now - 1000 >= 300)
+
+
+class TestTrackedRollout(unittest.TestCase):
+
+    def setUp(self):
+        # actions complete on their first poll
+        self.api = TrackedApplianceMgmt(FakeClock(), duration=0, outcomes={
+            "bad": "FAILED", "stuck": "STUCK"})
+        self.addCleanup(self.api.tracker.close)
+
+    def test_view_tracker(self):
+        uuids = ["a%d" % i for i in range(5)]
+        report = rollout.Rollout(self.api, wave_size=2).run(uuids, user_id=3)
+        self.assertTrue(report.ok())
+        self.assertEqual(report.result("a0").status, {"status": "SUCCESS"})
+        # the actions were polled by the tracker of the view
+        self.assertEqual(self.api.tracker.requests(), 5)
+        self.assertEqual(self.api.status_requests, 5)
+
+    def test_failure_and_timeout(self):
+        report = rollout.Rollout(self.api, action_timeout=0.05,
+                                 max_failure_rate=None).run(
+                                     ["bad", "stuck", "good"])
+        self.assertTrue(isinstance(report.result("bad").error,
+                                   actions.ActionFailed))
+        self.assertTrue(isinstance(report.result("stuck").error,
+                                   actions.ActionTimeout))
+        self.assertTrue(report.result("good").ok())
+
+    def test_closed_tracker(self):
+        self.api.tracker.close()
+        report = rollout.Rollout(self.api).run(["a"])
+        self.assertTrue(isinstance(report.result("a").error,
+                                   actions.TrackerClosed))
+
+
+if __name__ == "__main__":
+    exit(unittest.main())
@@ -0,0 +1,102 @@
+#!/usr/bin/python
+"""
+Unit tests for the column-wise intel entry validation
+"""
+import unittest
+
+from papi_client import papi_client
+from papi_client import validation
+
+
+class TestBatchValidator(unittest.TestCase):
+
+    def setUp(self):
+        self.validator = validation.BatchValidator()
+
+    def test_ips(self):
+        result = self.validator.validate(
+            ips=["10.0.0.1", "", "300.1.2.3", "::1", "255.255.255.255",
+                 "1.2.3"])
+        self.assertEqual(list(result.reasons), [
+            validation.OK, validation.MISSING_VALUE, validation.INVALID_IP,
+            validation.OK, validation.OK, validation.INVALID_IP])
+        self.assertEqual(result.accepted(), [0, 3, 4])
+        self.assertEqual(result.ipv4[0], 0x0a000001)
+        self.assertEqual(result.ipv4[4], 0xffffffff)
+        self.assertEqual(result.ip_string(0), "10.0.0.1")
+        self.assertEqual(result.ip_string(3), "::1")
+
+    def test_ipv6_not_allowed(self):
+        validator = validation.BatchValidator(allow_ipv6=False)
+        result = validator.validate(ips=["::1"])
+        self.assertEqual(result.rejected(), [(0, validation.INVALID_IP)])
+
+    def test_trailing_newline(self):
+        validator = validation.BatchValidator(strict_domains=True)
+        result = validator.validate(ips=["1.2.3.4\n", "1.2.3.4"],
+                                    domains=["example.com", "example.com\n"])
+        self.assertEqual(result.rejected(), [
+            (0, validation.INVALID_IP), (1, validation.INVALID_DOMAIN)])
+
+    def test_domains(self):
+        # as accepted by the per-row checks and the intel forms
+        result = self.validator.validate(domains=[
+            "example.com", "b\xc3\xbccher.example", "*.example.com", "",
+            "b\xfccher.example", "a" * 1025, u"b\xfccher.example",
+            "\xc3\xbc" * 1024])
+        self.assertEqual(result.accepted(), [0, 1, 2, 6, 7])
+        self.assertEqual(result.rejected(), [
+            (3, validation.MISSING_VALUE), (4, validation.INVALID_DOMAIN),
+            (5, validation.INVALID_DOMAIN)])
+
+    def test_strict_domains(self):
+        validator = validation.BatchValidator(strict_domains=True)
+        result = validator.validate(
+            domains=["example.com", "-bad.com", "", "a_b.example.org.",
+                     "b\xc3\xbccher.example"])
+        self.assertEqual(result.accepted(), [0, 3])
+        self.assertEqual(result.rejected(), [
+            (1, validation.INVALID_DOMAIN), (2, validation.MISSING_VALUE),
+            (4, validation.INVALID_DOMAIN)])
+
+    def test_impacts(self):
+        result = self.validator.validate(
+            impacts=["10", "", "high", "0", "101", "15", " 20 "])
+        self.assertEqual(list(result.reasons), [
+            validation.OK, validation.OK, validation.INVALID_IMPACT,
+            validation.INVALID_IMPACT, validation.INVALID_IMPACT,
+            validation.IMPACT_STEP, validation.OK])
+        self.assertEqual(list(result.impacts), [10, 0, 0, 0, 0, 15, 20])
+
+    def test_impact_leading_zeros(self):
+        result = self.validator.validate(impacts=["010", "0100", "00"])
+        self.assertEqual(list(result.reasons), [
+            validation.OK, validation.OK, validation.INVALID_IMPACT])
+        self.assertEqual(list(result.impacts), [10, 100, 0])
+
+    def test_impact_without_step(self):
+        validator = validation.BatchValidator(impact_step=False)
+        result = validator.validate(impacts=["15", "100"])
+        self.assertEqual(result.accepted(), [0, 1])
+
+    def test_lengths(self):
+        validator = validation.BatchValidator(max_source=3, max_comment=5)
+        result = validator.validate(ips=["1.1.1.1"] * 3,
+                                    sources=["abc", "abcd", ""],
+                                    comments=["", "", "abcdef"])
+        self.assertEqual(result.rejected(), [
+            (1, validation.SOURCE_TOO_LONG), (2, validation.COMMENT_TOO_LONG)])
+
+    def test_first_failure_wins(self):
+        result = self.validator.validate(ips=["bad"], impacts=["bad"])
+        self.assertEqual(result.reason_counts(), {"invalid ip": 1})
+
+    def test_column_length_mismatch(self):
+        with self.assertRaises(papi_client.InvalidArgument):
+            self.validator.validate(ips=["1.1.1.1"], impacts=[])
+        with self.assertRaises(papi_client.InvalidArgument):
+            self.validator.validate()
+
+
+if __name__ == "__main__":
+    exit(unittest.main())
@@ -8,6 +8,7 @@ Interactive shell for the papi client.
 """
 
 import argparse
+import atexit
 import ConfigParser
 import os.path
 import logging
@@ -15,6 +16,8 @@ import IPython
 
 from papi_client import papi_client
 from papi_client import loader
+from papi_client import metrics
+from papi_client import multi
 
 BANNER_PART1 = """
 ---------------------------------------------------------
@@ -23,12 +26,18 @@ Lastline PAPI shell
 
 The 'client' object is a PapiClientCollection,
 which provides access to the functionality
-of the individual API views.
+of the individual API views.%s
 
 Views currently available are:
 
 """
 
+MULTI_NOTE = """
+Here it is a MultiPapiClientCollection for the managers
+%s: every call runs on all of them and
+returns a MultiResult with the outcome per manager.
+'client.collection(NAME)' gives the collection of one manager."""
+
 BANNER_PART2 = """
 
 This is an IPython shell, so you can take
@@ -61,11 +70,23 @@ For a sample configuration INI file, see papi_client.ini.template
     parser.add_argument("-c", "--config", type=str, dest="config",
                         default="papi_client.ini",
                         help="Configuration file name")
-    parser.add_argument("--section", type=str, default="papi",
-                        help="Section of configuration file to read from")
+    parser.add_argument("--section", type=str, action="append",
+                        dest="sections",
+                        help="Section of configuration file to read from "
+                        "(default: papi). Give it several times to drive "
+                        "several managers at once")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="With several sections, seconds to wait for "
+                        "each manager before reporting a call as timed out")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="Write PAPI request metrics in the Prometheus "
+                        "text format to FILE ('-' for stdout) when done")
 
     args = parser.parse_args()
 
+    if args.metrics:
+        atexit.register(metrics.dump, args.metrics)
+
     # Python logger...
     logger = logging.getLogger()
     sh = logging.StreamHandler()
@@ -81,18 +102,29 @@ For a sample configuration INI file, see papi_client.ini.template
     config_parser = ConfigParser.ConfigParser()
     config_parser.read(config_fn)
 
-    base_client = papi_client.PapiClientFactory.client_from_config(config_parser, args.section, logger)
-    client = loader.PapiClientCollection(base_client=base_client,
-                                          conf=config_parser,
-                                          logger=logger)
-    client.load_all_views()
+    sections = args.sections or ["papi"]
+    multi_note = ""
+    if len(sections) == 1:
+        base_client = papi_client.PapiClientFactory.client_from_config(config_parser, sections[0], logger)
+        client = loader.PapiClientCollection(base_client=base_client,
+                                              conf=config_parser,
+                                              logger=logger)
+        client.load_all_views()
+    else:
+        client = multi.MultiPapiClientCollection.from_config(
+            config_parser, sections, logger, timeout=args.timeout)
+        multi_note = MULTI_NOTE % ", ".join(sections)
     views = client.list_views()
     logger.info("Loaded %s views:", len(views))
     for v in views:
         logger.info("-->%s", v)
 
-    view_desc = [" - 'client.%s': %s" % (v, client.view(v).description()) for v in views]
-    banner = BANNER_PART1 + "\n".join(view_desc) + BANNER_PART2
+    if len(sections) == 1:
+        descriptions = client
+    else:
+        descriptions = client.collection(sections[0])
+    view_desc = [" - 'client.%s': %s" % (v, descriptions.view(v).description()) for v in views]
+    banner = BANNER_PART1 % multi_note + "\n".join(view_desc) + BANNER_PART2
 
     # ipython interactive shell
     IPython.embed(banner1=banner)
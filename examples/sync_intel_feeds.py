@@ -0,0 +1,73 @@
+#!/usr/bin/python
+"""
+Sample program to keep a local mirror of the custom intelligence feeds.
+
+Run it periodically (e.g. from cron); after the first run only the changes
+since the last run are downloaded.
+"""
+
+import argparse
+import atexit
+import ConfigParser
+import os.path
+import logging
+
+from papi_client import papi_client
+from papi_client import loader
+from papi_client import metrics
+from papi_client import feed_sync
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--config", type=str, dest="config",
+                        default="papi_client.ini")
+    parser.add_argument("directory", help="Directory holding the mirror")
+    parser.add_argument("keys", nargs="*", default=[None],
+                        help="Sync the feeds at the scope of these license "
+                        "key[:subkey]s. If not provided, sync global scope")
+    parser.add_argument("--feed", action="append", dest="feeds",
+                        choices=sorted(feed_sync.FEEDS),
+                        help="Feed to sync, can be given several times. "
+                        "Defaults to all feeds")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="Write PAPI request metrics in the Prometheus "
+                        "text format to FILE ('-' for stdout) when done")
+
+    args = parser.parse_args()
+
+    if args.metrics:
+        atexit.register(metrics.dump, args.metrics)
+
+    # Python logger...
+    logger = logging.getLogger()
+    sh = logging.StreamHandler()
+    logger.setLevel(logging.INFO)
+    sh.setLevel(logging.INFO)
+    logger.addHandler(sh)
+
+    config_fn = os.path.expanduser(args.config)
+    if not os.path.isfile(config_fn):
+        logger.error("config %s not found", args.config)
+        return 1
+
+    config_parser = ConfigParser.ConfigParser()
+    config_parser.read(config_fn)
+
+    base_client = papi_client.PapiClientFactory.client_from_config(config_parser, "papi", logger)
+    client = loader.PapiClientCollection(base_client=base_client,
+                                          conf=config_parser,
+                                          logger=logger)
+    client.load_view("intel")
+
+    mirror = feed_sync.FeedMirror(args.directory, logger)
+    for key in args.keys:
+        for feed in args.feeds or sorted(feed_sync.FEEDS):
+            state = mirror.sync(client.intel, feed, key)  # pylint: disable=E1101
+            logger.info("%s feed for %s: version %s, %d entries",
+                        feed, state.scope, state.version, len(state.entries))
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
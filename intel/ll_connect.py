@@ -6,11 +6,14 @@ import ConfigParser
 
 from papi_client import papi_client
 from papi_client import loader
+from papi_client import pool
+from papi_client import feed_sync
+from papi_client import cache
+from papi_client import bulk
+from papi_client import breaker
 
 # Session re-use
-import dill as pickle
-import requests, requests.utils
-from intel.models import APISession
+import ll_session
 
 from ll_logger import LogExceptions
 from ll_debug import __debugvar__
@@ -18,9 +21,64 @@ from ll_debug import __debugvar__
 
 # TODO: Handle Permission Denied errors if our provided account has no rights.
 
+# Config file section of the manager used by default
+DEFAULT_SECTION = getattr(settings, 'PAPI_CLIENT_SECTION', 'papi')
+
+# Optional local mirror of the global intel feeds. When INTEL_FEED_MIRROR_DIR
+# is set, blacklists are listed from the mirror, which is synced (usually only
+# a delta) when older than INTEL_FEED_MIRROR_MAX_AGE seconds. Managers other
+# than the default one get a subdirectory each.
+feed_mirrors = {}
+def feed_mirror(section=DEFAULT_SECTION):
+  directory = getattr(settings, 'INTEL_FEED_MIRROR_DIR', None)
+  if not directory:
+    return None
+  if section != DEFAULT_SECTION:
+    directory = os.path.join(directory, section)
+  if section not in feed_mirrors:
+    feed_mirrors[section] = feed_sync.FeedMirror(directory)
+  return feed_mirrors[section]
+
+# Optional cache of read-only API responses, one per manager, shared by all
+# connections of this process ('memory') or of all processes ('file', kept in
+# PAPI_RESPONSE_CACHE_DIR). Writes through the app invalidate it.
+response_caches = {}
+def response_cache(section=DEFAULT_SECTION):
+  backend = getattr(settings, 'PAPI_RESPONSE_CACHE', None)
+  if not backend:
+    return None
+  if section not in response_caches:
+    if backend == 'file':
+      backend = cache.FileCache(
+        os.path.join(settings.PAPI_RESPONSE_CACHE_DIR, section))
+    else:
+      backend = cache.LRUCache(
+        getattr(settings, 'PAPI_RESPONSE_CACHE_SIZE', 1024))
+    response_caches[section] = cache.ResponseCache(backend)
+  return response_caches[section]
+
+# Circuit breaker per manager, shared by all connections of this process: after
+# PAPI_CIRCUIT_FAILURES consecutive failures requests fail at once with
+# papi_client.CircuitOpenError, for PAPI_CIRCUIT_RESET seconds until a probe
+# request gets through. Disabled if PAPI_CIRCUIT_FAILURES is None, settings in
+# the config section (breaker_failures, breaker_reset) take precedence.
+circuit_breakers = {}
+def circuit_breaker(section=DEFAULT_SECTION):
+  return circuit_breakers.get(section)
+
+# Whether requests to the manager fail fast right now
+def circuit_open(section=DEFAULT_SECTION):
+  circuit = circuit_breaker(section)
+  return circuit is not None and circuit.is_open()
+
+def circuit_error(section=DEFAULT_SECTION):
+  circuit = circuit_breaker(section)
+  return papi_client.CircuitOpenError(circuit.name, circuit.retry_in())
+
 class APIConn:
-  def __init__(self, logger):
+  def __init__(self, logger, section=DEFAULT_SECTION):
     self.logger = logger
+    self.section = section
 
   @LogExceptions()
   def load_config(self):
@@ -39,78 +97,140 @@ class APIConn:
     # Create base client object from config
     __base_client = papi_client.PapiClientFactory.client_from_config(
       __config_parser,
-      'papi',
+      self.section,
       logger=self.logger.instance
     )
+    failures = getattr(settings, 'PAPI_CIRCUIT_FAILURES', 5)
+    if failures and __base_client.get_circuit_breaker() is None:
+      __base_client.set_circuit_breaker(breaker.get_breaker(
+        __config_parser.get(self.section, 'url').strip('/'),
+        failure_threshold=failures,
+        reset_timeout=getattr(settings, 'PAPI_CIRCUIT_RESET', 30)
+      ))
+    circuit_breakers[self.section] = __base_client.get_circuit_breaker()
     self.client = loader.PapiClientCollection(
       base_client=__base_client,
       conf=__config_parser,
-      logger=self.logger.instance
+      logger=self.logger.instance,
+      cache=response_cache(self.section)
     )
 
-    # Load old session (Auth cookies) - Looked up by login URI from db
-    # Alternatively: session = self.client._client._PapiClient__url
-    self.login_uri = __config_parser.get('papi', 'url')
-    try:
-      __session = APISession.objects.get(login_uri=self.login_uri)
-    except APISession.DoesNotExist:
-      self.client._client._PapiClient__session = None
-      self.cookie = None
-    except: raise
-    else:
-      self.client._client._PapiClient__session = pickle.loads(__session.serialized) 
-      self.cookie = self.client._client._PapiClient__session.cookies['PHPSESSID']
+    # Reuse the stored session (Auth cookies) - Looked up by login URI
+    self.login_uri = __config_parser.get(self.section, 'url')
+    self.sessions = ll_session.SessionStore(self.login_uri, self.logger)
+    self.sessions.attach(self.client.base_client())
 
     return self.client
 
   # Check if authorization cookie has changed between queries
   def check_auth(self):
-    # Cookie received from Lastline
-    __current_cookie = self.client._client._PapiClient__session.cookies['PHPSESSID']
-    if(self.cookie != __current_cookie):
-      # Store changed cookie in DB
-      __sessionDB = APISession(
-          login_uri=self.login_uri,
-          serialized=pickle.dumps(self.client._client._PapiClient__session)
-      )
-      __sessionDB.save()
-      self.cookie = __current_cookie
-      return False
-    return True
+    return self.sessions.check(self.client.base_client())
+
+  # List from the feed mirror if enabled, otherwise call list_function
+  def mirrored_list(self, feed, list_function):
+    mirror = feed_mirror(self.section)
+    if mirror is None:
+      return list_function()
+    return mirror.refresh(
+      self.client.intel, feed,
+      max_age=getattr(settings, 'INTEL_FEED_MIRROR_MAX_AGE', 60)
+    )
+
+  # Blacklist changed, next listing has to sync the mirror
+  def invalidate_mirror(self, feed):
+    mirror = feed_mirror(self.section)
+    if mirror is not None:
+      mirror.invalidate(feed)
 
   # Wrapped API calls 
   @LogExceptions()
   def ll_list_ip(self):
-    response = self.client.intel.list_ip()
+    response = self.mirrored_list('ip', self.client.intel.list_ip)
     self.check_auth() # Update stored auth if changed
     return response
 
   @LogExceptions()
   def ll_add_ip(self, entries):
     response = self.client.intel.add_ip(entries)
+    self.invalidate_mirror('ip')
     self.check_auth()
     return response
 
   @LogExceptions()
   def ll_delete_ip(self, entries):
     response = self.client.intel.delete_ip(entries)
+    self.invalidate_mirror('ip')
     self.check_auth()
     return response
 
   @LogExceptions()
   def ll_list_domain(self):
-    response = self.client.intel.list_domain()
+    response = self.mirrored_list('domain', self.client.intel.list_domain)
     self.check_auth()
     return response
 
   @LogExceptions()
   def ll_add_domain(self, entries):
     response = self.client.intel.add_domain(entries)
+    self.invalidate_mirror('domain')
     self.check_auth()
     return response
 
   @LogExceptions()
   def ll_delete_domain(self, entries):
     response = self.client.intel.delete_domain(entries)
+    self.invalidate_mirror('domain')
     self.check_auth()
     return response
+
+  # Adds ip or domain entries in batches of INTEL_ADD_BATCH_SIZE. Failed
+  # batches do not raise, returns a papi_client.bulk.BulkReport
+  @LogExceptions()
+  def ll_bulk_add(self, data_type, entries):
+    uploader = bulk.BulkUploader(
+      self.client.intel,
+      max_entries=getattr(settings, 'INTEL_ADD_BATCH_SIZE', 1000),
+      workers=getattr(settings, 'INTEL_ADD_WORKERS', 1),
+      max_attempts=2, retry_delay=0.5, # Someone is waiting for the response
+      logger=self.logger.instance
+    )
+    if data_type == 'domain':
+      report = uploader.add_domain(entries)
+    else:
+      report = uploader.add_ip(entries)
+    self.invalidate_mirror(data_type)
+    self.check_auth()
+    return report
+
+
+# Process wide pool of connected APIConn objects, borrowed by the views for
+# the duration of a single request instead of reconnecting every time.
+class APIConnPool:
+  def __init__(self, logger, section=DEFAULT_SECTION):
+    self.logger = logger
+    self.section = section
+    self.pool = pool.PapiClientPool(
+      self.create,
+      size=getattr(settings, 'PAPI_CLIENT_POOL_SIZE', 8),
+      timeout=getattr(settings, 'PAPI_CLIENT_POOL_TIMEOUT', 30),
+      health_check=self.health_check,
+      check_interval=getattr(settings, 'PAPI_CLIENT_POOL_CHECK_INTERVAL', 300),
+      logger=logger.instance
+    )
+
+  @LogExceptions()
+  def create(self):
+    api = APIConn(self.logger, self.section)
+    api.connect_api(api.load_config())
+    api.client.load_all_views()
+    return api
+
+  def health_check(self, api):
+    return pool.ping_collection(api.client)
+
+  # Usage: with api_pool.borrow() as api: api.ll_list_ip()
+  def borrow(self):
+    return self.pool.borrow()
+
+  def stats(self):
+    return self.pool.stats()
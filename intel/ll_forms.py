@@ -1,4 +1,5 @@
 from django import forms
+from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.validators import validate_ipv46_address, MinLengthValidator, MaxLengthValidator
 
@@ -16,6 +17,10 @@ _ = gettext.gettext
 # Validators
 validate_max1k = MaxLengthValidator(1024)
 
+# Limits of a single add request, the entries are sent on in batches
+ADD_MAX_LENGTH = getattr(settings, 'INTEL_ADD_MAX_LENGTH', 4194304) # 4mb
+ADD_MAX_ENTRIES = getattr(settings, 'INTEL_ADD_MAX_ENTRIES', 10000)
+
 def validate_impact(value):
   try:
     value = int(value)
@@ -67,18 +72,54 @@ class Undefined_Form(forms.Form):
   def clean_entries(self):
     return None
 
-class Add_ipForm(forms.Form):
+# Base class of forms adding a list of entries. Entries are validated one by
+# one: cleaned_data['entries'] holds the valid ones as (index, entry) pairs,
+# self.rejected the others as {'index': n, 'entry': entry, 'errors': [..]}.
+# Only a request that is not a list of entries at all fails validation.
+class BulkAddForm(forms.Form):
   key = forms.CharField(label='entries', max_length=100, required=False) 
   key_id = forms.CharField(label='entries', max_length=100, required=False)
   subkey_id = forms.CharField(label='entries', max_length=100, required=False)
-  entries = forms.CharField(label='entries', max_length=1024)
+  entries = forms.CharField(label='entries', max_length=ADD_MAX_LENGTH)
+
+  # Returns cleaned entry or raises ValidationError
+  def clean_entry(self, data):
+    raise ValidationError(_('Unsupported entry type'))
 
   def clean_entries(self):
     validate_unicode(self.cleaned_data['key'], max_length=100)
     validate_unicode(self.cleaned_data['key_id'], max_length=100)
     validate_unicode(self.cleaned_data['subkey_id'], max_length=100)
 
-    data = json.loads(self.cleaned_data['entries'])[0] # [{json=a..}]
+    try:
+      data = json.loads(self.cleaned_data['entries']) # [{json=a..}, ..]
+    except ValueError:
+      raise ValidationError(_('Entries are not valid JSON'))
+    if not isinstance(data, list):
+      raise ValidationError(_('Entries are not a list'))
+    if len(data) > ADD_MAX_ENTRIES:
+      raise ValidationError(
+        _('More than %(max_entries)s entries'), params={'max_entries': ADD_MAX_ENTRIES} )
+
+    self.rejected = []
+    entries = []
+    for index, entry in enumerate(data):
+      try:
+        if not isinstance(entry, dict):
+          raise ValidationError(_('Entry is not an object'))
+        entries.append((index, self.clean_entry(entry)))
+      except KeyError as e:
+        self.rejected.append({'index': index, 'entry': entry,
+          'errors': [_('Missing field: %s') % e.args[0]]})
+      except (TypeError, AttributeError):
+        self.rejected.append({'index': index, 'entry': entry,
+          'errors': [_('Invalid field type')]})
+      except ValidationError as e:
+        self.rejected.append({'index': index, 'entry': entry, 'errors': e.messages})
+    return entries
+
+class Add_ipForm(BulkAddForm):
+  def clean_entry(self, data):
     if validate_impact((data['impact'])):
       data['impact'] = int(data['impact']) # Unicode str number, decimals, etc
     validate_ipv46_address(data['ip'])
@@ -102,18 +143,8 @@ class Delete_ipForm(forms.Form):
       validate_ipv46_address(ip)
     return data
 
-class Add_domainForm(forms.Form):
-  key = forms.CharField(label='entries', max_length=100, required=False) 
-  key_id = forms.CharField(label='entries', max_length=100, required=False)
-  subkey_id = forms.CharField(label='entries', max_length=100, required=False)
-  entries = forms.CharField(label='entries', max_length=2000)
-
-  def clean_entries(self): 
-    validate_unicode(self.cleaned_data['key'], max_length=100)
-    validate_unicode(self.cleaned_data['key_id'], max_length=100)
-    validate_unicode(self.cleaned_data['subkey_id'], max_length=100)
-
-    data = json.loads(self.cleaned_data['entries'])[0] # [{json=a..}]
+class Add_domainForm(BulkAddForm):
+  def clean_entry(self, data):
     if validate_impact((data['impact'])):
       data['impact'] = int(data['impact']) # Unicode str number, decimals, etc
     validate_unicode(data['domain'], max_length=1024)
@@ -0,0 +1,172 @@
+import collections
+import socket
+import threading
+import time
+
+# Indexed local copies of the blacklists, so that the list views can answer
+# page/sort/filter queries with a slice instead of the whole list.
+
+# Columns besides the ip/domain itself, in table order
+COLUMNS = ('impact', 'comment', 'source', 'last_modified')
+ORDERS = ('asc', 'desc')
+
+# Sorted and filtered position lists kept per index
+FILTER_CACHE_SIZE = 16
+
+# IPv4 numerically before IPv6, anything unparsable last
+def ip_sort_key(value):
+  for order, family in ((0, socket.AF_INET), (1, socket.AF_INET6)):
+    try:
+      return (order, socket.inet_pton(family, value))
+    except (socket.error, ValueError, TypeError):
+      pass
+  return (2, value)
+
+# Case insensitive, empty values last
+def text_sort_key(value):
+  if value is None or value == '':
+    return (1, u'')
+  if isinstance(value, basestring):
+    return (0, value.lower())
+  return (0, value)
+
+def search_text(value):
+  if value is None:
+    return u''
+  if not isinstance(value, basestring):
+    value = unicode(value)
+  return value.lower()
+
+# Validates query parameters (request.GET) into keyword arguments of
+# ListIndex.query(). Raises ValueError on invalid parameters.
+def parse_query(params, data_type, max_limit):
+  columns = (data_type,) + COLUMNS
+  page = int(params.get('page', 0))
+  limit = int(params.get('limit', 50))
+  if page < 0 or not 0 < limit <= max_limit:
+    raise ValueError('page must be >= 0 and limit 1-{0}'.format(max_limit))
+  sort = params.get('sort') or data_type
+  if sort not in columns:
+    raise ValueError('Cannot sort by {0}'.format(sort))
+  order = params.get('order') or 'asc'
+  if order not in ORDERS:
+    raise ValueError('order must be one of {0}'.format(', '.join(ORDERS)))
+
+  # filter=text searches all columns, filter_<column>=text only one
+  filters = {}
+  if params.get('filter'):
+    filters[None] = params['filter']
+  for column in columns:
+    if params.get('filter_' + column):
+      filters[column] = params['filter_' + column]
+  return {'page': page, 'limit': limit, 'sort': sort,
+          'descending': order == 'desc', 'filters': filters}
+
+class ListIndex:
+  def __init__(self, data_type, entries):
+    self.data_type = data_type
+    self.columns = (data_type,) + COLUMNS
+    self.entries = list(entries)
+    self.created = time.time()
+    self.lock = threading.Lock()
+    self.orders = {} # column -> positions in ascending order, built lazily
+    self.texts = {} # column -> lower case text of every entry, built lazily
+    self.filtered = collections.OrderedDict() # LRU of query positions
+
+  def age(self):
+    return time.time() - self.created
+
+  def order(self, column):
+    with self.lock:
+      if column not in self.orders:
+        key = ip_sort_key if column == 'ip' else text_sort_key
+        values = [entry.get(column) for entry in self.entries]
+        self.orders[column] = sorted(range(len(values)),
+                                     key=lambda i: key(values[i]))
+      return self.orders[column]
+
+  def text(self, column):
+    with self.lock:
+      if column not in self.texts:
+        if column is None:
+          # all columns, separated so that terms do not match across them
+          self.texts[column] = [u'\0'.join(
+            search_text(entry.get(c)) for c in self.columns)
+            for entry in self.entries]
+        else:
+          self.texts[column] = [search_text(entry.get(column))
+                                for entry in self.entries]
+      return self.texts[column]
+
+  # Positions of the matching entries in the requested order
+  def positions(self, sort, descending, filters):
+    cache_key = (sort, descending, tuple(sorted(filters.items())))
+    with self.lock:
+      if cache_key in self.filtered:
+        positions = self.filtered.pop(cache_key)
+        self.filtered[cache_key] = positions
+        return positions
+
+    positions = self.order(sort)
+    if descending:
+      positions = positions[::-1]
+    for column, term in filters.items():
+      texts = self.text(column)
+      term = term.lower()
+      positions = [i for i in positions if term in texts[i]]
+
+    with self.lock:
+      self.filtered[cache_key] = positions
+      while len(self.filtered) > FILTER_CACHE_SIZE:
+        self.filtered.popitem(last=False)
+    return positions
+
+  def query(self, page=0, limit=50, sort=None, descending=False,
+            filters=None):
+    positions = self.positions(sort or self.data_type, descending,
+                               filters or {})
+    filtered = len(positions)
+    pages = max(1, (filtered + limit - 1) // limit)
+    page = min(page, pages - 1)
+    start = page * limit
+    return {
+      'entries': [self.entries[i] for i in positions[start:start + limit]],
+      'total': len(self.entries),
+      'filtered': filtered,
+      'page': page,
+      'pages': pages,
+      'limit': limit,
+      'sort': sort or self.data_type,
+      'order': 'desc' if descending else 'asc',
+    }
+
+# Process wide indexes per list type, rebuilt when older than max_age seconds
+# or after a change through this process.
+class ListStore:
+  def __init__(self, max_age=30):
+    self.max_age = max_age
+    self.lock = threading.Lock()
+    self.fetch_locks = {}
+    self.indexes = {}
+
+  # fetch() returns the full list and is only called by one thread at a time
+  def get(self, data_type, fetch):
+    index = self.indexes.get(data_type)
+    if index is not None and index.age() <= self.max_age:
+      return index
+    with self.lock:
+      fetch_lock = self.fetch_locks.setdefault(data_type, threading.Lock())
+    with fetch_lock:
+      # another thread may have refreshed it while we waited
+      index = self.indexes.get(data_type)
+      if index is None or index.age() > self.max_age:
+        index = ListIndex(data_type, fetch() or [])
+        self.indexes[data_type] = index
+      return index
+
+  # Current index however old, None if there is none
+  def peek(self, data_type):
+    return self.indexes.get(data_type)
+
+  def invalidate(self, data_type):
+    self.indexes.pop(data_type, None)
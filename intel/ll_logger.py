@@ -1,25 +1,169 @@
+import atexit
 import logging
+import logging.handlers
+import Queue
 import sys
+import threading
 import traceback
+from django.conf import settings
 from ipware.ip import get_ip
 
 from ll_debug import __debugvar__
 
-# Responsible for adding context to syslog messages like ip and username
-# Takes request, and a dict of overrides like: 'user':'someusername'
-class ContextFilter(logging.Filter):
-  def __init__(self, request, overrides={}):
-    self.request = request
-    self.overrides = overrides
+# Context of the request handled by the current thread, set once per request
+# by RequestContextMiddleware and read by ContextFilter for every record.
+_context = threading.local()
+
+def set_context(request, overrides=None):
+  _context.request = request
+  _context.ip = get_ip(request)
+  if(_context.ip is None): _context.ip = 'None'
+  _context.overrides = dict(overrides or {})
+
+# Overrides for the rest of the request, like: user='someusername'
+def update_context(**overrides):
+  if getattr(_context, 'request', None) is not None:
+    _context.overrides.update(overrides)
+
+def clear_context():
+  _context.__dict__.clear()
+
+def get_request():
+  return getattr(_context, 'request', None)
 
+# Responsible for adding context to syslog messages like ip and username.
+# Added once per logger, takes both from the current request context.
+class ContextFilter(logging.Filter):
   def filter(self, record):
-    record.ip = get_ip(self.request)
-    if(record.ip is None): record.ip = 'None' 
+    request = getattr(_context, 'request', None)
+    if request is None: # Outside of a request, eg. startup or worker threads
+      record.ip = 'None'
+      record.user = 'None'
+      return True
 
-    if(self.request.user.is_authenticated()): record.user = self.request.user.username
-    else: record.user = self.overrides.get('user', 'AnonymousUser')
+    record.ip = _context.ip
+    user = getattr(request, 'user', None)
+    if(user is not None and user.is_authenticated()): record.user = user.username
+    else: record.user = _context.overrides.get('user', 'AnonymousUser')
     return True
 
+# Sets the log context for the duration of each request. Listed after
+# AuthenticationMiddleware, as the user is looked up from request.user
+class RequestContextMiddleware(object):
+  def process_request(self, request):
+    set_context(request)
+    return None
+
+  def process_response(self, request, response):
+    clear_context()
+    return response
+
+# Hands records to a background thread which writes them to target, so that a
+# slow syslog does not stall requests. The queue is bounded, when it is full
+# records are dropped: overflow='drop_new' drops the record being logged,
+# 'drop_old' the oldest queued one. Messages longer than max_length are
+# truncated, and with sample_large=n only every n-th of them is kept at all.
+class QueueHandler(logging.Handler):
+  OVERFLOW_POLICIES = ('drop_new', 'drop_old')
+
+  def __init__(self, target, queue_size=10000, overflow='drop_new',
+               max_length=8192, sample_large=1):
+    logging.Handler.__init__(self)
+    if overflow not in self.OVERFLOW_POLICIES:
+      raise ValueError('overflow must be one of {0}'.format(
+        ', '.join(self.OVERFLOW_POLICIES)))
+    self.target = target
+    self.queue = Queue.Queue(queue_size)
+    self.overflow = overflow
+    self.max_length = max_length
+    self.sample_large = max(1, sample_large)
+    self.counters = {'queued': 0, 'written': 0, 'dropped': 0,
+                     'truncated': 0, 'sampled_out': 0, 'large': 0}
+    self.counter_lock = threading.Lock()
+    self.thread = threading.Thread(target=self.write_records,
+                                   name='ll_logger-writer')
+    self.thread.daemon = True
+    self.thread.start()
+
+  def count(self, name):
+    with self.counter_lock:
+      self.counters[name] += 1
+      return self.counters[name]
+
+  def stats(self):
+    with self.counter_lock:
+      stats = dict(self.counters)
+    stats['pending'] = self.queue.qsize()
+    return stats
+
+  # Renders the record in the logging thread: arguments may change or become
+  # invalid once the request is done, and tracebacks only exist here.
+  def prepare(self, record):
+    message = record.getMessage()
+    if record.exc_info:
+      message = message + '\n' + logging.Formatter().formatException(record.exc_info)
+      record.exc_info = None
+      record.exc_text = None
+
+    if self.max_length and len(message) > self.max_length:
+      if self.count('large') % self.sample_large:
+        self.count('sampled_out')
+        return None
+      self.count('truncated')
+      message = '{0}... ({1} chars truncated)'.format(
+        message[:self.max_length], len(message) - self.max_length)
+    record.msg = message
+    record.args = None
+    return record
+
+  def emit(self, record):
+    try:
+      record = self.prepare(record)
+      if record is None:
+        return
+      try:
+        self.queue.put_nowait(record)
+      except Queue.Full:
+        if self.overflow == 'drop_new':
+          self.count('dropped')
+          return
+        try:
+          self.queue.get_nowait()
+          self.count('dropped')
+        except Queue.Empty:
+          pass
+        try:
+          self.queue.put_nowait(record)
+        except Queue.Full: # Refilled concurrently
+          self.count('dropped')
+          return
+      self.count('queued')
+    except Exception:
+      self.handleError(record)
+
+  # Background thread, None in the queue stops it
+  def write_records(self):
+    while True:
+      record = self.queue.get()
+      if record is None:
+        break
+      try:
+        self.target.handle(record)
+        self.count('written')
+      except Exception:
+        self.target.handleError(record)
+
+  # Writes the queued records, waiting at most timeout seconds
+  def close(self, timeout=5):
+    if self.thread.is_alive():
+      try:
+        self.queue.put(None, timeout=timeout)
+      except Queue.Full:
+        pass
+      self.thread.join(timeout)
+    self.target.close()
+    logging.Handler.close(self)
+
 class Logger:
 
   # eg.
@@ -35,14 +179,13 @@ class Logger:
     self.instance = logging.getLogger('ll_logger')
     self.instance.setLevel(level)
 
-    # Build log formatters
-    logFormatter = logging.Formatter('%(levelname)s user(%(user)s) ip(%(ip)s) %(message)s')
+    # Shared by all Logger objects, only added once
+    if not any(isinstance(f, ContextFilter) for f in self.instance.filters):
+      self.instance.addFilter(ContextFilter())
 
-    # Logs to syslog
-    syslog = logging.handlers.SysLogHandler(address = '/dev/log')
-    syslog.setLevel(level)
-    syslog.setFormatter(logFormatter)
-    self.instance.addHandler(syslog)
+    # Handlers are shared by all Logger objects, only added once
+    if not self.instance.handlers:
+      self.instance.addHandler(self.build_handler(level))
 
     # Expose logging API
     self.debug = self.instance.debug
@@ -52,6 +195,36 @@ class Logger:
     self.critical = self.instance.critical
     self.exception = self.instance.exception
 
+  # Logs to syslog, through a QueueHandler if LOG_ASYNC is set
+  def build_handler(self, level):
+    # Build log formatters
+    logFormatter = logging.Formatter('%(levelname)s user(%(user)s) ip(%(ip)s) %(message)s')
+
+    # Logs to syslog
+    syslog = logging.handlers.SysLogHandler(address = '/dev/log')
+    syslog.setLevel(level)
+    syslog.setFormatter(logFormatter)
+    if not getattr(settings, 'LOG_ASYNC', False):
+      return syslog
+
+    handler = QueueHandler(
+      syslog,
+      queue_size=getattr(settings, 'LOG_QUEUE_SIZE', 10000),
+      overflow=getattr(settings, 'LOG_QUEUE_OVERFLOW', 'drop_new'),
+      max_length=getattr(settings, 'LOG_MAX_MESSAGE_LENGTH', 8192),
+      sample_large=getattr(settings, 'LOG_SAMPLE_LARGE', 1)
+    )
+    handler.setLevel(level)
+    atexit.register(handler.close) # Write what is queued on shutdown
+    return handler
+
+  # Counters of the QueueHandler, None when logging synchronously
+  def stats(self):
+    for handler in self.instance.handlers:
+      if isinstance(handler, QueueHandler):
+        return handler.stats()
+    return None
+
   # Returns the name of the function that called this function.
   def caller_name():
     return sys._getframe(1).f_code.co_name
@@ -0,0 +1,154 @@
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+import datetime
+import json
+import os
+import threading
+import time
+
+from intel.models import APISession
+from ll_debug import __debugvar__
+
+# Auth cookies of the PAPI sessions, shared by all connections of all
+# processes. Only the cookies and their expiry are kept: in process memory,
+# written through to the APISession table. When a session has to be renewed,
+# the process holding the login lease logs in while the others wait for the
+# new cookies to show up in the table.
+
+# login_uri -> (cookies, expires as seconds since the epoch)
+cache = {}
+cache_lock = threading.Lock()
+
+def session_max_age():
+  return getattr(settings, 'PAPI_SESSION_MAX_AGE', 1800)
+
+def to_datetime(timestamp):
+  return datetime.datetime.fromtimestamp(timestamp, timezone.utc)
+
+def to_timestamp(value):
+  return (value - datetime.datetime(1970, 1, 1, tzinfo=timezone.utc)).total_seconds()
+
+# When the cookies are to be considered expired: the earliest cookie expiry,
+# at most PAPI_SESSION_MAX_AGE seconds from now
+def cookies_expire(cookies):
+  expires = time.time() + session_max_age()
+  for cookie in cookies:
+    if cookie.get('expires'):
+      expires = min(expires, cookie['expires'])
+  return expires
+
+class SessionStore:
+  def __init__(self, login_uri, logger):
+    self.login_uri = login_uri
+    self.logger = logger
+    self.cookies = [] # Last cookies this store installed or saved
+    self.owner = '{0}:{1}'.format(os.getpid(), id(self))
+
+  # Cookies of a valid session or None; from process memory if possible
+  def load(self):
+    with cache_lock:
+      cached = cache.get(self.login_uri)
+    if cached is not None and cached[1] > time.time():
+      return cached[0]
+    return self.load_db()
+
+  def load_db(self):
+    try:
+      stored = APISession.objects.get(login_uri=self.login_uri)
+    except APISession.DoesNotExist:
+      return None
+    if not stored.cookies or stored.expires is None or stored.expires <= timezone.now():
+      return None
+    try:
+      cookies = json.loads(stored.cookies)
+    except ValueError:
+      return None
+    with cache_lock:
+      cache[self.login_uri] = (cookies, to_timestamp(stored.expires))
+    return cookies
+
+  def save(self, cookies):
+    expires = cookies_expire(cookies)
+    with cache_lock:
+      cache[self.login_uri] = (cookies, expires)
+    APISession.objects.update_or_create(
+      login_uri=self.login_uri,
+      defaults={'cookies': json.dumps(cookies), 'expires': to_datetime(expires)}
+    )
+    self.cookies = cookies
+
+  def forget(self):
+    with cache_lock:
+      cache.pop(self.login_uri, None)
+
+  # Use the stored session (if any) for client and coordinate its logins
+  def attach(self, client):
+    cookies = self.load()
+    if cookies:
+      client.set_cookies(cookies)
+      self.cookies = cookies
+    client.set_login_handler(self.login)
+
+  # Login lease, only one process logs in at a time
+  def acquire(self):
+    now = timezone.now()
+    lease = datetime.timedelta(seconds=getattr(settings, 'PAPI_SESSION_LOGIN_LEASE', 30))
+    APISession.objects.get_or_create(login_uri=self.login_uri)
+    return APISession.objects.filter(login_uri=self.login_uri).filter(
+      Q(lease_until__isnull=True) | Q(lease_until__lt=now)
+    ).update(lease_owner=self.owner, lease_until=now + lease) == 1
+
+  def release(self):
+    APISession.objects.filter(login_uri=self.login_uri, lease_owner=self.owner).update(
+      lease_owner='', lease_until=None)
+
+  # Newer cookies than ours, stored by another connection or process
+  def renewed(self):
+    cookies = self.load_db()
+    if cookies and cookies != self.cookies:
+      return cookies
+    return None
+
+  def adopt(self, client, cookies):
+    client.set_cookies(cookies)
+    self.cookies = cookies
+    self.logger.debug(self.logger.to_internal(self, 'Using session renewed elsewhere'))
+
+  # Login handler of the PapiClient, login() does the actual login
+  def login(self, client, login):
+    self.forget() # The cached session was not accepted
+    cookies = self.renewed()
+    if cookies:
+      return self.adopt(client, cookies)
+
+    lease = getattr(settings, 'PAPI_SESSION_LOGIN_LEASE', 30)
+    deadline = time.time() + lease
+    while not self.acquire():
+      if time.time() > deadline: # Lease holder seems stuck, log in anyway
+        self.logger.warning(self.logger.to_internal(self, 'Login lease not released'))
+        break
+      time.sleep(getattr(settings, 'PAPI_SESSION_POLL_INTERVAL', 0.2))
+      cookies = self.renewed()
+      if cookies:
+        return self.adopt(client, cookies)
+
+    try:
+      # Renewed while we acquired the lease
+      cookies = self.renewed()
+      if cookies:
+        return self.adopt(client, cookies)
+      login()
+      self.save(client.get_cookies())
+      self.logger.info(self.logger.to_internal(self, 'Logged in'))
+    finally:
+      self.release()
+
+  # The server may replace the session cookie on any response
+  def check(self, client):
+    cookies = client.get_cookies()
+    if cookies and cookies != self.cookies:
+      self.save(cookies)
+      return False
+    return True
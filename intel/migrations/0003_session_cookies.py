@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+# Pickled sessions are dropped, the next request logs in again.
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('intel', '0002_auto_20150310_1246'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='apisession',
+            name='serialized',
+        ),
+        migrations.AddField(
+            model_name='apisession',
+            name='cookies',
+            field=models.TextField(default='', verbose_name=b'Session cookies', blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='apisession',
+            name='expires',
+            field=models.DateTimeField(null=True, verbose_name=b'Session expires', blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='apisession',
+            name='lease_owner',
+            field=models.CharField(default='', max_length=100, verbose_name=b'Login lease owner', blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='apisession',
+            name='lease_until',
+            field=models.DateTimeField(null=True, verbose_name=b'Login lease until', blank=True),
+            preserve_default=True,
+        ),
+    ]
@@ -3,5 +3,9 @@ from django.db import models
 class APISession(models.Model):
   login_uri = models.CharField("Login URI", max_length=1024, primary_key=True)
   modified = models.DateTimeField("Last modified", auto_now=True)
-  # Serialized representation of the session
-  serialized = models.BinaryField("Serialized session")
+  # Auth cookies of the session as JSON, see ll_session
+  cookies = models.TextField("Session cookies", blank=True, default='')
+  expires = models.DateTimeField("Session expires", null=True, blank=True)
+  # Process currently logging in, others wait for its cookies
+  lease_owner = models.CharField("Login lease owner", max_length=100, blank=True, default='')
+  lease_until = models.DateTimeField("Login lease until", null=True, blank=True)
@@ -3,15 +3,37 @@ String.prototype.capitalizeFirstLetter = function() {
 }
 
 var BlacklistBox = React.createClass({
-  // Loads blacklist data from server
-  loadBlacklistFromServer: function() {
+  // Loads the requested slice of the blacklist from server. The server pages,
+  // sorts and filters, so only the rows on screen are transferred.
+  loadBlacklistFromServer: function(changes) {
+    var query = $.extend({}, this.state.query, changes);
+    var params = {
+      page: query.page,
+      limit: query.limit,
+      sort: query.sort,
+      order: query.order
+    };
+    for (var column in query.filters) {
+      if (query.filters[column]) { params['filter_' + column] = query.filters[column]; }
+    }
+    this.setState({query: query});
+
+    // Only the reply to the latest request is shown
+    var requestId = this.requestId = (this.requestId || 0) + 1;
     $.ajax({
       url: this.props.list_url,
       dataType: 'json',
+      data: params,
       success: function(data) {
-        this.setState({data: data});
-	// Update table sort after changes (TableSorter)
-	$("#" + this.props.data_type + "Table").trigger("updateAll").trigger("appendCache").trigger("applyWidgets");
+        if (requestId != this.requestId) { return; }
+        this.setState({
+          data: data.entries,
+          total: data.total,
+          filtered: data.filtered,
+          pages: data.pages,
+          // Server moves us to the last page if we were past it
+          query: $.extend({}, this.state.query, {page: data.page})
+        });
       }.bind(this),
       error: function(xhr, status, err) {
         //console.error(this.props.url, status, err.toString());
@@ -20,29 +42,48 @@ var BlacklistBox = React.createClass({
     });
   },
 
+  handleSort: function(column) {
+    var order = 'asc';
+    if (column == this.state.query.sort && this.state.query.order == 'asc') {
+      order = 'desc';
+    }
+    this.loadBlacklistFromServer({sort: column, order: order, page: 0});
+  },
+
+  handlePage: function(page) {
+    this.loadBlacklistFromServer({page: page});
+  },
+
+  handleLimit: function(limit) {
+    this.loadBlacklistFromServer({limit: limit, page: 0});
+  },
+
+  // Filter inputs update at once, the server is asked after typing pauses
+  handleFilter: function(column, value) {
+    var filters = $.extend({}, this.state.query.filters);
+    filters[column] = value;
+    this.setState({query: $.extend({}, this.state.query, {filters: filters})});
+    clearTimeout(this.filterTimer);
+    this.filterTimer = setTimeout(function() {
+      this.loadBlacklistFromServer({page: 0});
+    }.bind(this), 300);
+  },
+
   // Submits changes to server
   handleBlacklistUpdate: function(blacklistUpdate) {
-    // Optimistic submission, add entry already on js side
-    // this is so that we do not have to wait for server reply -> Snappy.
-    var blacklisted = this.state.data;
-    //var newBlacklists = blacklisted.concat([blacklistUpdate.add]);
-    //this.setState({data: newBlacklists});
-
     if ('add' in blacklistUpdate) {
       $.ajax({
         url: this.props.add_url,
         dataType: 'json',
         type: 'POST',
 	// Without JSON.stringify this would be POST: ip=1.1.1.1&comment=bla..
-        data: { entries: JSON.stringify([blacklistUpdate.add]) },
+        data: { entries: JSON.stringify(blacklistUpdate.add) },
         success: function(data) {
 	  if (data['errors'].length) {
-            // TODO: Better error reporting
-            alert("API says:" + JSON.stringify(data));
+            // Entries that were not added, the others are
+            alert("Added " + data['added'] + " entries, failed:\n" + data['errors'].join("\n"));
 	  } 
-          // We could just set state here if we changed it in JS.
-          //this.setState({data: data}); 
-          this.loadBlacklistFromServer(); // Refresh blacklist from server
+          this.loadBlacklistFromServer(); // Refresh current page from server
         }.bind(this),
         error: function(xhr, status, err) {
           //console.error(this.props.url, status, err.toString());
@@ -62,33 +103,7 @@ var BlacklistBox = React.createClass({
             // TODO: Better error reporting
             alert("API says:" + JSON.stringify(data));
 	  }
-
-          else {
-            // Remove the removed entries from our data, otherwise we end up
-	    // desynching with the dom information React thinks should be there.
-	    // This is a problem with TableSorter modifying dom outside React.
-  	    filter_fn = function(filter_array, filter_by) {
-	      return(function(x) {
-                return(filter_array.filter(function(y) {
-                  return(y == x[filter_by]);
-                }).length == 0);
-              });
-            }(blacklistUpdate.deletes, this.props.data_type); 
-
-	    var blacklistFiltered = blacklisted.filter(filter_fn);
-
-	    // TODO: Both needed until we have better solution
-            //this.setState({data: blacklistFiltered}); // Update internal state
-            //this.replaceState({data: blacklistFiltered}); // Update internal state
-	    //this.forceUpdate();
-            //this.loadBlacklistFromServer(); // Refresh blacklist from server
-	  
-	    // TODO: TableSorter still explodes us on removal of entry, may need to
-	    // consider alternative to TableSorter or figure out something lighter to
-	    // do here.
-	    window.location.reload();
-	  }
-
+          this.loadBlacklistFromServer(); // Refresh current page from server
         }.bind(this),
         error: function(xhr, status, err) {
           //console.error(this.props.url, status, err.toString());
@@ -99,16 +114,21 @@ var BlacklistBox = React.createClass({
 
   },
   getInitialState: function() {
-    return {data: []};
+    return {
+      data: [],
+      total: 0,
+      filtered: 0,
+      pages: 1,
+      query: {page: 0, limit: 10, sort: this.props.data_type, order: 'asc', filters: {}}
+    };
   },
   componentDidMount: function() {
     this.loadBlacklistFromServer();
     // TODO: Autoupdates disabled until table paging retains state.
     //setInterval(this.loadBlacklistFromServer, this.props.pollInterval);
-
-    // Initialize table sorting for our table (Can be empty here too.)
-    // Argument is the Table ID
-    sortblacklists(this.props.data_type); 
+  },
+  componentWillUnmount: function() {
+    clearTimeout(this.filterTimer);
   },
   render: function() {
     return (
@@ -117,8 +137,21 @@ var BlacklistBox = React.createClass({
         <BlacklistList
 	  data={this.state.data}
 	  data_type={this.props.data_type}
+	  query={this.state.query}
+	  onSort={this.handleSort}
+	  onFilter={this.handleFilter}
+	/>
+	<BlacklistPager
+	  data_type={this.props.data_type}
+	  page={this.state.query.page}
+	  limit={this.state.query.limit}
+	  pages={this.state.pages}
+	  total={this.state.total}
+	  filtered={this.state.filtered}
+	  rows={this.state.data.length}
+	  onPage={this.handlePage}
+	  onLimit={this.handleLimit}
 	/>
-	<BlacklistPager data_type={this.props.data_type}/>
         <BlacklistForm
 	  data_type={this.props.data_type} 
 	  onBlacklistUpdate={this.handleBlacklistUpdate}
@@ -147,12 +180,43 @@ var BlacklistList = React.createClass({
         </BlacklistEntry>
       );
     });
+
+    // Sortable, filterable columns: [column, title]
+    var columns = [
+      [this.props.data_type, this.props.data_type.capitalizeFirstLetter()],
+      ['impact', 'Impact'],
+      ['comment', 'Comment'],
+      ['source', 'Source'],
+      ['last_modified', 'Modified']
+    ];
+    var query = this.props.query;
+    var headers = columns.map(function (column) {
+      var className = 'tablesorter-header';
+      if (column[0] == query.sort) {
+        className += query.order == 'asc' ? ' tablesorter-headerSortUp' : ' tablesorter-headerSortDown';
+      }
+      return (
+        <th key={column[0]} className={className} onClick={this.props.onSort.bind(null, column[0])}>
+          <div className="tablesorter-header-inner roundedCorners">{column[1]}</div>
+        </th>
+      );
+    }.bind(this));
+    var filters = columns.map(function (column) {
+      return (
+        <td key={column[0]}>
+          <input type="search" className="tablesorter-filter" placeholder="Filter"
+            value={query.filters[column[0]] || ''}
+            onChange={function(e) { this.props.onFilter(column[0], e.target.value); }.bind(this)} />
+        </td>
+      );
+    }.bind(this));
+
     return (
       // Return formatted output
-      <table className="blacklistList" id={this.props.data_type + "Table"}>
+      <table className="blacklistList tablesorter tablesorter-blackice" id={this.props.data_type + "Table"}>
         <thead>
-          <tr><th>{this.props.data_type.capitalizeFirstLetter()}</th><th>Impact</th><th>Comment</th><th>Source</th>
-	  <th>Modified</th><th>Delete</th></tr>
+          <tr className="tablesorter-headerRow">{headers}<th>Delete</th></tr>
+          <tr className="tablesorter-filter-row">{filters}<td></td></tr>
         </thead>
 	<tbody>
           {blacklistNodes}
@@ -174,15 +238,13 @@ var BlacklistForm = React.createClass({
     var comment = this.refs.comment.getDOMNode().value.trim();
     var source = this.refs.source.getDOMNode().value.trim();
     if (data && impact && comment && source) {
-      var update = {add: {impact: impact, comment: comment, source: source}}
-      // Handle different KEY for types here
-      // TODO: This should not be an if conditional
-      if (this.props.data_type == 'ip') {
-	$.extend(update.add, {ip: data});
-      }
-      else if (this.props.data_type == 'domain') { 
-        $.extend(update.add, {domain: data});
-      }
+      // Several entries separated by whitespace or commas go in one request
+      var data_type = this.props.data_type;
+      var update = {add: data.split(/[\s,]+/).map(function (value) {
+        var entry = {impact: impact, comment: comment, source: source};
+        entry[data_type] = value;
+        return entry;
+      })};
       // Fills properties for our submit code
       this.props.onBlacklistUpdate(update);
 
@@ -194,9 +256,9 @@ var BlacklistForm = React.createClass({
     }
 
 
-    // Iterate deletes from all class .checkbox under .blacklistForm class
+    // Iterate deletes from all class .checkbox in our own table
     var deletes = []
-    $('.blacklistList').find('.checkbox').each(function() {
+    $('#' + this.props.data_type + 'Table').find('.checkbox').each(function() {
       if (this.checked) { deletes.push(this.value) }
     })
     if (deletes.length) { 
@@ -204,7 +266,7 @@ var BlacklistForm = React.createClass({
     }
   },
   render: function() {
-    var data_placeholder = "Add " + this.props.data_type + " entry"
+    var data_placeholder = "Add " + this.props.data_type + " entries"
     return (
       <form className="blacklistForm" onSubmit={this.handleSubmit}>
         <input type="text" placeholder={data_placeholder} ref="data" />
@@ -246,21 +308,50 @@ var Comment = React.createClass({
 });
 
 var BlacklistPager = React.createClass({
+  handlePage: function(page) {
+    if (page >= 0 && page < this.props.pages && page != this.props.page) {
+      this.props.onPage(page);
+    }
+  },
   render: function() {
+    var page = this.props.page;
+    var last = this.props.pages - 1;
+    var startRow = this.props.rows ? page * this.props.limit + 1 : 0;
+    var endRow = page * this.props.limit + this.props.rows;
+    var display = startRow + " to " + endRow + " (" + this.props.filtered + ")";
+    if (this.props.filtered != this.props.total) {
+      display += " of " + this.props.total;
+    }
+    var pageOptions = [];
+    for (var i = 0; i <= last; i++) {
+      pageOptions.push(<option key={i} value={i}>{i + 1}</option>);
+    }
     return (
       <div className="pager" id={this.props.data_type + "TablePager"}> 
-        <img src="/static/tablesorter/addons/pager/icons/first.png" className="first"/> 
-        <img src="/static/tablesorter/addons/pager/icons/prev.png" className="prev"/> 
-        <span className="pagedisplay"></span> 
-        <img src="/static/tablesorter/addons/pager/icons/next.png" className="next"/> 
-        <img src="/static/tablesorter/addons/pager/icons/last.png" className="last"/> 
-        <select className="pagesize" title="Select page size" value="10"> 
+        <img src="/static/tablesorter/addons/pager/icons/first.png"
+          className={page == 0 ? "first disabled" : "first"}
+          onClick={this.handlePage.bind(this, 0)}/> 
+        <img src="/static/tablesorter/addons/pager/icons/prev.png"
+          className={page == 0 ? "prev disabled" : "prev"}
+          onClick={this.handlePage.bind(this, page - 1)}/> 
+        <span className="pagedisplay">{display}</span> 
+        <img src="/static/tablesorter/addons/pager/icons/next.png"
+          className={page == last ? "next disabled" : "next"}
+          onClick={this.handlePage.bind(this, page + 1)}/> 
+        <img src="/static/tablesorter/addons/pager/icons/last.png"
+          className={page == last ? "last disabled" : "last"}
+          onClick={this.handlePage.bind(this, last)}/> 
+        <select className="pagesize" title="Select page size" value={this.props.limit}
+          onChange={function(e) { this.props.onLimit(parseInt(e.target.value, 10)); }.bind(this)}> 
             <option value="10">10</option> 
             <option value="20">20</option> 
             <option value="30">30</option> 
             <option value="40">40</option> 
         </select>  
-        <select className="gotoPage" title="Select page number"></select>
+        <select className="gotoPage" title="Select page number" value={page}
+          onChange={function(e) { this.handlePage(parseInt(e.target.value, 10)); }.bind(this)}>
+          {pageOptions}
+        </select>
       </div>
     );
   }
@@ -1,3 +1,28 @@
-from django.test import TestCase
+from django.test import SimpleTestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
 
-# Create your tests here.
+import views
+
+@override_settings(METRICS_ALLOWED_IPS=('127.0.0.1',), METRICS_TRUSTED_PROXIES=())
+class MetricsAccessTest(SimpleTestCase):
+  def setUp(self):
+    self.factory = RequestFactory()
+
+  def get(self, remote_addr, forwarded=None):
+    extra = {'REMOTE_ADDR': remote_addr}
+    if forwarded is not None:
+      extra['HTTP_X_FORWARDED_FOR'] = forwarded
+    return views.metrics(self.factory.get('/intel/metrics', **extra))
+
+  def test_allowed(self):
+    self.assertEqual(self.get('127.0.0.1').status_code, 200)
+
+  def test_spoofed_forwarded_for(self):
+    self.assertEqual(self.get('10.1.2.3', '127.0.0.1').status_code, 403)
+
+  @override_settings(METRICS_TRUSTED_PROXIES=('10.0.0.1',))
+  def test_trusted_proxy(self):
+    self.assertEqual(self.get('10.0.0.1', '127.0.0.1').status_code, 200)
+    # only the hop added by the proxy counts
+    self.assertEqual(self.get('10.0.0.1', '127.0.0.1, 10.1.2.3').status_code, 403)
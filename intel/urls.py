@@ -13,6 +13,7 @@ urlpatterns = patterns('',
   url(r'^delete_ip$', views.Delete_ip.as_view(), name='delete_ip'),
   url(r'^add_domain$', views.Add_domain.as_view(), name='add_domain'),
   url(r'^delete_domain$', views.Delete_domain.as_view(), name='delete_domain'),
+  url(r'^metrics$', views.metrics, name='metrics'),
 )
 
 # For development only
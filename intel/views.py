@@ -5,15 +5,20 @@ import ll_logger
 logger = ll_logger.Logger(level=logging.INFO)
 sys.excepthook = ll_logger.uncaught_exception_handler # Log all uncaught exceptions
 
-from django.http import HttpResponse, JsonResponse, HttpResponseBadRequest
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, HttpResponseBadRequest, HttpResponseForbidden
 from django.shortcuts import render
 from django.template import RequestContext, loader
 from django.views.generic import View
 from django.utils.decorators import method_decorator
 from django.contrib.auth.decorators import login_required # Currently only for index
 
+from papi_client import papi_client
+from papi_client import metrics as papi_metrics
+
 import ll_connect
 import ll_forms
+import ll_lists
 from ll_mixins import LoginRequiredMixin 
 from ll_debug import __debugvar__
 
@@ -27,18 +32,48 @@ signals.user_logged_in.connect(signalhandler.login)
 signals.user_logged_out.connect(signalhandler.logout)
 signals.user_login_failed.connect(signalhandler.failed_login)
 
-# Init connection and any other common data we need for views
-def __doinit__():
-  global logger
- 
-  api = ll_connect.APIConn(logger)
-  config_parser = api.load_config()
-  client = api.connect_api(config_parser)
-  client.load_all_views()
-  return({'logger': logger,
-         'api': api,
-         'config_parser': config_parser,
-         'client': client})
+# Connected API handles are shared by all requests of this process.
+# Views borrow one for the duration of a request: with api_pool.borrow() as api:
+api_pool = ll_connect.APIConnPool(logger)
+
+# Indexed copies of the blacklists for paged list requests
+list_store = ll_lists.ListStore(getattr(settings, 'INTEL_LIST_INDEX_MAX_AGE', 30))
+
+# Result of every entry of a bulk add in request order, from the entries
+# rejected by the form and the batches sent to the API:
+# {"results": [{"index": 0, "entry": "1.1.1.1", "status": "added"}, ..],
+#  "errors": ["2: ..."], "added": n, "invalid": n, "failed": n}
+def __bulkResponse__(classref, form, report):
+  data_type = classref.data_type
+  def value(entry):
+    return entry.get(data_type) if isinstance(entry, dict) else entry
+
+  results = [{'index': rejected['index'], 'entry': value(rejected['entry']),
+              'status': 'invalid', 'errors': rejected['errors']}
+             for rejected in form.rejected]
+  entries = form.cleaned_data['entries']
+  for batch in report.results():
+    for index, entry in entries[batch.first:batch.first + batch.count]:
+      result = {'index': index, 'entry': value(entry), 'status': 'added'}
+      if not batch.ok():
+        result.update(status='failed', errors=[unicode(batch.error)])
+      results.append(result)
+  results.sort(key=lambda result: result['index'])
+
+  response = {'results': results, 'added': 0, 'invalid': 0, 'failed': 0}
+  for result in results:
+    response[result['status']] += 1
+  response['errors'] = [u'{0} ({1}): {2}'.format(result['index'], result['entry'],
+                                                u'; '.join(result['errors']))
+                        for result in results if result['status'] != 'added']
+  return response
+
+# Manager is down (circuit breaker open), fail fast instead of waiting for it
+def __unavailable__(classref, error):
+  logger.warning(logger.to_request(classref, str(error)))
+  response = JsonResponse({'errors': [str(error)]}, status=503)
+  response['Retry-After'] = int(error.retry_in) + 1
+  return response
 
 def __formJsonError__(classref, form):
   # JS component expects errors to be wrapped with 'errors' tag.
@@ -48,7 +83,6 @@ def __formJsonError__(classref, form):
 
 @login_required
 def index(request):
-  logger.instance.addFilter(ll_logger.ContextFilter(request))
   #template = loader.get_template("ajax.html")
   #return HttpResponse(template.render(context))
   context = {
@@ -56,44 +90,120 @@ def index(request):
   }
   return render(request, 'intel/index.html', context)
 
+# Address of the scraper: REMOTE_ADDR, or for requests from one of
+# METRICS_TRUSTED_PROXIES the last X-Forwarded-For hop that is not a trusted
+# proxy. Forwarding headers of other clients are ignored, anyone can send them.
+def metrics_client_ip(request):
+  trusted = getattr(settings, 'METRICS_TRUSTED_PROXIES', ())
+  ip = request.META.get('REMOTE_ADDR')
+  if ip not in trusted:
+    return ip
+  forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+  for hop in reversed([h.strip() for h in forwarded.split(',') if h.strip()]):
+    ip = hop
+    if ip not in trusted:
+      break
+  return ip
+
+# PAPI request metrics of this process in the Prometheus text format, for
+# scrapers connecting from METRICS_ALLOWED_IPS (no login)
+def metrics(request):
+  if metrics_client_ip(request) not in getattr(settings, 'METRICS_ALLOWED_IPS', ('127.0.0.1', '::1')):
+    return HttpResponseForbidden()
+  return HttpResponse(papi_metrics.REGISTRY.render_prometheus(),
+                      content_type=papi_metrics.CONTENT_TYPE)
+
 
 # All ajax/API calls should in the future support querying multiple sites.
 # Extensibility, commanding multiple ll managers are goals here.
 
 # Blacklist related views 
 
-class List_ip(LoginRequiredMixin, View):
+# Base list class. Without page/limit parameters the whole list is returned,
+# otherwise a slice of it: ?page=0&limit=50&sort=impact&order=desc&filter=x
+# (filter_<column> filters a single column) returns
+# {"entries": [...], "total": n, "filtered": n, "page": n, "pages": n, ...}
+class ListView(LoginRequiredMixin, View):
+  data_type = 'ip' # Default
 
-  def get(self, request):
-    logger.instance.addFilter(ll_logger.ContextFilter(request))
-    lastline = __doinit__()
-    response = json.dumps(lastline['api'].ll_list_ip())
-    logger.debug(logger.to_request(self, response)) 
-    return HttpResponse(response, content_type='application/json')
+  def list(self, api):
+    return api.ll_list_ip()
 
-class List_domain(LoginRequiredMixin, View):
+  def fetch(self):
+    with api_pool.borrow() as api:
+      return self.list(api)
 
   def get(self, request):
-    logger.instance.addFilter(ll_logger.ContextFilter(request))
-    lastline = __doinit__()
-    response = json.dumps(lastline['client'].intel.list_domain())
-    logger.debug(logger.to_request(self, response)) 
-    return HttpResponse(response, content_type='application/json')
+    query = None
+    if 'page' in request.GET or 'limit' in request.GET:
+      try:
+        query = ll_lists.parse_query(request.GET, self.data_type,
+                                     getattr(settings, 'INTEL_LIST_MAX_LIMIT', 500))
+      except ValueError as e:
+        logger.error(logger.to_request(self, str(e)))
+        return HttpResponseBadRequest(str(e))
+
+    stale = False
+    try:
+      if ll_connect.circuit_open():
+        raise ll_connect.circuit_error()
+      if query is None:
+        data = self.fetch()
+      else:
+        index = list_store.get(self.data_type, self.fetch)
+    except papi_client.CircuitOpenError as e:
+      # Manager is down, answer from the last indexed copy if there is one
+      index = list_store.peek(self.data_type)
+      if index is None:
+        return __unavailable__(self, e)
+      data = index.entries
+      stale = True
+
+    if query is None:
+      response = json.dumps(data)
+      logger.debug(logger.to_request(self, response))
+    else:
+      result = index.query(**query)
+      result['stale'] = stale
+      response = json.dumps(result)
+      logger.debug(logger.to_request(self, json.dumps(request.GET)))
+    response = HttpResponse(response, content_type='application/json')
+    if stale:
+      response['Warning'] = '110 - "Response is stale"'
+    return response
+
+class List_ip(ListView):
+  data_type = 'ip'
+
+  def list(self, api):
+    return api.ll_list_ip()
+
+class List_domain(ListView):
+  data_type = 'domain'
+
+  def list(self, api):
+    return api.ll_list_domain()
 
 # Base blacklist class that all blacklist views extend
 class BlacklistView(LoginRequiredMixin, View):
   form_class = ll_forms.Add_ipForm # Default
+  data_type = 'ip'
 
   def form_valid(self, form):
     # By default only give error
     return HttpResponseBadRequest('')
 
   def post(self, request, *args, **kwargs):
-    logger.instance.addFilter(ll_logger.ContextFilter(request))
     form = self.form_class(request.POST) 
     if form.is_valid(): 
       logger.info(logger.to_request(self, json.dumps(form.cleaned_data['entries'])))
-      response = self.form_valid(form) # Call classes form_valid()
+      try:
+        if ll_connect.circuit_open():
+          raise ll_connect.circuit_error()
+        response = self.form_valid(form) # Call classes form_valid()
+      except papi_client.CircuitOpenError as e:
+        return __unavailable__(self, e)
+      list_store.invalidate(self.data_type) # Next paged list request refetches
       logger.info(logger.to_request(self, json.dumps(response), act='response'))
       return JsonResponse(response)
     else:
@@ -103,34 +213,40 @@ class BlacklistView(LoginRequiredMixin, View):
 # Extends BlacklistView to add IP addresses
 class Add_ip(BlacklistView):
   form_class = ll_forms.Add_ipForm
+  data_type = 'ip'
 
   def form_valid(self, form):
-    lastline = __doinit__()
-    # Note extra [] for list 
-    return lastline['api'].ll_add_ip([form.cleaned_data['entries']])
+    entries = [entry for index, entry in form.cleaned_data['entries']]
+    with api_pool.borrow() as api:
+      report = api.ll_bulk_add(self.data_type, entries)
+    return __bulkResponse__(self, form, report)
 
 # Extends BlacklistView to delete IP addresses
 class Delete_ip(BlacklistView):
   form_class = ll_forms.Delete_ipForm
+  data_type = 'ip'
 
   def form_valid(self, form):
-    lastline = __doinit__()
-    return lastline['api'].ll_delete_ip(form.cleaned_data['entries'])
+    with api_pool.borrow() as api:
+      return api.ll_delete_ip(form.cleaned_data['entries'])
 
 # Extends BlacklistView to add domains
 class Add_domain(BlacklistView):
   form_class = ll_forms.Add_domainForm
+  data_type = 'domain'
 
   def form_valid(self, form):
-    lastline = __doinit__()
-    # Note extra [] for list 
-    return lastline['api'].ll_add_domain([form.cleaned_data['entries']])
+    entries = [entry for index, entry in form.cleaned_data['entries']]
+    with api_pool.borrow() as api:
+      report = api.ll_bulk_add(self.data_type, entries)
+    return __bulkResponse__(self, form, report)
 
 # Extends BlacklistView to delete domains
 class Delete_domain(BlacklistView):
   form_class = ll_forms.Delete_domainForm
+  data_type = 'domain'
 
   def form_valid(self, form):
-    lastline = __doinit__()
     # Note extra [] for list 
-    return lastline['api'].ll_delete_domain(form.cleaned_data['entries'])
+    with api_pool.borrow() as api:
+      return api.ll_delete_domain(form.cleaned_data['entries'])
@@ -42,7 +42,7 @@ MIDDLEWARE_CLASSES = (
     'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'request_provider.middleware.RequestProvider'
+    'intel.ll_logger.RequestContextMiddleware'
 )
 
 ROOT_URLCONF = 'lastline_api.urls'
@@ -72,6 +72,63 @@ USE_TZ = True
 
 # Lastline PAPI client configuration file path
 PAPI_CLIENTCONF = os.path.join(BASE_DIR, "config/papi_client.ini")
+# Section of PAPI_CLIENTCONF describing the manager the app talks to
+PAPI_CLIENT_SECTION = 'papi'
+
+# Cache read-only PAPI responses (list/get calls, appliance overview and
+# configuration) for up to a minute: None (disabled), 'memory' (per process,
+# at most PAPI_RESPONSE_CACHE_SIZE responses) or 'file' (shared by all
+# processes through PAPI_RESPONSE_CACHE_DIR).
+PAPI_RESPONSE_CACHE = None
+PAPI_RESPONSE_CACHE_SIZE = 1024
+PAPI_RESPONSE_CACHE_DIR = os.path.join(BASE_DIR, "cache/papi_responses")
+
+# Connected PAPI clients kept per process (per mod_wsgi process, shared by its
+# threads). Requests wait up to PAPI_CLIENT_POOL_TIMEOUT seconds for a free
+# client, idle clients are pinged after PAPI_CLIENT_POOL_CHECK_INTERVAL seconds.
+PAPI_CLIENT_POOL_SIZE = 8
+PAPI_CLIENT_POOL_TIMEOUT = 30
+PAPI_CLIENT_POOL_CHECK_INTERVAL = 300
+
+# Requests to a manager fail at once after PAPI_CIRCUIT_FAILURES consecutive
+# connection failures, until a probe after PAPI_CIRCUIT_RESET seconds gets
+# through. Lists are then answered from their last indexed copy if there is
+# one. None disables the circuit breaker.
+PAPI_CIRCUIT_FAILURES = 5
+PAPI_CIRCUIT_RESET = 30
+
+# PAPI request metrics are served at /intel/metrics (Prometheus text format,
+# per process) to these addresses only. X-Forwarded-For is only looked at for
+# requests from METRICS_TRUSTED_PROXIES, e.g. a reverse proxy in front of
+# Apache.
+METRICS_ALLOWED_IPS = ('127.0.0.1', '::1')
+METRICS_TRUSTED_PROXIES = ()
+
+# PAPI session cookies are reused by all processes for at most
+# PAPI_SESSION_MAX_AGE seconds. Only one process logs in at a time, the others
+# wait up to PAPI_SESSION_LOGIN_LEASE seconds for its session.
+PAPI_SESSION_MAX_AGE = 1800
+PAPI_SESSION_LOGIN_LEASE = 30
+PAPI_SESSION_POLL_INTERVAL = 0.2
+
+# Local mirror of the intel feeds used for listing blacklists, shared by all
+# processes. Disabled (always list from the manager) if None.
+INTEL_FEED_MIRROR_DIR = None
+INTEL_FEED_MIRROR_MAX_AGE = 60
+
+# Paged blacklist requests are answered from an indexed copy of the list kept
+# per process, refetched after INTEL_LIST_INDEX_MAX_AGE seconds or a change.
+# At most INTEL_LIST_MAX_LIMIT entries are returned per page.
+INTEL_LIST_INDEX_MAX_AGE = 30
+INTEL_LIST_MAX_LIMIT = 500
+
+# Add requests take up to INTEL_ADD_MAX_ENTRIES entries (INTEL_ADD_MAX_LENGTH
+# bytes of JSON), sent to the API in batches of INTEL_ADD_BATCH_SIZE entries
+# by INTEL_ADD_WORKERS threads.
+INTEL_ADD_MAX_LENGTH = 4194304
+INTEL_ADD_MAX_ENTRIES = 10000
+INTEL_ADD_BATCH_SIZE = 1000
+INTEL_ADD_WORKERS = 1
 
 # Only affects 'manage.py collectstatic' when it moves file here
 STATIC_ROOT = os.path.join(BASE_DIR, "static")
@@ -81,6 +138,18 @@ STATICFILES_DIRS = (
   os.path.join(BASE_DIR, "lastline_api/static"),
 )
 STATIC_URL = '/static/'
+
+# Log records are written to syslog by a background thread when LOG_ASYNC is
+# set. At most LOG_QUEUE_SIZE records wait for it, on overflow the new record
+# ('drop_new') or the oldest one ('drop_old') is dropped. Longer messages than
+# LOG_MAX_MESSAGE_LENGTH chars (0 for no limit) are truncated and only every
+# LOG_SAMPLE_LARGE-th of them is logged.
+LOG_ASYNC = False
+LOG_QUEUE_SIZE = 10000
+LOG_QUEUE_OVERFLOW = 'drop_new'
+LOG_MAX_MESSAGE_LENGTH = 8192
+LOG_SAMPLE_LARGE = 1
+
 LOGIN_URL = '/login'
 LOGOUT_URL = '/'
 LOGIN_REDIRECT_URL = '/intel'
@@ -0,0 +1,397 @@
+#!/usr/bin/python
+"""
+Waiting for appliance actions.
+
+PapiClientApplianceMgmt.configure() and friends start an action on an
+appliance and return right away; whether it worked is only known once
+get_action_status() says so. Instead of every caller polling on its own,
+the ActionTracker of the view polls all outstanding actions from one
+background thread and resolves a Future per action::
+
+    future = client.appliance_mgmt.track_action(action_uuid)
+    status = future.result()  # raises ActionFailed or ActionTimeout
+
+Callers waiting for the same action share its Future, so the number of
+status requests does not grow with the number of waiters. Actions are
+polled often while they are young and more rarely as they get older.
+"""
+# so that we don't import papi_client.papi_client instead of papi_client
+from __future__ import absolute_import
+
+import threading
+import time
+
+import papi_client.errors
+import papi_client.papi_client
+import papi_client.workers
+
+
+# Outcomes of an action
+PENDING = "PENDING"
+SUCCEEDED = "SUCCEEDED"
+FAILED = "FAILED"
+
+# get_action_status() values of completed actions
+SUCCESS_STATUSES = frozenset([
+    "SUCCESS", "SUCCEEDED", "SUCCESSFUL", "COMPLETED", "DONE", "FINISHED", "OK",
+])
+FAILURE_STATUSES = frozenset([
+    "FAILED", "FAILURE", "ERROR", "CANCELLED", "CANCELED", "ABORTED",
+    "REJECTED", "TIMEOUT", "TIMED_OUT",
+])
+
+
+class Error(papi_client.errors.Error):
+    """
+    Base class for all exceptions in this module
+    """
+
+
+class ActionFailed(Error):
+    """
+    The appliance reported that the action failed
+    """
+
+
+class ActionTimeout(Error):
+    """
+    The action did not complete in time
+    """
+
+
+class TrackerClosed(Error):
+    """
+    The ActionTracker was closed before the action completed
+    """
+
+
+def action_uuid_of(response):
+    """
+    :param response: response of PapiClientApplianceMgmt.configure(), a
+        dict with the action_uuid or the action_uuid itself
+    :return: the action_uuid
+    :raises: Error if there is none
+    """
+    if isinstance(response, dict):
+        action_uuid = response.get("action_uuid")
+    else:
+        action_uuid = response
+    if not action_uuid or not isinstance(action_uuid, basestring):
+        raise Error("No action_uuid in response %r" % (response,))
+    return action_uuid
+
+
+def action_outcome(status):
+    """
+    Interpret a get_action_status() response.
+
+    :return: SUCCEEDED, FAILED or PENDING
+    """
+    if isinstance(status, dict):
+        status = status.get("status", status.get("state"))
+    value = str(status or "").upper()
+    if value in SUCCESS_STATUSES:
+        return SUCCEEDED
+    if value in FAILURE_STATUSES:
+        return FAILED
+    return PENDING
+
+
+class _Action(object):
+    def __init__(self, action_uuid, user_id, callback, added, next_poll):
+        self.action_uuid = action_uuid
+        self.user_id = user_id
+        self.callback = callback
+        self.added = added
+        self.next_poll = next_poll
+        self.status = None
+        self.error = None
+
+
+class ActionPoller(object):
+    """
+    Tracks the status of many actions from a single loop.
+
+    An action is polled again after a fraction (backoff) of its age, within
+    [min_interval, max_interval]: short actions are noticed quickly, while
+    long ones do not cost a request every few seconds. Actions are kept per
+    user_id and the due actions of a user are polled together.
+
+    :param appliance_mgmt: a PapiClientApplianceMgmt
+    :param min_interval: seconds between the first polls of an action
+    :param max_interval: maximum seconds between two polls of an action
+    :param backoff: poll interval as a fraction of the age of the action
+    :param timeout: seconds after which an action that did not complete is
+        reported failed
+    :param outcome: callable(status) interpreting get_action_status()
+        responses, see action_outcome()
+    :param logger: python logger to which we will log
+    :param clock: callable returning the current time in seconds
+    :param sleep: callable(seconds) used by wait() for the next poll
+    """
+    def __init__(self, appliance_mgmt, min_interval=2.0, max_interval=60.0,
+                 backoff=0.25, timeout=3600, outcome=action_outcome,
+                 logger=None, clock=time.time, sleep=time.sleep):
+        if min_interval <= 0 or max_interval < min_interval:
+            raise papi_client.papi_client.InvalidArgument(
+                "Need 0 < min_interval <= max_interval")
+        self._api = appliance_mgmt
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._backoff = backoff
+        self._timeout = timeout
+        self._outcome = outcome
+        self._logger = logger
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        # user_id -> action_uuid -> _Action
+        self._actions = {}
+        self._requests = 0
+
+    def add(self, action_uuid, callback, user_id=None):
+        """
+        Track an action until it completes.
+
+        :param callback: callable(action_uuid, outcome, status, error)
+            called once with outcome SUCCEEDED or FAILED, from the thread
+            calling poll() or wait()
+        :param user_id: as for get_action_status()
+        """
+        now = self._clock()
+        with self._lock:
+            self._actions.setdefault(user_id, {})[action_uuid] = _Action(
+                action_uuid, user_id, callback, now, now + self._min_interval)
+
+    def remove_all(self):
+        """
+        Stop tracking all actions, without calling their callbacks.
+
+        :return: list of (user_id, action_uuid) of the actions removed
+        """
+        with self._lock:
+            removed = [(user_id, action_uuid)
+                       for user_id, actions in self._actions.iteritems()
+                       for action_uuid in actions]
+            self._actions = {}
+        return removed
+
+    def pending(self):
+        """
+        :return: number of actions which did not complete yet
+        """
+        with self._lock:
+            return sum(len(actions) for actions in self._actions.itervalues())
+
+    def requests(self):
+        """
+        :return: number of get_action_status() requests sent
+        """
+        with self._lock:
+            return self._requests
+
+    def interval(self, age):
+        """
+        :return: seconds until the next poll of an action of this age
+        """
+        return min(self._max_interval,
+                   max(self._min_interval, age * self._backoff))
+
+    def poll(self):
+        """
+        Poll all actions which are due.
+
+        :return: seconds until the next action is due, None if there are no
+            actions left
+        """
+        now = self._clock()
+        with self._lock:
+            # the actions of a user one after the other
+            due = [action for actions in self._actions.itervalues()
+                   for action in sorted(actions.itervalues(),
+                                        key=lambda action: action.next_poll)
+                   if action.next_poll <= now]
+        for action in due:
+            self.__poll(action)
+        with self._lock:
+            next_polls = [action.next_poll
+                          for actions in self._actions.itervalues()
+                          for action in actions.itervalues()]
+        if not next_polls:
+            return None
+        return max(0, min(next_polls) - self._clock())
+
+    def wait(self):
+        """
+        Poll until all actions completed.
+        """
+        while True:
+            delay = self.poll()
+            if delay is None:
+                return
+            if delay > 0:
+                self._sleep(delay)
+
+    def __poll(self, action):
+        try:
+            status = self._api.get_action_status(action.action_uuid,
+                                                 user_id=action.user_id)
+        except Exception as e:  # pylint: disable=W0703
+            # transient for all we know: try again until the timeout, so
+            # that every action is resolved eventually
+            outcome = PENDING
+            action.error = e
+            if self._logger:
+                self._logger.warning("Cannot get status of action %s: %s",
+                                     action.action_uuid, e)
+        else:
+            outcome = self._outcome(status)
+            action.status = status
+            action.error = None
+
+        now = self._clock()
+        age = now - action.added
+        with self._lock:
+            self._requests += 1
+            actions = self._actions.get(action.user_id, {})
+            if actions.get(action.action_uuid) is not action:
+                # removed meanwhile
+                return
+            if outcome == PENDING and age < self._timeout:
+                action.next_poll = now + self.interval(age)
+                return
+            del actions[action.action_uuid]
+            if not actions:
+                del self._actions[action.user_id]
+
+        error = None
+        if outcome == PENDING:
+            outcome = FAILED
+            error = ActionTimeout("Action %s did not complete after %ds%s" % (
+                action.action_uuid, age,
+                ": %s" % action.error if action.error else ""))
+        elif outcome == FAILED:
+            error = ActionFailed("Action %s failed: %r" % (
+                action.action_uuid, action.status))
+        action.callback(action.action_uuid, outcome, action.status, error)
+
+
+class ActionTracker(object):
+    """
+    Background service resolving a Future per action.
+
+    A daemon thread is started with the first action and polls with an
+    ActionPoller; it waits without requests while there is nothing to
+    track. Future callbacks run on that thread and should not block.
+
+    :param appliance_mgmt: a PapiClientApplianceMgmt
+    :param kwargs: ActionPoller parameters (min_interval, max_interval,
+        backoff, timeout, outcome, logger, clock)
+    """
+    def __init__(self, appliance_mgmt, **kwargs):
+        self._poller = ActionPoller(appliance_mgmt, **kwargs)
+        self._logger = kwargs.get("logger")
+        self._cond = threading.Condition(threading.Lock())
+        # (user_id, action_uuid) -> Future
+        self._futures = {}
+        self._added = False
+        self._closed = False
+        self._thread = None
+
+    def track(self, action_uuid, user_id=None, callback=None):
+        """
+        Wait for an action in the background.
+
+        :param user_id: as for get_action_status()
+        :param callback: optional callable(future) called once the action
+            completed
+        :return: `papi_client.workers.Future` whose result is the final
+            get_action_status() response, or which raises ActionFailed or
+            ActionTimeout
+        :raises: TrackerClosed
+        """
+        key = (user_id, action_uuid)
+        with self._cond:
+            if self._closed:
+                raise TrackerClosed("Cannot track actions after close()")
+            future = self._futures.get(key)
+            if future is None:
+                future = papi_client.workers.Future()
+                self._futures[key] = future
+                self._poller.add(
+                    action_uuid,
+                    lambda _uuid, outcome, status, error:
+                    self.__done(key, outcome, status, error),
+                    user_id=user_id)
+                self._added = True
+                self.__start()
+                self._cond.notify()
+        if callback is not None:
+            future.add_done_callback(callback)
+        return future
+
+    def pending(self):
+        """
+        :return: number of actions which did not complete yet
+        """
+        return self._poller.pending()
+
+    def requests(self):
+        """
+        :return: number of get_action_status() requests sent
+        """
+        return self._poller.requests()
+
+    def close(self):
+        """
+        Stop the background thread; the Futures of actions which did not
+        complete raise TrackerClosed.
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        self._poller.remove_all()
+        with self._cond:
+            futures, self._futures = self._futures.values(), {}
+        error = TrackerClosed("Action tracker was closed")
+        for future in futures:
+            future.set_exception((TrackerClosed, error, None))
+
+    def __start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.__run,
+                                            name="papi-action-tracker")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def __run(self):
+        while True:
+            delay = self._poller.poll()
+            with self._cond:
+                if self._closed:
+                    return
+                if not self._added:
+                    self._cond.wait(delay)
+                self._added = False
+                if self._closed:
+                    return
+
+    def __done(self, key, outcome, status, error):
+        with self._cond:
+            future = self._futures.pop(key, None)
+        if future is None:
+            return
+        try:
+            if outcome == SUCCEEDED:
+                future.set_result(status)
+            else:
+                future.set_exception((type(error), error, None))
+        except Exception:  # pylint: disable=W0703
+            # a failing callback must not stop the poller
+            if self._logger:
+                self._logger.exception("Action callback failed")
@@ -4,6 +4,9 @@ PAPI client view for talking to the Appliance Management API
 :Copyright:
      Copyright 2014 Lastline, Inc.  All Rights Reserved.
 """
+import threading
+
+from papi_client import actions
 from papi_client import loader
 from papi_client import papi_client
 
@@ -35,6 +38,8 @@ class PapiClientApplianceMgmt(loader.PapiViewClient):
         loader.PapiViewClient.__init__(self, "appliance_mgmt", base_client,
                                        logger=logger,
                                        description="Appliance Management API")
+        self._tracker = None
+        self._tracker_lock = threading.Lock()
 
     def ping(self, raw=False):
         """
@@ -133,3 +138,37 @@ class PapiClientApplianceMgmt(loader.PapiViewClient):
             params["user_id"] = int(user_id)
 
         return self._get("action/status", params=params, raw=raw)
+
+    def action_tracker(self):
+        """
+        The `papi_client.actions.ActionTracker` polling the status of all
+        actions tracked through this client; created on first use.
+        """
+        with self._tracker_lock:
+            if self._tracker is None:
+                self._tracker = actions.ActionTracker(self,
+                                                      logger=self._logger)
+            return self._tracker
+
+    def set_action_tracker(self, tracker):
+        """
+        Track actions with the given `papi_client.actions.ActionTracker`,
+        e.g. one with other poll intervals or shared with other clients.
+        """
+        with self._tracker_lock:
+            self._tracker = tracker
+
+    def track_action(self, action_uuid, user_id=None, callback=None):
+        """
+        Wait for an action to complete in the background. All waiters share
+        one poller, see `papi_client.actions`.
+
+        :param action_uuid: Unique identifier of the Action
+        :param callback: optional callable(future) called once the action
+            completed
+        :return: `papi_client.workers.Future` whose result is the final
+            response of `get_action_status()`; it raises
+            `papi_client.actions.ActionFailed` if the action failed
+        """
+        return self.action_tracker().track(action_uuid, user_id=user_id,
+                                           callback=callback)
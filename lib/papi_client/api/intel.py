@@ -267,8 +267,6 @@ class PapiClientIntel(loader.PapiViewClient):
             This can be 10-100 in increments of 10.
         """
         entries_str = json.dumps(entries)
-        print "THE ENTRIES" 
-        print entries_str
         params = {"entries":entries_str}
         if key:
             params.update(self._get_key_params(key))
@@ -64,6 +64,9 @@ class PapiClientPostprocessing(loader.PapiViewClient):
         :param score: score of the task: 0-100 (required)
         :param licenses: sequence of access keys (required)
         :param raw: if True, return raw JSON instead of parsed response data
+
+        To announce many tasks without waiting for each request, see
+        `papi_client.completion_queue.CompletionQueue`.
         """
         #conversts sequence to list,
         #and increases determinism
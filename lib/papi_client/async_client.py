@@ -0,0 +1,137 @@
+#!/usr/bin/python
+"""
+Concurrent PAPI client returning futures instead of results.
+
+AsyncPapiClient exposes the same login(), logout() and do_request()
+interface as PapiClient, but runs the blocking requests on a WorkerPool
+and returns a papi_client.workers.Future right away. Since view clients
+only forward do_request() results, any PapiViewClient subclass can be
+built on top of it and its methods then return futures as well::
+
+    base_client = papi_client.PapiClientFactory.client_from_config(
+        conf, "papi", logger)
+    async_client = AsyncPapiClient(base_client, concurrency=32)
+    intel_view = intel.PapiClientIntel(async_client, logger)
+
+    futures = [intel_view.get_ip(ip) for ip in ips]
+    results = [f.result() for f in futures]
+
+Retries and error handling are exactly the ones of the wrapped PapiClient.
+"""
+# so that we don't import papi_client.papi_client instead of papi_client
+from __future__ import absolute_import
+
+import threading
+
+import papi_client.loader
+import papi_client.papi_client
+import papi_client.workers
+
+
+class AsyncPapiClient(object):
+    """
+    Wrap a PapiClient so that its requests run concurrently.
+
+    :param base_client: the PapiClient that actually sends the requests.
+        Its connection pool should allow at least `concurrency` connections
+        (see pool_maxsize) for requests to really run in parallel.
+    :param concurrency: maximum number of requests in flight
+    :param logger: python logger to which we will log
+    """
+    # do_request() returns a Future, see PapiViewClient._get()
+    returns_futures = True
+
+    def __init__(self, base_client, concurrency=8, logger=None):
+        self._client = base_client
+        self._logger = logger
+        self._pool = papi_client.workers.WorkerPool(workers=concurrency,
+                                                    name="papi-async")
+        # Login is not safe to run from several threads at once
+        self._login_lock = threading.Lock()
+
+    def base_client(self):
+        return self._client
+
+    def close(self):
+        """
+        Wait for outstanding requests and stop the worker threads.
+        """
+        self._pool.shutdown(wait=True)
+
+    def login(self, raw=False):
+        return self._pool.submit(self.__login, raw)
+
+    def logout(self):
+        return self._pool.submit(self._client.logout)
+
+    def do_request(self, method, module, function, params=None, data=None,
+                   files=None, url=None, fmt="JSON", raw=False, stream=False,
+                   output=None,
+                   chunk_size=papi_client.papi_client.DOWNLOAD_CHUNK_SIZE,
+                   resume=True):
+        """
+        Same as PapiClient.do_request(), but returns a Future. With stream,
+        the result is the iterator over the chunks of the body, which is
+        read by the thread consuming it.
+        """
+        return self._pool.submit(self.__do_request, method, module, function,
+                                 params=params, data=data, files=files,
+                                 url=url, fmt=fmt, raw=raw, stream=stream,
+                                 output=output, chunk_size=chunk_size,
+                                 resume=resume)
+
+    def ping(self, module="", fmt="JSON", raw=False):
+        return self.do_request(method="GET", module=module, function="ping",
+                               fmt=fmt, raw=raw)
+
+    def map(self, fn, items):
+        """
+        Call fn(item) for all items, at most `concurrency` at a time.
+
+        fn is called on the worker threads and is expected to use the
+        blocking base client, e.g. a method of a view built on it.
+
+        :return: list of Futures in the order of items
+        """
+        return [self._pool.submit(self.__call, fn, item) for item in items]
+
+    def __login(self, raw=False):
+        with self._login_lock:
+            return self._client.login(raw=raw)
+
+    def __ensure_logged_in(self):
+        # Make sure the first batch of concurrent requests does not log in
+        # once per request.
+        if not self._client.is_logged_in():
+            with self._login_lock:
+                if not self._client.is_logged_in():
+                    self._client.login()
+
+    def __call(self, fn, item):
+        self.__ensure_logged_in()
+        return fn(item)
+
+    def __do_request(self, *args, **kwargs):
+        self.__ensure_logged_in()
+        return self._client.do_request(*args, **kwargs)
+
+    @staticmethod
+    def _get_key_params(key):
+        return papi_client.papi_client.PapiClient._get_key_params(key)
+
+
+class AsyncPapiClientCollection(papi_client.loader.PapiClientCollection):
+    """
+    PapiClientCollection whose views return futures.
+
+    :param base_client: the blocking PapiClient to wrap
+    :param concurrency: maximum number of requests in flight
+    """
+    def __init__(self, base_client, conf, logger=None, concurrency=8):
+        async_client = AsyncPapiClient(base_client, concurrency=concurrency,
+                                       logger=logger)
+        papi_client.loader.PapiClientCollection.__init__(
+            self, async_client, conf, logger=logger)
+
+    def close(self):
+        self.base_client().close()
@@ -0,0 +1,164 @@
+#!/usr/bin/python
+"""
+Circuit breakers for PAPI managers.
+
+While a manager is down, every request waits for the full client timeout
+before it fails. A CircuitBreaker set on the PapiClient (or configured with
+the breaker_* options of its config section) counts consecutive failures
+and opens after failure_threshold of them: requests then fail at once with
+CircuitOpenError. After reset_timeout seconds a single probe request is let
+through (half-open); if it succeeds the breaker closes, otherwise it stays
+open for another reset_timeout::
+
+    client.set_circuit_breaker(get_breaker(url, failure_threshold=5))
+    ...
+    if get_breaker(url).is_open():
+        return cached_data()
+
+Only communication errors and HTTP 5xx responses count as failures; API
+errors show that the manager is up. Breakers are shared by all clients of
+a process talking to the same URL, see get_breaker().
+"""
+# so that we don't import papi_client.papi_client instead of papi_client
+from __future__ import absolute_import
+
+import threading
+import time
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(url, **options):
+    """
+    Get the breaker of a manager, creating it on first use.
+
+    :param url: base URL of the manager
+    :param options: CircuitBreaker arguments, only used when the breaker
+        is created
+    """
+    with _breakers_lock:
+        if url not in _breakers:
+            _breakers[url] = CircuitBreaker(url, **options)
+        return _breakers[url]
+
+
+def breakers():
+    """
+    :return: dict mapping URL to CircuitBreaker of all breakers created
+    """
+    with _breakers_lock:
+        return dict(_breakers)
+
+
+class CircuitBreaker(object):
+    """
+    :param name: what the breaker protects, usually the manager URL
+    :param failure_threshold: consecutive failures after which to open
+    :param reset_timeout: seconds to fail fast before probing
+    :param clock: callable returning the current time in seconds
+    """
+    def __init__(self, name, failure_threshold=5, reset_timeout=30,
+                 clock=time.time):
+        if failure_threshold < 1:
+            raise ValueError("failure_threshold must be positive")
+        self.name = name
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probe_started = None
+        self._stats = {"opened": 0, "rejected": 0, "probes": 0}
+
+    def allow(self):
+        """
+        Check whether a request may be sent now. In half-open state only
+        the first caller is allowed, as the probe.
+
+        :return: False if the request should fail fast
+        """
+        with self._lock:
+            now = self._clock()
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and \
+                    now - self._opened_at < self._reset_timeout:
+                self._stats["rejected"] += 1
+                return False
+            if self._state == HALF_OPEN and \
+                    now - self._probe_started < self._reset_timeout:
+                # a probe is in flight
+                self._stats["rejected"] += 1
+                return False
+            self._state = HALF_OPEN
+            self._probe_started = now
+            self._stats["probes"] += 1
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._opened_at = None
+            self._probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or \
+                    self._failures >= self._failure_threshold:
+                if self._state != OPEN:
+                    self._stats["opened"] += 1
+                self._state = OPEN
+                self._opened_at = self._clock()
+                self._probe_started = None
+
+    def state(self):
+        """
+        :return: CLOSED, OPEN or HALF_OPEN
+        """
+        with self._lock:
+            return self._state
+
+    def is_open(self):
+        """
+        Check whether requests fail fast right now, i.e. the breaker is
+        open or half-open with a probe in flight.
+        """
+        return self.retry_in() > 0
+
+    def retry_in(self):
+        """
+        :return: seconds until the next request may be sent, 0 if now
+        """
+        with self._lock:
+            now = self._clock()
+            if self._state == OPEN:
+                since = self._opened_at
+            elif self._state == HALF_OPEN:
+                since = self._probe_started
+            else:
+                return 0
+            return max(0, since + self._reset_timeout - now)
+
+    def stats(self):
+        """
+        :return: dict with state, consecutive failures, how often the
+            breaker opened, rejected requests and probes
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["state"] = self._state
+            stats["failures"] = self._failures
+        return stats
+
+    def __repr__(self):
+        return "<CircuitBreaker %s: %s>" % (self.name, self.state())
@@ -0,0 +1,337 @@
+#!/usr/bin/python
+"""
+Chunked, parallel bulk upload of custom intelligence.
+
+PapiClientIntel.add_ip() and friends send all entries in a single request,
+which runs into server limits and timeouts for large feeds and cannot be
+retried partially. BulkUploader splits the entries into batches bounded by
+entry count and encoded size, sends them from a pool of worker threads,
+retries only the batches that failed and reports the outcome per batch::
+
+    uploader = BulkUploader(client.intel, max_entries=1000, workers=4)
+    report = uploader.add_ip(entries, key)
+    if not report.ok():
+        retry_later(report.failed_entries())
+
+Entries are consumed lazily, so they can come from a generator; at most
+a few batches per worker are held in memory at any time.
+"""
+# so that we don't import papi_client.papi_client instead of papi_client
+from __future__ import absolute_import
+
+import threading
+import time
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+import papi_client.papi_client
+import papi_client.workers
+
+
+def json_size(entry):
+    """
+    Bytes an entry adds to a JSON encoded list (including the separator)
+    """
+    return len(json.dumps(entry)) + 2
+
+
+def csv_size(value):
+    """
+    Bytes a value adds to a comma separated list (including the separator)
+    """
+    return len(value) + 1
+
+
+class Batch(object):
+    """
+    A chunk of consecutive entries of a bulk upload
+
+    :param index: 0-based number of this batch
+    :param first: 0-based position of the first entry in the input
+    """
+    def __init__(self, index, first, entries, size):
+        self.index = index
+        self.first = first
+        self.entries = entries
+        self.size = size
+
+
+class BatchResult(object):
+    """
+    Outcome of sending a single batch
+
+    The entries are only kept for failed batches, so that they can be
+    retried later without keeping the whole feed in memory.
+    """
+    def __init__(self, batch, attempts, duration, result=None, error=None):
+        self.index = batch.index
+        self.first = batch.first
+        self.count = len(batch.entries)
+        self.size = batch.size
+        self.attempts = attempts
+        self.duration = duration
+        self.result = result
+        self.error = error
+        self.entries = batch.entries if error is not None else None
+
+    def ok(self):
+        return self.error is None
+
+    def last(self):
+        """
+        0-based position of the last entry of this batch in the input
+        """
+        return self.first + self.count - 1
+
+    def __repr__(self):
+        return "<BatchResult %d: entries %d-%d, %s after %d attempt(s)>" % (
+            self.index, self.first, self.last(),
+            "ok" if self.ok() else "failed: %s" % self.error, self.attempts)
+
+
+class BulkReport(object):
+    """
+    Per-batch results of a bulk upload; safe to fill from several threads.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results = []
+
+    def add(self, batch_result):
+        with self._lock:
+            self._results.append(batch_result)
+
+    def results(self):
+        """
+        :return: list of BatchResult, ordered by batch index
+        """
+        with self._lock:
+            return sorted(self._results, key=lambda r: r.index)
+
+    def failed(self):
+        return [r for r in self.results() if not r.ok()]
+
+    def ok(self):
+        return not self.failed()
+
+    def failed_entries(self):
+        entries = []
+        for result in self.failed():
+            entries.extend(result.entries)
+        return entries
+
+    def summary(self):
+        """
+        :return: dict with batch and entry counts
+        """
+        results = self.results()
+        failed = [r for r in results if not r.ok()]
+        return {
+            "batches": len(results),
+            "failed_batches": len(failed),
+            "entries": sum(r.count for r in results),
+            "failed_entries": sum(r.count for r in failed),
+            "bytes": sum(r.size for r in results),
+            "retries": sum(r.attempts - 1 for r in results),
+        }
+
+
+class BulkUploader(object):
+    """
+    Send large add/delete requests of an intel view in bounded batches.
+
+    :param intel_view: a `papi_client.api.intel.PapiClientIntel`
+    :param max_entries: maximum number of entries per request
+    :param max_bytes: maximum encoded size of the entries of a request; a
+        single entry exceeding it is sent on its own
+    :param workers: number of requests in flight at the same time
+    :param max_attempts: attempts per batch before it is reported failed
+    :param retry_delay: seconds before the first retry of a batch, doubled
+        for every further retry
+    :param retry_on: exception classes for which a batch is retried
+    :param progress: optional callable(BatchResult) invoked as soon as a
+        batch is done; called from worker threads
+    :param logger: python logger to which we will log
+    """
+    def __init__(self, intel_view, max_entries=1000, max_bytes=512 * 1024,
+                 workers=4, max_attempts=3, retry_delay=1.0,
+                 retry_on=(papi_client.papi_client.CommunicationError,),
+                 progress=None, logger=None):
+        if max_entries < 1:
+            raise papi_client.papi_client.InvalidArgument(
+                "max_entries must be positive")
+        if workers < 1:
+            raise papi_client.papi_client.InvalidArgument(
+                "workers must be positive")
+
+        self._view = intel_view
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._workers = workers
+        self._max_attempts = max(1, max_attempts)
+        self._retry_delay = retry_delay
+        self._retry_on = retry_on
+        self._progress = progress
+        self._logger = logger
+
+    def add_ip(self, entries, key=None):
+        """
+        Bulk version of PapiClientIntel.add_ip()
+
+        :return: BulkReport
+        """
+        return self.run(lambda batch: self._view.add_ip(batch, key), entries,
+                        json_size)
+
+    def add_domain(self, entries, key=None):
+        """
+        Bulk version of PapiClientIntel.add_domain()
+        """
+        return self.run(lambda batch: self._view.add_domain(batch, key),
+                        entries, json_size)
+
+    def add_ids_rule(self, entries, key=None):
+        """
+        Bulk version of PapiClientIntel.add_ids_rule()
+        """
+        return self.run(lambda batch: self._view.add_ids_rule(batch, key),
+                        entries, json_size)
+
+    def delete_ip(self, ips, key=None):
+        """
+        Bulk version of PapiClientIntel.delete_ip()
+        """
+        return self.run(lambda batch: self._view.delete_ip(batch, key), ips,
+                        csv_size)
+
+    def delete_domain(self, domains, key=None):
+        """
+        Bulk version of PapiClientIntel.delete_domain()
+        """
+        return self.run(lambda batch: self._view.delete_domain(batch, key),
+                        domains, csv_size)
+
+    def delete_ids_rule(self, rules, key=None):
+        """
+        Bulk version of PapiClientIntel.delete_ids_rule()
+        """
+        return self.run(lambda batch: self._view.delete_ids_rule(batch, key),
+                        rules, json_size)
+
+    def batches(self, entries, measure):
+        """
+        Split entries into Batch objects.
+
+        :param entries: iterable of entries, consumed lazily
+        :param measure: callable(entry) returning its encoded size in bytes
+        """
+        index = 0
+        first = 0
+        chunk = []
+        size = 0
+        for position, entry in enumerate(entries):
+            entry_size = measure(entry)
+            if chunk and (len(chunk) >= self._max_entries or
+                          size + entry_size > self._max_bytes):
+                yield Batch(index, first, chunk, size)
+                index += 1
+                first = position
+                chunk = []
+                size = 0
+            chunk.append(entry)
+            size += entry_size
+        if chunk:
+            yield Batch(index, first, chunk, size)
+
+    def run(self, send, entries, measure):
+        """
+        Send all entries in batches.
+
+        :param send: callable(list of entries) doing a single API request
+        :param entries: iterable of entries
+        :param measure: callable(entry) returning its encoded size in bytes
+        :return: BulkReport
+        """
+        report = BulkReport()
+        batches = self.batches(entries, measure)
+
+        # The first batch goes out on this thread, so that the workers find
+        # an established session and do not all log in at once.
+        first = next(batches, None)
+        if first is None:
+            return report
+        self.__finish(report, self.__send(send, first))
+
+        pool = papi_client.workers.WorkerPool(workers=self._workers,
+                                              max_pending=self._workers,
+                                              name="papi-bulk")
+        try:
+            for batch in batches:
+                future = pool.submit(self.__send, send, batch)
+                future.add_done_callback(
+                    lambda f, batch=batch: self.__finish_future(report, batch,
+                                                                f))
+        finally:
+            pool.shutdown(wait=True)
+
+        if self._logger:
+            self._logger.info("Bulk upload done: %s", report.summary())
+        return report
+
+    def __finish_future(self, report, batch, future):
+        # never re-raise on the worker thread: the batch would be lost from
+        # the report
+        error = future.exception()
+        if error is not None:
+            self.__finish(report, BatchResult(batch, 1, 0, error=error))
+        else:
+            self.__finish(report, future.result())
+
+    def __finish(self, report, batch_result):
+        report.add(batch_result)
+        if self._logger:
+            if batch_result.ok():
+                self._logger.debug("%r", batch_result)
+            else:
+                self._logger.error("%r", batch_result)
+        if self._progress:
+            self._progress(batch_result)
+
+    def __send(self, send, batch):
+        """
+        Send a batch, retrying it on the configured errors.
+
+        :return: BatchResult; never raises for API or communication errors
+        """
+        start = time.time()
+        delay = self._retry_delay
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result = send(batch.entries)
+            except self._retry_on as e:
+                if attempt >= self._max_attempts:
+                    return BatchResult(batch, attempt, time.time() - start,
+                                       error=e)
+                if self._logger:
+                    self._logger.warning("Batch %d failed (%s), retrying in "
+                                         "%.1fs", batch.index, e, delay)
+                time.sleep(delay)
+                delay *= 2
+            except papi_client.papi_client.Error as e:
+                return BatchResult(batch, attempt, time.time() - start,
+                                   error=e)
+            except Exception as e:  # pylint: disable=W0703
+                # e.g. a bug in the view: report the batch failed
+                if self._logger:
+                    self._logger.exception("Batch %d failed unexpectedly",
+                                           batch.index)
+                return BatchResult(batch, attempt, time.time() - start,
+                                   error=e)
+            else:
+                return BatchResult(batch, attempt, time.time() - start,
+                                   result=result)
@@ -0,0 +1,378 @@
+#!/usr/bin/python
+"""
+Response cache for read-only PAPI calls.
+
+Dashboards and scripts call list_ip(), get_ip(), get_overview() etc. with
+the same parameters over and over. A ResponseCache set on the views of a
+collection answers these calls from a cache for a configurable number of
+seconds per function::
+
+    response_cache = ResponseCache(LRUCache(max_entries=1024))
+    client = loader.PapiClientCollection(base_client, conf, logger,
+                                         cache=response_cache)
+
+Writes through _post() (add_*, delete_*, configure) invalidate the cached
+responses of their module and scope key: every cache key contains a
+generation token of the (module, scope) it depends on, and a write replaces
+the token. Responses read at a specific scope only depend on that scope;
+all other reads (no key, inherit_scope, modules without scope keys) depend
+on the module as a whole, which every write to the module invalidates.
+
+Two backends are provided: LRUCache keeps entries in memory of one process,
+FileCache in a directory that several processes (e.g. mod_wsgi daemons)
+can share. Cache keys do not contain the server URL, so use one cache per
+manager.
+"""
+# so that we don't import papi_client.papi_client instead of papi_client
+from __future__ import absolute_import
+
+import copy
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+import papi_client.workers
+
+
+# Seconds to cache responses, by (module, function). Functions not listed
+# here are not cached.
+DEFAULT_TTLS = {
+    ("intel", "ip/list"): 60,
+    ("intel", "ip/get"): 60,
+    ("intel", "domain/list"): 60,
+    ("intel", "domain/get"): 60,
+    ("intel", "ids_rule/list"): 60,
+    ("intel", "ids_rule/get"): 60,
+    ("appliance_mgmt", "overview"): 30,
+    ("appliance_mgmt", "configuration"): 60,
+}
+
+# Scope that reads depend on when they may see more than a single scope
+MODULE_SCOPE = "*"
+
+
+def _new_token():
+    # unique across processes, so that two concurrent writes never end up
+    # with the same generation
+    return os.urandom(8).encode("hex")
+
+
+def _scope(params):
+    """
+    Scope of a request, from the key parameters it was sent with
+    """
+    if not params:
+        return None
+    if params.get("key"):
+        return str(params["key"])
+    if "key_id" not in params:
+        return None
+    if params.get("subkey_id"):
+        return "%s:%s" % (params["key_id"], params["subkey_id"])
+    return str(params["key_id"])
+
+
+class LRUCache(object):
+    """
+    In-memory cache backend, evicting the least recently used entries.
+
+    :param max_entries: maximum number of cached responses
+    """
+    def __init__(self, max_entries=1024):
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        # key -> [previous, next, key, (expires, value)], the links forming
+        # a circular list from least to most recently used around _root
+        self._entries = {}
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+        self._generations = {}
+
+    def get(self, key):
+        """
+        :return: (found, value)
+        """
+        with self._lock:
+            link = self._entries.get(key)
+            if link is None:
+                return False, None
+            self.__unlink(link)
+            expires, value = link[3]
+            if expires < time.time():
+                del self._entries[key]
+                return False, None
+            self.__append(link)
+        return True, copy.deepcopy(value)
+
+    def set(self, key, value, ttl):
+        entry = (time.time() + ttl, copy.deepcopy(value))
+        with self._lock:
+            link = self._entries.get(key)
+            if link is not None:
+                self.__unlink(link)
+                link[3] = entry
+            else:
+                link = [None, None, key, entry]
+                self._entries[key] = link
+            self.__append(link)
+            while len(self._entries) > self._max_entries:
+                oldest = self._root[1]
+                self.__unlink(oldest)
+                del self._entries[oldest[2]]
+
+    def __append(self, link):
+        last = self._root[0]
+        link[0] = last
+        link[1] = self._root
+        last[1] = link
+        self._root[0] = link
+
+    @staticmethod
+    def __unlink(link):
+        previous, following = link[0], link[1]
+        previous[1] = following
+        following[0] = previous
+
+    def generation(self, namespace):
+        with self._lock:
+            if namespace not in self._generations:
+                self._generations[namespace] = _new_token()
+            return self._generations[namespace]
+
+    def bump(self, namespace):
+        with self._lock:
+            self._generations[namespace] = _new_token()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._root[:] = [self._root, self._root, None, None]
+            self._generations.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FileCache(object):
+    """
+    Cache backend keeping one JSON file per entry in a directory, so that
+    several processes can share it. Files are replaced atomically.
+
+    :param directory: where to keep the cache files
+    """
+    def __init__(self, directory):
+        self._directory = directory
+
+    def get(self, key):
+        try:
+            with open(self.__path("entries", key)) as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            return False, None
+        if entry["expires"] < time.time():
+            return False, None
+        return True, entry["value"]
+
+    def set(self, key, value, ttl):
+        self.__write(self.__path("entries", key),
+                     {"expires": time.time() + ttl, "value": value})
+
+    def generation(self, namespace):
+        path = self.__path("generations", namespace)
+        try:
+            with open(path) as f:
+                token = f.read()
+            if token:
+                return token
+        except IOError:
+            pass
+        self.bump(namespace)
+        with open(path) as f:
+            return f.read()
+
+    def bump(self, namespace):
+        self.__write(self.__path("generations", namespace), _new_token(),
+                     encode=False)
+
+    def prune(self):
+        """
+        Remove expired entries.
+
+        :return: number of removed entries
+        """
+        removed = 0
+        now = time.time()
+        for dirpath, _dirnames, filenames in os.walk(
+                os.path.join(self._directory, "entries")):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    with open(path) as f:
+                        expired = json.load(f)["expires"] < now
+                    if expired:
+                        os.unlink(path)
+                        removed += 1
+                except (IOError, OSError, ValueError, KeyError):
+                    pass
+        return removed
+
+    def __path(self, kind, key):
+        digest = hashlib.sha1(key).hexdigest()
+        return os.path.join(self._directory, kind, digest[:2], digest)
+
+    @staticmethod
+    def __write(path, value, encode=True):
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # created concurrently
+                if not os.path.isdir(directory):
+                    raise
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                if encode:
+                    json.dump(value, f)
+                else:
+                    f.write(value)
+            os.rename(tmp_path, path)
+        except:
+            os.unlink(tmp_path)
+            raise
+
+
+class ResponseCache(object):
+    """
+    Caches responses of read-only view functions and invalidates them on
+    writes to the same module and scope.
+
+    :param backend: LRUCache, FileCache or an object with the same methods
+    :param ttls: dict mapping (module, function) to seconds to cache the
+        response for; DEFAULT_TTLS if None
+    :param logger: python logger to which we will log
+    """
+    def __init__(self, backend=None, ttls=None, logger=None):
+        self._backend = backend if backend is not None else LRUCache()
+        self._ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def ttl(self, module, function):
+        return self._ttls.get((module, function), 0)
+
+    def set_ttl(self, module, function, ttl):
+        """
+        Change how long responses of a function are cached; 0 disables it
+        """
+        self._ttls[(module, function)] = ttl
+
+    def get(self, module, function, params, fmt, raw, call, future=False):
+        """
+        Return the cached response of a read, or call() and cache its
+        result.
+
+        :param call: callable sending the request
+        :param future: True if call() returns a `papi_client.workers.Future`
+            (views on an AsyncPapiClient); cached responses are then
+            returned as completed Futures as well
+        """
+        ttl = self.ttl(module, function)
+        if not ttl:
+            return call()
+
+        # The generation is looked up before sending, so that a response
+        # racing with a write is stored under the old generation.
+        key = self.__key(module, function, params, fmt, raw)
+        found, value = self._backend.get(key)
+        if found:
+            self.__count("hits")
+            if future:
+                completed = papi_client.workers.Future()
+                completed.set_result(value)
+                return completed
+            return value
+
+        self.__count("misses")
+        result = call()
+        if isinstance(result, papi_client.workers.Future):
+            # views on an AsyncPapiClient
+            result.add_done_callback(
+                lambda future: self.__store_future(key, future, ttl))
+        else:
+            self.__store(key, result, ttl)
+        return result
+
+    def written(self, module, params=None, data=None, result=None):
+        """
+        Invalidate the responses a write to module may have changed.
+
+        :param params: query parameters of the write
+        :param data: form data of the write, which usually holds the key
+        :param result: result of the write; if it is a Future, the
+            responses are invalidated again once it completes
+        """
+        scope = _scope(data) or _scope(params) or "global"
+        self.__invalidate(module, scope)
+        if isinstance(result, papi_client.workers.Future):
+            result.add_done_callback(
+                lambda future: self.__invalidate(module, scope))
+
+    def __invalidate(self, module, scope):
+        self._backend.bump(self.__namespace(module, scope))
+        self._backend.bump(self.__namespace(module, MODULE_SCOPE))
+        self.__count("invalidations")
+        if self._logger:
+            self._logger.debug("Invalidated cached %s responses for %s",
+                               module, scope)
+
+    def stats(self):
+        """
+        :return: dict with hits, misses, stores and invalidations
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        for name in ("hits", "misses", "stores", "invalidations"):
+            stats.setdefault(name, 0)
+        return stats
+
+    def __store(self, key, value, ttl):
+        try:
+            self._backend.set(key, value, ttl)
+        except (IOError, OSError, TypeError, ValueError) as e:
+            # caching is best effort
+            if self._logger:
+                self._logger.warning("Cannot cache response: %s", e)
+        else:
+            self.__count("stores")
+
+    def __store_future(self, key, future, ttl):
+        if future.exception() is None:
+            self.__store(key, future.result(), ttl)
+
+    def __count(self, name):
+        with self._lock:
+            self._stats[name] = self._stats.get(name, 0) + 1
+
+    @staticmethod
+    def __namespace(module, scope):
+        return "%s|%s" % (module, scope)
+
+    def __key(self, module, function, params, fmt, raw):
+        params = params or {}
+        scope = _scope(params)
+        if scope is None or params.get("inherit_scope"):
+            scope = MODULE_SCOPE
+        generation = self._backend.generation(self.__namespace(module,
+                                                               scope))
+        return json.dumps([module, function, params, fmt, bool(raw),
+                           generation], sort_keys=True)
@@ -0,0 +1,480 @@
+#!/usr/bin/python
+"""
+Durable queue of analysis_completed notifications.
+
+PapiClientPostprocessing.analysis_completed() sends one request per task,
+which a producer seeing thousands of completions per minute cannot afford
+to wait for. CompletionQueue takes notifications without touching the
+network, writes them to a journal file and sends them from a pool of
+sender threads::
+
+    queue = CompletionQueue(client.postprocessing,
+                            "/var/lib/lastline_api/completions", logger)
+    queue.put(task_uuid, score, licenses)
+    ...
+    queue.close()
+
+ - A notification for a task that is still queued replaces the queued one:
+   only the latest score of a rescored task is sent.
+ - Sending is retried with exponential backoff on communication errors;
+   other errors (e.g. an API error for an unknown task, or a bug raising
+   any other exception) fail the notification right away.
+ - Notifications not sent yet when the process ends are read back from the
+   journal and sent by the next CompletionQueue on the same directory.
+   Only one queue may use a directory at a time.
+
+The journal is appended to with every put() and every notification sent,
+and rewritten with just the queued notifications once it has grown enough.
+By default it is flushed to the operating system but not synced to disk,
+which survives the process dying but not the machine; fsync=True syncs
+every record, at the cost of the producer waiting for the disk.
+
+Throughput and lag are recorded into a `papi_client.metrics`
+MetricsRegistry:
+
+ - papi_completion_queue_enqueued_total / _coalesced_total: notifications
+   put, and those which replaced a queued one
+ - papi_completion_queue_sent_total / _failed_total / _retries_total
+ - papi_completion_queue_lag_seconds: histogram of the time from put() to
+   the notification being sent
+"""
+# so that we don't import papi_client.papi_client instead of papi_client
+from __future__ import absolute_import
+
+import collections
+import heapq
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+import papi_client.errors
+import papi_client.metrics
+import papi_client.papi_client
+
+
+JOURNAL_FILE = "journal.log"
+
+# Lag ranges from milliseconds to hours while the manager is unreachable
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+
+
+class Error(papi_client.errors.Error):
+    """
+    Base class for all exceptions in this module
+    """
+
+
+class QueueClosed(Error):
+    """
+    A notification was put into a queue that has been closed
+    """
+
+
+class _Notification(object):
+    def __init__(self, seq, uuid, score, licenses, enqueued):
+        self.seq = seq
+        self.uuid = uuid
+        self.score = score
+        self.licenses = licenses
+        self.enqueued = enqueued
+        self.attempts = 0
+        self.next_attempt = 0
+
+    def record(self):
+        return {"seq": self.seq, "uuid": self.uuid, "score": self.score,
+                "licenses": self.licenses, "time": self.enqueued}
+
+
+def read_journal(path):
+    """
+    Replay a journal.
+
+    :return: (list of the records of the notifications not sent, ordered by
+        sequence number, highest sequence number in the journal)
+    """
+    latest = {}
+    done = set()
+    max_seq = 0
+    try:
+        f = open(path)
+    except IOError:
+        return [], 0
+    with f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # torn write of a process that died
+                continue
+            if "done" in record:
+                done.add(record["done"])
+                continue
+            max_seq = max(max_seq, record["seq"])
+            previous = latest.get(record["uuid"])
+            if previous is None or previous["seq"] < record["seq"]:
+                latest[record["uuid"]] = record
+    queued = [entry for entry in latest.itervalues()
+              if entry["seq"] not in done]
+    return sorted(queued, key=lambda entry: entry["seq"]), max_seq
+
+
+class CompletionQueue(object):
+    """
+    Send analysis_completed notifications in the background.
+
+    :param postprocessing_view: a PapiClientPostprocessing
+    :param directory: where to keep the journal
+    :param logger: python logger to which we will log
+    :param workers: number of sender threads
+    :param retry_delay: seconds before the first retry of a notification,
+        doubled for every further retry
+    :param max_retry_delay: upper bound of the retry delay
+    :param max_attempts: attempts before a notification is given up; None
+        retries until it is sent
+    :param retry_on: exception classes for which sending is retried
+    :param fsync: sync the journal to disk with every record
+    :param compact_after: journal records after which the journal is
+        rewritten, if most of them are obsolete
+    :param registry: MetricsRegistry to record into, the shared one of the
+        process by default
+    :param start: start the sender threads right away; otherwise call
+        start()
+    """
+    def __init__(self, postprocessing_view, directory, logger=None,
+                 workers=4, retry_delay=1.0, max_retry_delay=300,
+                 max_attempts=None,
+                 retry_on=(papi_client.papi_client.CommunicationError,),
+                 fsync=False, compact_after=10000, registry=None,
+                 start=True):
+        if workers < 1:
+            raise papi_client.papi_client.InvalidArgument(
+                "workers must be positive")
+
+        self._view = postprocessing_view
+        self._directory = directory
+        self._logger = logger
+        self._workers = workers
+        self._retry_delay = retry_delay
+        self._max_retry_delay = max_retry_delay
+        self._max_attempts = max_attempts
+        self._retry_on = retry_on
+        self._fsync = fsync
+        self._compact_after = compact_after
+        self.__init_metrics(registry or papi_client.metrics.REGISTRY)
+
+        self._cond = threading.Condition(threading.Lock())
+        self._closed = False
+        self._threads = []
+        # uuid -> _Notification not sent yet
+        self._pending = {}
+        # uuid -> _Notification being sent
+        self._in_flight = {}
+        # uuids which may be sent now, in order
+        self._ready = collections.deque()
+        # (next_attempt, seq, uuid) of notifications waiting for a retry
+        self._retries = []
+        self._sent = 0
+        self._failed = 0
+        self._coalesced = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._path = os.path.join(directory, JOURNAL_FILE)
+        records, self._seq = read_journal(self._path)
+        for record in records:
+            notification = _Notification(record["seq"], record["uuid"],
+                                         record["score"], record["licenses"],
+                                         record.get("time") or time.time())
+            self._pending[notification.uuid] = notification
+            self._ready.append(notification.uuid)
+        self._journal = None
+        self._records = 0
+        self.__compact()
+        if records and self._logger:
+            self._logger.info("Resuming %d notifications from %s",
+                              len(records), self._path)
+        if start:
+            self.start()
+
+    def __init_metrics(self, registry):
+        self._enqueued_total = registry.counter(
+            "papi_completion_queue_enqueued_total",
+            "analysis_completed notifications put into the queue")
+        self._coalesced_total = registry.counter(
+            "papi_completion_queue_coalesced_total",
+            "Notifications which replaced a queued one for the same task")
+        self._sent_total = registry.counter(
+            "papi_completion_queue_sent_total",
+            "Notifications sent")
+        self._failed_total = registry.counter(
+            "papi_completion_queue_failed_total",
+            "Notifications given up")
+        self._retries_total = registry.counter(
+            "papi_completion_queue_retries_total",
+            "Failed attempts to send a notification that were retried")
+        self._lag = registry.histogram(
+            "papi_completion_queue_lag_seconds",
+            "Time from queueing a notification to sending it",
+            buckets=LAG_BUCKETS)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def start(self):
+        """
+        Start the sender threads
+        """
+        with self._cond:
+            if self._threads:
+                return
+            if self._closed:
+                raise QueueClosed("Cannot start a closed queue")
+            for i in range(self._workers):
+                thread = threading.Thread(target=self.__send_loop,
+                                          name="papi-completion-%d" % i)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def put(self, uuid, score, licenses):
+        """
+        Queue the notification that an analysis task completed or was
+        rescored; see PapiClientPostprocessing.analysis_completed(). Never
+        waits for the network.
+
+        :raises: QueueClosed
+        """
+        licenses = sorted(licenses)
+        now = time.time()
+        with self._cond:
+            if self._closed:
+                raise QueueClosed("Cannot put into a closed queue")
+            self._seq += 1
+            notification = self._pending.get(uuid)
+            if notification is not None:
+                # only the latest score is sent; the lag counts from the
+                # first notification that was not sent
+                notification.seq = self._seq
+                notification.score = score
+                notification.licenses = licenses
+                self._coalesced += 1
+                self._coalesced_total.inc()
+            else:
+                notification = _Notification(self._seq, uuid, score, licenses,
+                                             now)
+                self._pending[uuid] = notification
+                if uuid not in self._in_flight:
+                    self._ready.append(uuid)
+                    self._cond.notify()
+            self.__write(notification.record())
+        self._enqueued_total.inc()
+
+    def flush(self, timeout=None):
+        """
+        Wait until all notifications were sent or given up.
+
+        :param timeout: seconds to wait, None waits forever
+        :return: True if the queue is empty
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._pending or self._in_flight:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                self._cond.wait(remaining)
+            return True
+
+    def close(self, timeout=None):
+        """
+        Stop accepting notifications and stop the senders once they are
+        done with the notifications they are sending; queued notifications
+        stay in the journal. Call flush() first to send them.
+
+        :param timeout: seconds to wait for each sender thread
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+            threads = list(self._threads)
+        for thread in threads:
+            thread.join(timeout)
+        with self._cond:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+    def stats(self):
+        """
+        :return: dict with the number of queued, in-flight, sent, failed and
+            coalesced notifications, and the age in seconds of the oldest
+            one not sent
+        """
+        now = time.time()
+        with self._cond:
+            waiting = self._pending.values() + self._in_flight.values()
+            return {
+                "queued": len(self._pending),
+                "in_flight": len(self._in_flight),
+                "sent": self._sent,
+                "failed": self._failed,
+                "coalesced": self._coalesced,
+                "oldest": max([now - n.enqueued for n in waiting] or [0]),
+            }
+
+    def __send_loop(self):
+        while True:
+            with self._cond:
+                notification = self.__next()
+                if notification is None:
+                    return
+            self.__send(notification)
+
+    def __next(self):
+        """
+        Wait for a notification that may be sent now and mark it in flight;
+        called with the lock held.
+
+        :return: _Notification, None once the queue is closed
+        """
+        while not self._closed:
+            now = time.time()
+            while self._retries and self._retries[0][0] <= now:
+                _, _, uuid = heapq.heappop(self._retries)
+                self._ready.append(uuid)
+            while self._ready:
+                uuid = self._ready.popleft()
+                notification = self._pending.get(uuid)
+                # stale: sent, in flight or still waiting for its retry
+                if notification is None or uuid in self._in_flight or \
+                        notification.next_attempt > now:
+                    continue
+                del self._pending[uuid]
+                self._in_flight[uuid] = notification
+                return notification
+            timeout = None
+            if self._retries:
+                timeout = max(0, self._retries[0][0] - now)
+            self._cond.wait(timeout)
+        return None
+
+    def __send(self, notification):
+        notification.attempts += 1
+        try:
+            self._view.analysis_completed(notification.uuid,
+                                          notification.score,
+                                          notification.licenses)
+        except self._retry_on as e:
+            if self._max_attempts is None or \
+                    notification.attempts < self._max_attempts:
+                self.__retry(notification, e)
+            else:
+                self.__done(notification, e)
+        except papi_client.errors.Error as e:
+            self.__done(notification, e)
+        except Exception as e:  # pylint: disable=W0703
+            # e.g. a bug in the view: give up this notification, but keep
+            # the sender alive
+            if self._logger:
+                self._logger.exception("Sending completion of %s failed "
+                                       "unexpectedly", notification.uuid)
+            self.__done(notification, e)
+        else:
+            self.__done(notification)
+
+    def __retry(self, notification, error):
+        delay = min(self._max_retry_delay,
+                    self._retry_delay * 2 ** (notification.attempts - 1))
+        if self._logger:
+            self._logger.warning("Sending completion of %s failed (%s), "
+                                 "retrying in %.1fs", notification.uuid,
+                                 error, delay)
+        self._retries_total.inc()
+        with self._cond:
+            del self._in_flight[notification.uuid]
+            newer = self._pending.get(notification.uuid)
+            if newer is not None:
+                # replaces this one, but backs off all the same
+                notification = newer
+            else:
+                self._pending[notification.uuid] = notification
+            notification.next_attempt = time.time() + delay
+            heapq.heappush(self._retries, (notification.next_attempt,
+                                           notification.seq,
+                                           notification.uuid))
+            # a sender may be waiting for a later retry
+            self._cond.notify()
+
+    def __done(self, notification, error=None):
+        now = time.time()
+        if error is None:
+            self._sent_total.inc()
+            self._lag.observe(now - notification.enqueued)
+        else:
+            self._failed_total.inc()
+            if self._logger:
+                self._logger.error("Giving up completion of %s after %d "
+                                   "attempt(s): %s", notification.uuid,
+                                   notification.attempts, error)
+        with self._cond:
+            del self._in_flight[notification.uuid]
+            if error is None:
+                self._sent += 1
+            else:
+                self._failed += 1
+            if notification.uuid in self._pending:
+                # put() while it was being sent
+                self._ready.append(notification.uuid)
+            self.__write({"done": notification.seq})
+            if self._records > self._compact_after and self._records > \
+                    2 * (len(self._pending) + len(self._in_flight)):
+                self.__compact()
+            self._cond.notify_all()
+
+    def __write(self, record):
+        # called with the lock held
+        if self._journal is None:
+            # closed: the notification is sent again by the next queue
+            return
+        self._journal.write(json.dumps(record) + "\n")
+        self._journal.flush()
+        self._records += 1
+        if self._fsync:
+            os.fsync(self._journal.fileno())
+
+    def __compact(self):
+        """
+        Rewrite the journal with the notifications not sent yet; called
+        with the lock held (or before there are other threads)
+        """
+        notifications = sorted(self._pending.values() +
+                               self._in_flight.values(),
+                               key=lambda n: n.seq)
+        fd, tmp_path = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                for notification in notifications:
+                    f.write(json.dumps(notification.record()) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp_path, self._path)
+        except:
+            os.unlink(tmp_path)
+            raise
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = open(self._path, "a")
+        self._records = len(notifications)
@@ -0,0 +1,357 @@
+#!/usr/bin/python
+"""
+Local, incrementally updated mirror of the custom intelligence feeds.
+
+The feed functions of the intel API (feed_ip, feed_domain, feed_ids_rule
+and feed_ids_rule_variable) take the version of the feed the caller
+already has and then only return what changed since. FeedMirror keeps one
+file per feed and scope key with the entries and the feed version, applies
+these deltas, and falls back to a full download whenever a delta cannot be
+applied. Readers can then use the local copy instead of pulling the full
+list from the manager every time::
+
+    mirror = FeedMirror("/var/lib/lastline_api/feeds", logger)
+    mirror.sync(client.intel, "ip", key)
+    ips = mirror.entries("ip", key)
+
+Feed responses are interpreted as follows: an empty response means no
+changes; a response with an "entries" list is a full feed; a response with
+"add" and/or "remove" lists is a delta on top of the version we sent.
+Removed items may be given as identifiers or as full entries.
+"""
+# so that we don't import papi_client.papi_client instead of papi_client
+from __future__ import absolute_import
+
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+import papi_client.errors
+import papi_client.papi_client
+
+
+GLOBAL_SCOPE = "global"
+
+FULL_KEYS = ("entries",)
+ADD_KEYS = ("add", "added")
+REMOVE_KEYS = ("remove", "removed", "delete", "deleted")
+
+
+class Error(papi_client.errors.Error):
+    """
+    Base class for all exceptions in this module
+    """
+
+
+class InvalidDelta(Error):
+    """
+    A feed delta cannot be applied to the local copy
+    """
+
+
+def _ids_rule_id(entry):
+    return "%s:%s" % (entry["rule_id"], entry.get("group_id") or 0)
+
+
+class Feed(object):
+    """
+    Description of one intel feed
+
+    :param name: name of the feed, also used as directory name
+    :param function: name of the PapiClientIntel method fetching the feed
+    :param identify: callable(entry) returning the unique id of an entry
+    """
+    def __init__(self, name, function, identify):
+        self.name = name
+        self.function = function
+        self.identify = identify
+
+    def entry_id(self, item):
+        """
+        Id of a full entry or of an item of a remove list
+        """
+        if isinstance(item, dict):
+            return self.identify(item)
+        return unicode(item)
+
+    def fetch(self, intel_view, key, current_version):
+        return getattr(intel_view, self.function)(
+            key=key, current_version=current_version)
+
+
+FEEDS = dict((feed.name, feed) for feed in [
+    Feed("ip", "feed_ip", lambda e: e["ip"]),
+    Feed("domain", "feed_domain", lambda e: e["domain"]),
+    Feed("ids_rule", "feed_ids_rule", _ids_rule_id),
+    Feed("ids_rule_variable", "feed_ids_rule_variable",
+         lambda e: e["variable_name"]),
+])
+
+
+def scope_of(key):
+    """
+    Scope string for a key as accepted by the intel view methods.
+    """
+    if not key:
+        return GLOBAL_SCOPE
+    if hasattr(key, "get_key_params"):
+        params = key.get_key_params()
+        if "subkey_id" in params:
+            return "%s:%s" % (params["key_id"], params["subkey_id"])
+        return str(params["key_id"])
+    return str(key)
+
+
+class FeedState(object):
+    """
+    Local copy of one feed at one scope
+
+    :param entries: dict mapping entry id to entry
+    :param synced: time of the last successful sync, 0 if stale
+    """
+    def __init__(self, feed, scope, version=None, entries=None, synced=0):
+        self.feed = feed
+        self.scope = scope
+        self.version = version
+        self.entries = entries if entries is not None else {}
+        self.synced = synced
+
+    def age(self):
+        return time.time() - self.synced
+
+    def to_dict(self):
+        return {
+            "feed": self.feed,
+            "scope": self.scope,
+            "version": self.version,
+            "synced": self.synced,
+            "entries": self.entries,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["feed"], data["scope"], data.get("version"),
+                   data.get("entries"), data.get("synced", 0))
+
+
+class FeedMirror(object):
+    """
+    On-disk mirror of intel feeds, kept per feed and scope key.
+
+    Safe to use from several threads; several processes can share the
+    directory, as files are replaced atomically and re-read when they
+    change.
+
+    :param directory: where to keep the mirror files
+    :param logger: python logger to which we will log
+    """
+    def __init__(self, directory, logger=None):
+        self._directory = directory
+        self._logger = logger
+        self._lock = threading.Lock()
+        self._scope_locks = {}
+        # (feed, scope) -> (file mtime, FeedState)
+        self._states = {}
+
+    def sync(self, intel_view, feed, key=None):
+        """
+        Bring the local copy of a feed up to date.
+
+        :param intel_view: a `papi_client.api.intel.PapiClientIntel`
+        :param feed: one of the names in FEEDS
+        :param key: scope key as for the intel view methods
+        :return: FeedState after the sync
+        """
+        feed = self.__feed(feed)
+        scope = scope_of(key)
+        with self.__scope_lock(feed.name, scope):
+            # Work on a copy, readers may hold on to the current state
+            current = self.__load(feed.name, scope)
+            state = FeedState(feed.name, scope, current.version,
+                              dict(current.entries))
+            if state.version is not None:
+                try:
+                    data = feed.fetch(intel_view, key, state.version)
+                    changed = self.__apply(feed, state, data)
+                except (papi_client.papi_client.ApiError, InvalidDelta) as e:
+                    if self._logger:
+                        self._logger.warning(
+                            "Delta of %s feed for %s from version %s "
+                            "rejected (%s), doing a full sync",
+                            feed.name, scope, state.version, e)
+                    state = FeedState(feed.name, scope)
+            if state.version is None:
+                data = feed.fetch(intel_view, key, None)
+                changed = self.__apply(feed, state, data)
+                if state.version is None and self._logger:
+                    self._logger.warning("Full %s feed for %s has no "
+                                         "version", feed.name, scope)
+
+            state.synced = time.time()
+            self.__save(state)
+            if self._logger:
+                self._logger.debug("Synced %s feed for %s: version %s, %d "
+                                   "entries, %d changes", feed.name, scope,
+                                   state.version, len(state.entries), changed)
+            return state
+
+    def refresh(self, intel_view, feed, key=None, max_age=60):
+        """
+        Sync the feed if the local copy is older than max_age seconds.
+
+        :return: list of entries
+        """
+        state = self.state(feed, key)
+        if state.version is None or state.age() > max_age:
+            state = self.sync(intel_view, feed, key)
+        return state.entries.values()
+
+    def state(self, feed, key=None):
+        """
+        :return: FeedState of the local copy, without talking to the API
+        """
+        feed = self.__feed(feed)
+        return self.__load(feed.name, scope_of(key))
+
+    def entries(self, feed, key=None):
+        """
+        :return: list of entries of the local copy
+        """
+        return self.state(feed, key).entries.values()
+
+    def invalidate(self, feed, key=None):
+        """
+        Mark the local copy as stale, e.g. after changing the blacklist, so
+        that the next refresh() syncs. The version is kept, so that sync
+        only needs to fetch a delta.
+        """
+        feed = self.__feed(feed)
+        scope = scope_of(key)
+        with self.__scope_lock(feed.name, scope):
+            state = self.__load(feed.name, scope)
+            if state.version is not None:
+                state.synced = 0
+                self.__save(state)
+
+    @staticmethod
+    def __feed(name):
+        try:
+            return FEEDS[name]
+        except KeyError:
+            raise papi_client.papi_client.InvalidArgument(
+                "Unknown feed '%s', expected one of %s" % (
+                    name, ", ".join(sorted(FEEDS))))
+
+    def __scope_lock(self, feed, scope):
+        with self._lock:
+            return self._scope_locks.setdefault((feed, scope),
+                                                threading.Lock())
+
+    def __apply(self, feed, state, data):
+        """
+        Apply a feed response to state.
+
+        :return: number of changed entries
+        :raises: InvalidDelta
+        """
+        if not data:
+            return 0
+        if not isinstance(data, dict):
+            raise InvalidDelta("Unexpected feed response %r" % type(data))
+
+        full = self.__first(data, FULL_KEYS)
+        added = self.__first(data, ADD_KEYS)
+        removed = self.__first(data, REMOVE_KEYS)
+
+        if full is not None:
+            state.entries = dict((feed.identify(e), e) for e in full)
+            changed = len(state.entries)
+        elif added is not None or removed is not None:
+            if state.version is None:
+                raise InvalidDelta("Delta without a base version")
+            changed = 0
+            for item in removed or []:
+                entry_id = feed.entry_id(item)
+                if state.entries.pop(entry_id, None) is None:
+                    raise InvalidDelta("Cannot remove unknown entry %s" %
+                                       entry_id)
+                changed += 1
+            for entry in added or []:
+                state.entries[feed.identify(entry)] = entry
+                changed += 1
+        else:
+            changed = 0
+
+        if data.get("version") is not None:
+            state.version = data["version"]
+        return changed
+
+    @staticmethod
+    def __first(data, keys):
+        for key in keys:
+            if key in data:
+                return data[key]
+        return None
+
+    def __path(self, feed, scope):
+        safe = re.sub(r"[^A-Za-z0-9_.-]", "_", scope)
+        digest = hashlib.sha1(scope).hexdigest()[:8]
+        return os.path.join(self._directory, feed,
+                            "%s-%s.json" % (safe, digest))
+
+    def __load(self, feed, scope):
+        path = self.__path(feed, scope)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return FeedState(feed, scope)
+
+        with self._lock:
+            cached = self._states.get((feed, scope))
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        try:
+            with open(path) as f:
+                state = FeedState.from_dict(json.load(f))
+        except (IOError, ValueError, KeyError) as e:
+            if self._logger:
+                self._logger.warning("Ignoring unreadable mirror file %s: %s",
+                                     path, e)
+            return FeedState(feed, scope)
+
+        with self._lock:
+            self._states[(feed, scope)] = (mtime, state)
+        return state
+
+    def __save(self, state):
+        path = self.__path(state.feed, state.scope)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # created concurrently
+                if not os.path.isdir(directory):
+                    raise
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(state.to_dict(), f)
+            os.rename(tmp_path, path)
+        except:
+            os.unlink(tmp_path)
+            raise
+
+        mtime = os.stat(path).st_mtime
+        with self._lock:
+            self._states[(state.feed, state.scope)] = (mtime, state)
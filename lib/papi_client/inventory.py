@@ -0,0 +1,365 @@
+#!/usr/bin/python
+"""
+Local, versioned snapshot of the configuration of all appliances.
+
+Finding out how the fleet is configured takes a get_overview() call and a
+get_configuration() call per appliance. Inventory fetches the
+configurations concurrently and keeps them in snapshot files, one per
+version, from which questions are answered without the API::
+
+    inventory = Inventory("/var/lib/lastline_api/inventory", logger)
+    snapshot = inventory.refresh(client.appliance_mgmt)
+    uuids = snapshot.find("sso_saml2_enabled1", True)
+
+A refresh only fetches the configuration of appliances which are new or
+whose overview entry changed since the last snapshot (fields which change
+all the time, like the time an appliance was last seen, are ignored), and of
+those whose configuration is older than max_age. Configurations that fail
+to download are taken over from the last snapshot and marked with the error.
+
+Settings are indexed by name and value: the top-level values of a
+configuration and the entries of its "settings" dict.
+"""
+# so that we don't import papi_client.papi_client instead of papi_client
+from __future__ import absolute_import
+
+import errno
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+import papi_client.errors
+import papi_client.workers
+
+
+# Overview fields which change without the configuration changing
+VOLATILE_FIELDS = frozenset([
+    "last_seen", "last_heartbeat", "last_contact", "last_update", "uptime",
+])
+
+UUID_FIELDS = ("appliance_uuid", "uuid")
+
+SNAPSHOT_FILE = re.compile(r"^snapshot-(\d+)\.json$")
+
+
+class Error(papi_client.errors.Error):
+    """
+    Base class for all exceptions in this module
+    """
+
+
+def overview_appliances(overview):
+    """
+    Appliances of a get_overview() response, which may be a dict by
+    appliance uuid, a list of appliances or a dict with such a list.
+
+    :return: dict mapping appliance uuid to its overview entry
+    :raises: Error if the response is not understood
+    """
+    if isinstance(overview, dict) and isinstance(overview.get("appliances"),
+                                                 (list, dict)):
+        overview = overview["appliances"]
+    if isinstance(overview, dict):
+        return dict((uuid, entry) for uuid, entry in overview.iteritems()
+                    if isinstance(entry, dict))
+    if isinstance(overview, list):
+        appliances = {}
+        for entry in overview:
+            for field in UUID_FIELDS:
+                if isinstance(entry, dict) and entry.get(field):
+                    appliances[entry[field]] = entry
+                    break
+            else:
+                raise Error("Overview entry without appliance uuid: %r" %
+                            (entry,))
+        return appliances
+    raise Error("Unexpected overview %r" % type(overview))
+
+
+def fingerprint(entry, volatile=VOLATILE_FIELDS):
+    """
+    :return: hash of an overview entry without its volatile fields
+    """
+    stable = dict((k, v) for k, v in entry.iteritems() if k not in volatile)
+    return hashlib.sha1(json.dumps(stable, sort_keys=True)).hexdigest()
+
+
+def configuration_settings(configuration):
+    """
+    :return: dict of the settings of a configuration: its top-level values
+        and the entries of its "settings" dict
+    """
+    if not isinstance(configuration, dict):
+        return {}
+    settings = dict((k, v) for k, v in configuration.iteritems()
+                    if k != "settings")
+    if isinstance(configuration.get("settings"), dict):
+        settings.update(configuration["settings"])
+    return settings
+
+
+def _value_key(value):
+    return json.dumps(value, sort_keys=True)
+
+
+class Snapshot(object):
+    """
+    One version of the inventory
+
+    :param appliances: dict mapping appliance uuid to a dict with its
+        overview entry, fingerprint, configuration, time the configuration
+        was fetched and the error of the last fetch, if it failed
+    """
+    def __init__(self, version=0, created=0, appliances=None):
+        self.version = version
+        self.created = created
+        self.appliances = appliances if appliances is not None else {}
+        self._index = None
+        self._index_lock = threading.Lock()
+
+    def to_dict(self):
+        return {
+            "version": self.version,
+            "created": self.created,
+            "appliances": self.appliances,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["version"], data.get("created", 0),
+                   data.get("appliances"))
+
+    def uuids(self):
+        return sorted(self.appliances)
+
+    def configuration(self, appliance_uuid):
+        """
+        :return: configuration of the appliance, None if not known
+        """
+        appliance = self.appliances.get(appliance_uuid)
+        return appliance and appliance.get("configuration")
+
+    def failed(self):
+        """
+        :return: dict mapping uuid to the error of appliances whose
+            configuration could not be fetched with this version
+        """
+        return dict((uuid, appliance["error"])
+                    for uuid, appliance in self.appliances.iteritems()
+                    if appliance.get("error"))
+
+    def __index(self):
+        with self._index_lock:
+            if self._index is None:
+                index = {}
+                for uuid, appliance in self.appliances.iteritems():
+                    settings = configuration_settings(
+                        appliance.get("configuration"))
+                    for name, value in settings.iteritems():
+                        index.setdefault(name, {}).setdefault(
+                            _value_key(value), set()).add(uuid)
+                self._index = index
+            return self._index
+
+    def find(self, setting, value):
+        """
+        :return: sorted uuids of the appliances having setting = value
+        """
+        uuids = self.__index().get(setting, {}).get(_value_key(value), ())
+        return sorted(uuids)
+
+    def values(self, setting):
+        """
+        :return: list of (value, sorted uuids) of all values of a setting
+        """
+        return sorted((json.loads(value), sorted(uuids)) for value, uuids
+                      in self.__index().get(setting, {}).iteritems())
+
+    def settings(self):
+        """
+        :return: sorted names of all settings of all appliances
+        """
+        return sorted(self.__index())
+
+
+class Inventory(object):
+    """
+    Versioned appliance configuration snapshots in a directory.
+
+    Several processes may read the directory while one refreshes it;
+    snapshots are written to a new file, replacing nothing.
+
+    :param directory: where to keep the snapshot files
+    :param logger: python logger to which we will log
+    :param concurrency: configurations fetched at the same time
+    :param keep: number of snapshot versions to keep
+    :param max_age: seconds after which configurations are fetched again
+        even if the overview of the appliance did not change; None never
+    :param volatile: overview fields to ignore when looking for changes
+    """
+    def __init__(self, directory, logger=None, concurrency=8, keep=10,
+                 max_age=None, volatile=VOLATILE_FIELDS):
+        if concurrency < 1:
+            raise Error("concurrency must be positive")
+        if keep < 1:
+            raise Error("keep must be positive")
+        self._directory = directory
+        self._logger = logger
+        self._concurrency = concurrency
+        self._keep = keep
+        self._max_age = max_age
+        self._volatile = frozenset(volatile)
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        # version -> Snapshot
+        self._snapshots = {}
+
+    def versions(self):
+        """
+        :return: sorted versions of the snapshots on disk
+        """
+        try:
+            names = os.listdir(self._directory)
+        except OSError:
+            return []
+        return sorted(int(match.group(1)) for match in
+                      (SNAPSHOT_FILE.match(name) for name in names) if match)
+
+    def snapshot(self, version=None):
+        """
+        :param version: version to load, the latest one if None
+        :return: Snapshot; an empty one with version 0 if there is none
+        :raises: Error if the version does not exist
+        """
+        if version is None:
+            versions = self.versions()
+            if not versions:
+                return Snapshot()
+            version = versions[-1]
+        with self._lock:
+            cached = self._snapshots.get(version)
+        if cached is not None:
+            return cached
+        try:
+            with open(self.__path(version)) as f:
+                snapshot = Snapshot.from_dict(json.load(f))
+        except (IOError, ValueError, KeyError) as e:
+            raise Error("Cannot read inventory version %s: %s" % (version, e))
+        with self._lock:
+            self._snapshots[version] = snapshot
+        return snapshot
+
+    def refresh(self, appliance_mgmt, user_id=None, full=False):
+        """
+        Fetch the overview and the configurations that changed, and store
+        them as a new snapshot version.
+
+        :param appliance_mgmt: a PapiClientApplianceMgmt
+        :param user_id: as for get_overview()/get_configuration()
+        :param full: fetch all configurations
+        :return: the new Snapshot
+        """
+        with self._refresh_lock:
+            current = self.snapshot()
+            appliances = overview_appliances(
+                appliance_mgmt.get_overview(user_id=user_id))
+
+            now = time.time()
+            result = {}
+            stale = []
+            for uuid, entry in appliances.iteritems():
+                previous = current.appliances.get(uuid)
+                result[uuid] = {
+                    "overview": entry,
+                    "fingerprint": fingerprint(entry, self._volatile),
+                }
+                if self.__unchanged(previous, result[uuid], now) and not full:
+                    for field in ["configuration", "fetched", "error"]:
+                        result[uuid][field] = previous.get(field)
+                else:
+                    stale.append(uuid)
+
+            def fetch(uuid):
+                return appliance_mgmt.get_configuration(uuid, user_id=user_id)
+
+            futures = papi_client.workers.fan_out(fetch, stale,
+                                                  self._concurrency)
+            for uuid, future in zip(stale, futures):
+                error = future.exception()
+                previous = current.appliances.get(uuid) or {}
+                if error is None:
+                    result[uuid].update(configuration=future.result(),
+                                        fetched=time.time(), error=None)
+                else:
+                    if self._logger:
+                        self._logger.warning("Cannot fetch configuration of "
+                                             "%s: %s", uuid, error)
+                    result[uuid].update(
+                        configuration=previous.get("configuration"),
+                        fetched=previous.get("fetched"),
+                        error=str(error) or error.__class__.__name__)
+
+            snapshot = Snapshot(current.version + 1, now, result)
+            self.__save(snapshot)
+            if self._logger:
+                self._logger.info("Inventory version %d: %d appliances, %d "
+                                  "configurations fetched, %d failed",
+                                  snapshot.version, len(result), len(stale),
+                                  len(snapshot.failed()))
+            return snapshot
+
+    def __unchanged(self, previous, appliance, now):
+        if previous is None or previous.get("error") or \
+                previous.get("configuration") is None:
+            return False
+        if previous.get("fingerprint") != appliance["fingerprint"]:
+            return False
+        if self._max_age is not None and \
+                now - (previous.get("fetched") or 0) > self._max_age:
+            return False
+        return True
+
+    def __path(self, version):
+        return os.path.join(self._directory, "snapshot-%d.json" % version)
+
+    def __save(self, snapshot):
+        if not os.path.isdir(self._directory):
+            try:
+                os.makedirs(self._directory)
+            except OSError:
+                # created concurrently
+                if not os.path.isdir(self._directory):
+                    raise
+
+        fd, tmp_path = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(snapshot.to_dict(), f)
+            # unlike rename, link does not replace a version another
+            # process wrote in the meantime
+            os.link(tmp_path, self.__path(snapshot.version))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            raise Error("Inventory version %d was written concurrently" %
+                        snapshot.version)
+        finally:
+            os.unlink(tmp_path)
+
+        with self._lock:
+            self._snapshots[snapshot.version] = snapshot
+        for version in self.versions()[:-self._keep]:
+            try:
+                os.unlink(self.__path(version))
+            except OSError:
+                pass
+            with self._lock:
+                self._snapshots.pop(version, None)
@@ -8,9 +8,11 @@ Loader for papi clients for all supported papi API views
 # so that we don't import papi_client.papi_client instead of papi_client
 from __future__ import absolute_import
 
+import ConfigParser
+import os
 import sys
-import inspect
-import pkgutil
+import threading
+import types
 
 import papi_client.api
 import papi_client.errors
@@ -68,11 +70,38 @@ def import_module(name):
     return sys.modules[name]
 
 
+def _api_modules():
+    """
+    Names of the modules of papi_client.api. Like pkgutil.iter_modules(),
+    which imports inspect though, and that takes longer than the scan.
+    """
+    names = set()
+    for directory in papi_client.api.__path__:
+        try:
+            filenames = os.listdir(directory)
+        except OSError:
+            continue
+        for filename in filenames:
+            name, ext = os.path.splitext(filename)
+            if ext in (".py", ".pyc", ".pyo") and name != "__init__":
+                names.add(name)
+    return sorted(names)
+
+
+def _isclass(obj):
+    # same as inspect.isclass(); importing inspect takes longer than
+    # building a collection with all views
+    return isinstance(obj, (type, types.ClassType))
+
+
 class PapiViewClient(object):
     """
     Abstract base class for a client that can send API requests
     to a view (a module) of the PAPI.
     """
+    # Optional `papi_client.cache.ResponseCache`, see set_cache()
+    _cache = None
+
     @classmethod
     def client_from_config(cls, base_client, conf, logger=None):
         """
@@ -133,47 +162,234 @@ class PapiViewClient(object):
             return self._description
         return self.name() + " API"
     
+    def set_cache(self, cache):
+        """
+        Answer read-only requests from a cache.
+
+        :param cache: a `papi_client.cache.ResponseCache`, or None to
+            disable caching
+        """
+        self._cache = cache
+
     def _get(self, function, params=None, fmt="JSON", raw=False):
-        return self._client.do_request(
+        call = lambda: self._client.do_request(
             method="GET",
             module=self.module_name(),
             function=function,
             params=params,
             fmt=fmt,
             raw=raw)
+        if self._cache is None:
+            return call()
+        return self._cache.get(self.module_name(), function, params, fmt,
+                               raw, call,
+                               future=getattr(self._client, "returns_futures",
+                                              False))
     
     def _post(self, function, params=None, data=None, files=None, fmt="JSON", raw=False):
+        result = None
+        try:
+            result = self._client.do_request(
+                method="POST",
+                module=self.module_name(),
+                function=function,
+                params=params,
+                data=data,
+                files=files,
+                fmt=fmt,
+                raw=raw)
+            return result
+        finally:
+            # also after errors, the write may have been applied partially
+            if self._cache is not None:
+                self._cache.written(self.module_name(), params, data, result)
+    
+    def _download(self, function, output=None, params=None, data=None,
+                  fmt="JSON"):
+        """
+        Get the raw response of a function without holding it in memory;
+        it is never cached. The request is a POST if there is data.
+
+        :param output: file-like object or path to write the body to, see
+            PapiClient.do_request(); if None, return an iterator over chunks
+            of the body
+        """
         return self._client.do_request(
-            method="POST",
+            method="POST" if data is not None else "GET",
             module=self.module_name(),
             function=function,
             params=params,
             data=data,
-            files=files,
             fmt=fmt,
-            raw=raw)
-    
+            raw=True,
+            stream=output is None,
+            output=output)
+
     @staticmethod
     def _get_key_params(key):
         return papi_client.papi_client.PapiClient._get_key_params(key)
 
 
+# Views shipped with the client, name -> "module:class"
+BUILTIN_VIEWS = {
+    "appliance_mgmt": "papi_client.api.appliance_mgmt:PapiClientApplianceMgmt",
+    "intel": "papi_client.api.intel:PapiClientIntel",
+    "postprocessing": "papi_client.api.postprocessing:PapiClientPostprocessing",
+}
+
+# Entry point group through which other packages provide views
+ENTRY_POINT_GROUP = "papi_client.views"
+
+
+def _entry_points():
+    """
+    Read the views of ENTRY_POINT_GROUP from the entry_points.txt files of
+    the distributions on sys.path. This is what pkg_resources does, whose
+    import alone takes longer than creating all views.
+
+    :return: list of (name, "module:class")
+    """
+    entry_points = []
+    for path in sys.path:
+        try:
+            entries = os.listdir(path or ".")
+        except OSError:
+            continue
+        for entry in entries:
+            if not entry.endswith((".dist-info", ".egg-info")):
+                continue
+            conf = ConfigParser.RawConfigParser()
+            conf.optionxform = str
+            try:
+                if not conf.read(os.path.join(path, entry,
+                                              "entry_points.txt")):
+                    continue
+            except ConfigParser.Error:
+                continue
+            if not conf.has_section(ENTRY_POINT_GROUP):
+                continue
+            for name, value in conf.items(ENTRY_POINT_GROUP):
+                # drop extras: "module:class [extra]"
+                entry_points.append((name, value.split("[")[0].strip()))
+    return entry_points
+
+
+class ViewRegistry(object):
+    """
+    The view classes of this process by view name.
+
+    Views are registered explicitly with register(), through an entry point
+    of the papi_client.views group, or as modules of papi_client.api. Entry
+    points and modules are only looked for once, the first time all names
+    are needed or an unknown name is asked for. The module of a view is only
+    imported when its class is first asked for.
+
+    :param views: dict of views to register, see register()
+    """
+    def __init__(self, views=None):
+        self._lock = threading.RLock()
+        self._views = dict(views or {})
+        self._classes = {}
+        self._discovered = False
+
+    def register(self, name, view_class):
+        """
+        :param view_class: PapiViewClient subclass, or "module:class" to
+            import on first use
+        """
+        with self._lock:
+            self._views[name] = view_class
+            self._classes.pop(name, None)
+
+    def names(self):
+        self.__discover()
+        with self._lock:
+            return sorted(self._views)
+
+    def has(self, name):
+        with self._lock:
+            if name not in self._views:
+                self.__discover()
+            return name in self._views
+
+    def get(self, name):
+        """
+        :return: PapiViewClient subclass of the view
+        :raises: NoSuchView
+        """
+        with self._lock:
+            view_class = self._classes.get(name)
+            if view_class is None:
+                if not self.has(name):
+                    raise NoSuchView(name)
+                view_class = self.__resolve(name, self._views[name])
+                self._classes[name] = view_class
+            return view_class
+
+    def __discover(self):
+        with self._lock:
+            if self._discovered:
+                return
+            self._discovered = True
+            for name in _api_modules():
+                self._views.setdefault(name, "papi_client.api.%s" % name)
+            for name, view in _entry_points():
+                self._views.setdefault(name, view)
+
+    @staticmethod
+    def __resolve(name, view):
+        if _isclass(view):
+            view_class = view
+        else:
+            module_name, _, class_name = view.partition(":")
+            try:
+                module = import_module(module_name)
+            except ImportError:
+                raise NoSuchView(name)
+            if not class_name:
+                return PapiViewLoader.get_view_class_from_module(module)
+            try:
+                view_class = getattr(module, class_name)
+            except AttributeError:
+                raise NoSuchView(name)
+        if not _isclass(view_class) or \
+                not issubclass(view_class, PapiViewClient):
+            raise UnexpectedView("%s: %r is not a PapiViewClient" % (
+                name, view_class))
+        return view_class
+
+
+_registry = ViewRegistry(BUILTIN_VIEWS)
+
+
+def register_view(name, view_class):
+    """
+    Make a view available to all PapiClientCollections of this process.
+
+    :param view_class: PapiViewClient subclass, or "module:class" to import
+        it on first use
+    """
+    _registry.register(name, view_class)
+
+
+def registered_views():
+    """
+    :return: sorted names of all views available
+    """
+    return _registry.names()
+
+
 class PapiViewLoader(object):
 
     @staticmethod
     def get_view_class_from_name(name):
-        module_name = "papi_client.api.%s" % name
-        try:
-            module = import_module(module_name)
-        except ImportError:
-            raise NoSuchView(name)
-        return PapiViewLoader.get_view_class_from_module(module)
+        return _registry.get(name)
 
     @staticmethod
     def get_view_class_from_module(module):
         for name in dir(module):
             obj = getattr(module, name)
-            if inspect.isclass(obj):
+            if _isclass(obj):
                 if issubclass(obj, PapiViewClient):
                     return obj
     
@@ -197,12 +413,43 @@ class PapiViewLoader(object):
 class PapiClientCollection(object):
     """
     Collection of PapiViewClient objects
+
+    Views loaded with load_view() or load_all_views() are created when they
+    are first used, as attribute or through view().
+
+    :param cache: optional `papi_client.cache.ResponseCache` set on all
+        views loaded into this collection
     """
-    def __init__(self, base_client, conf, logger=None):
+    def __init__(self, base_client, conf, logger=None, cache=None):
         self._client = base_client
         self._conf = conf
         self._logger = logger
+        self._cache = cache
         self._views = {}
+        self._lazy_views = set()
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # only called for attributes not found otherwise: views not created
+        if name.startswith("_") or \
+                name not in self.__dict__.get("_lazy_views", ()):
+            raise AttributeError(name)
+        return self.__create_view(name)
+
+    def __create_view(self, name):
+        with self._lock:
+            if name in self._views:
+                return self._views[name]
+            try:
+                view = PapiViewLoader.get_view_from_name(
+                    name=name,
+                    base_client=self._client,
+                    conf=self._conf,
+                    logger=self._logger)
+            finally:
+                self._lazy_views.discard(name)
+            self.add_view(name, view)
+            return view
     
     def base_client(self):
         """
@@ -221,22 +468,20 @@ class PapiClientCollection(object):
         try:
             return self._views[name]
         except KeyError:
-            raise NoSuchView(name)
+            pass
+        if name in self._lazy_views:
+            return self.__create_view(name)
+        raise NoSuchView(name)
 
     def list_views(self):
-        return sorted(self._views.keys())
+        return sorted(set(self._views) | self._lazy_views)
 
     def load_view(self, name):
-        if name in self._views:
+        if name in self._views or name in self._lazy_views:
             raise DuplicateView(name)
-
-        view = PapiViewLoader.get_view_from_name(
-            name=name,
-            base_client=self._client,
-            conf=self._conf,
-            logger=self._logger)
-        
-        self.add_view(name, view)
+        if not _registry.has(name):
+            raise NoSuchView(name)
+        self._lazy_views.add(name)
     
     def add_view(self, name, view):
         if name != view.name():
@@ -244,6 +489,8 @@ class PapiClientCollection(object):
             raise UnexpectedView(msg)
         
         self._views[name] = view
+        if self._cache is not None:
+            view.set_cache(self._cache)
         
         #try to also add it as an attribute to 
         #this object with the view's name.
@@ -253,12 +500,6 @@ class PapiClientCollection(object):
             setattr(self, name, view)
 
     def load_all_views(self):
-        info = [i for i in pkgutil.iter_modules(papi_client.api.__path__)]
-        # i[2] is is_pkg, i[1] is the name
-        names = [i[1] for i in info if not i[2]]
-        for name in names:
-            try:
-                self.load_view(name)
-                self._logger.info("Loaded view '%s'", name)
-            except NoSuchView as e:
-                self._logger.warning("%s", e)
+        for name in registered_views():
+            if name not in self._views:
+                self._lazy_views.add(name)
@@ -0,0 +1,402 @@
+#!/usr/bin/python
+"""
+Metrics of PAPI requests.
+
+Every PapiClient records into a MetricsRegistry, by default the one shared
+by the whole process (REGISTRY):
+
+ - papi_request_duration_seconds: histogram of the duration of every
+   request attempt, by module, function and method
+ - papi_request_bytes_total / papi_response_bytes_total: bytes sent and
+   received, by module and function
+ - papi_retries_total: failed attempts that were retried
+ - papi_logins_total / papi_login_duration_seconds: logins by result
+   (success, failure, or joined when a thread used the login of another)
+ - papi_communication_errors_total and papi_api_errors_total, the latter
+   by error_code
+ - papi_circuit_rejected_total: requests failed fast by a circuit breaker
+
+The registry can be rendered in the Prometheus text format, or as a dict of
+plain values::
+
+    print papi_client.metrics.REGISTRY.render_prometheus()
+    papi_client.metrics.dump("metrics.prom")
+
+Recording takes a lock per metric; a request costs a few microseconds.
+"""
+# so that we don't import papi_client.papi_client instead of papi_client
+from __future__ import absolute_import
+
+import bisect
+import math
+import sys
+import threading
+
+import papi_client.errors
+
+
+# Request durations range from milliseconds for pings to minutes for
+# reports and bulk uploads
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60, 120)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Error(papi_client.errors.Error):
+    """
+    Base class for all exceptions in this module
+    """
+    pass
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float):
+        if math.isnan(value):
+            return "NaN"
+        if value.is_integer():
+            return str(int(value))
+        return repr(value)
+    return str(value)
+
+
+def _escape(value):
+    if not isinstance(value, basestring):
+        value = str(value)
+    if isinstance(value, unicode):
+        value = value.encode("utf-8")
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace(
+        '"', '\\"')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (name, _escape(value))
+                             for name, value in zip(names, values))
+
+
+class _Metric(object):
+    """
+    A metric with one value per combination of label values
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise Error("%s takes labels %s" % (self.name,
+                                                ", ".join(self.labelnames)))
+        return tuple("" if label is None else label for label in labels)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        """
+        :return: lines of the Prometheus text format
+        """
+        lines = ["# HELP %s %s" % (self.name, self.documentation),
+                 "# TYPE %s %s" % (self.name, self.kind)]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_items(items))
+        return lines
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing count
+    """
+    kind = "counter"
+
+    def inc(self, labels=(), amount=1):
+        """
+        :param labels: tuple of label values, in the order of labelnames
+        :param amount: how much to add, not negative
+        """
+        if amount < 0:
+            raise Error("counters can only be increased")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, labels=()):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def snapshot(self):
+        with self._lock:
+            return [{"labels": dict(zip(self.labelnames, key)),
+                     "value": value}
+                    for key, value in sorted(self._values.items())]
+
+    def _render_items(self, items):
+        for key, value in items:
+            yield "%s%s %s" % (self.name,
+                               _format_labels(self.labelnames, key),
+                               _format_value(value))
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values over fixed buckets
+    """
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        if "le" in labelnames:
+            raise Error("'le' is reserved for histogram buckets")
+        if not buckets or list(buckets) != sorted(set(buckets)):
+            raise Error("buckets must be increasing")
+        _Metric.__init__(self, name, documentation, labelnames)
+        self.buckets = tuple(float(bound) for bound in buckets)
+
+    def observe(self, value, labels=()):
+        """
+        :param value: observed value, e.g. seconds
+        :param labels: tuple of label values, in the order of labelnames
+        """
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # per bucket (not cumulative), +Inf, then the sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) \
+                    + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def value(self, labels=()):
+        """
+        :return: dict with count, sum and cumulative count per upper bound
+        """
+        with self._lock:
+            counts = self._values.get(self._key(labels))
+            counts = list(counts) if counts else None
+        return self._summarize(counts)
+
+    def _summarize(self, counts):
+        if counts is None:
+            counts = [0] * (len(self.buckets) + 1) + [0.0]
+        cumulative = 0
+        buckets = []
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            buckets.append((bound, cumulative))
+        return {"count": cumulative, "sum": counts[-1], "buckets": buckets}
+
+    def snapshot(self):
+        with self._lock:
+            items = [(key, list(counts))
+                     for key, counts in sorted(self._values.items())]
+        result = []
+        for key, counts in items:
+            summary = self._summarize(counts)
+            summary["labels"] = dict(zip(self.labelnames, key))
+            summary["buckets"] = [[_format_value(bound), count]
+                                  for bound, count in summary["buckets"]]
+            result.append(summary)
+        return result
+
+    def _render_items(self, items):
+        names = self.labelnames + ("le",)
+        for key, counts in items:
+            summary = self._summarize(counts)
+            for bound, count in summary["buckets"]:
+                yield "%s_bucket%s %d" % (
+                    self.name,
+                    _format_labels(names, key + (_format_value(bound),)),
+                    count)
+            labels = _format_labels(self.labelnames, key)
+            yield "%s_sum%s %s" % (self.name, labels,
+                                   _format_value(summary["sum"]))
+            yield "%s_count%s %d" % (self.name, labels, summary["count"])
+
+
+class MetricsRegistry(object):
+    """
+    Named metrics, created on first use
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def __get(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation,
+                                                   labelnames, **kwargs)
+            elif type(metric) is not cls or \
+                    metric.labelnames != tuple(labelnames):
+                raise Error("metric %s already registered as %s %s" % (
+                    name, metric.kind, ", ".join(metric.labelnames)))
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        """
+        :return: Counter name, created if it does not exist yet
+        """
+        return self.__get(Counter, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(),
+                  buckets=DEFAULT_BUCKETS):
+        """
+        :return: Histogram name, created if it does not exist yet; buckets
+            only apply when it is created
+        """
+        return self.__get(Histogram, name, documentation, labelnames,
+                          buckets=buckets)
+
+    def get(self, name):
+        with self._lock:
+            return self._metrics.get(name)
+
+    def clear(self):
+        """
+        Reset the values of all metrics
+        """
+        with self._lock:
+            metrics = self._metrics.values()
+        for metric in metrics:
+            metric.clear()
+
+    def render_prometheus(self):
+        """
+        :return: all metrics in the Prometheus text exposition format
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        lines = []
+        for _, metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """
+        :return: dict mapping metric name to a list of dicts with the labels
+            and the value (counters), or count, sum and buckets (histograms)
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        return dict((name, metric.snapshot()) for name, metric in metrics)
+
+
+REGISTRY = MetricsRegistry()
+
+
+def dump(path="-", registry=None):
+    """
+    Write the metrics in the Prometheus text format, e.g. at the end of a
+    command line run (for the node exporter textfile collector).
+
+    :param path: file to write, "-" for stdout
+    :param registry: MetricsRegistry, REGISTRY by default
+    """
+    text = (registry or REGISTRY).render_prometheus()
+    if path == "-":
+        sys.stdout.write(text)
+        sys.stdout.flush()
+        return
+    with open(path, "w") as f:
+        f.write(text)
+
+
+class ClientMetrics(object):
+    """
+    The metrics a PapiClient records, see the module documentation.
+
+    :param registry: MetricsRegistry to record into
+    """
+    def __init__(self, registry=None):
+        registry = registry or REGISTRY
+        self.registry = registry
+        self.request_duration = registry.histogram(
+            "papi_request_duration_seconds",
+            "Duration of PAPI request attempts",
+            ("module", "function", "method"))
+        self.request_bytes = registry.counter(
+            "papi_request_bytes_total", "Bytes sent in PAPI request bodies",
+            ("module", "function"))
+        self.response_bytes = registry.counter(
+            "papi_response_bytes_total",
+            "Bytes received in PAPI response bodies", ("module", "function"))
+        self.retries = registry.counter(
+            "papi_retries_total", "Failed PAPI requests that were retried",
+            ("module", "function"))
+        self.logins = registry.counter(
+            "papi_logins_total", "PAPI logins by result", ("result",))
+        self.login_duration = registry.histogram(
+            "papi_login_duration_seconds", "Duration of PAPI logins")
+        self.communication_errors = registry.counter(
+            "papi_communication_errors_total",
+            "PAPI request attempts failing with a communication error",
+            ("module", "function"))
+        self.api_errors = registry.counter(
+            "papi_api_errors_total", "PAPI requests failing with an API error",
+            ("module", "function", "error_code"))
+        self.circuit_rejected = registry.counter(
+            "papi_circuit_rejected_total",
+            "PAPI requests failed fast by an open circuit breaker")
+
+    def request(self, module, function, method, seconds, sent=0, received=0):
+        self.request_duration.observe(seconds, (module, function, method))
+        if sent:
+            self.request_bytes.inc((module, function), sent)
+        if received:
+            self.response_bytes.inc((module, function), received)
+
+    def received(self, module, function, received):
+        """
+        Count bytes of a streamed response body, as they are read
+        """
+        if received:
+            self.response_bytes.inc((module, function), received)
+
+    def retry(self, module, function):
+        self.retries.inc((module, function))
+
+    def login(self, result, seconds=None):
+        """
+        :param result: "success", "failure" or "joined"
+        :param seconds: time spent logging in, None if joined
+        """
+        self.logins.inc((result,))
+        if seconds is not None:
+            self.login_duration.observe(seconds)
+
+    def communication_error(self, module, function):
+        self.communication_errors.inc((module, function))
+
+    def api_error(self, module, function, error_code):
+        self.api_errors.inc((module, function, error_code))
+
+    def rejected(self):
+        self.circuit_rejected.inc()
+
+
+_default_metrics = None
+_default_metrics_lock = threading.Lock()
+
+
+def client_metrics():
+    """
+    :return: ClientMetrics recording into REGISTRY, shared by all clients
+    """
+    global _default_metrics
+    with _default_metrics_lock:
+        if _default_metrics is None:
+            _default_metrics = ClientMetrics(REGISTRY)
+        return _default_metrics
@@ -0,0 +1,344 @@
+#!/usr/bin/python
+"""
+Drive several Lastline managers through one collection.
+
+MultiPapiClientCollection holds one PapiClientCollection per target
+(manager), built from one configuration section each. Calling a view
+method on it runs the call on every target in parallel and returns a
+MultiResult with the result or error of each target::
+
+    multi = MultiPapiClientCollection.from_config(
+        conf, ["papi", "papi_emea"], logger, timeout=30)
+    multi.load_view("intel")
+    results = multi.intel.add_ip(entries)
+    for target, error in results.errors().items():
+        logger.error("%s: %s", target, error)
+
+Every target has its own worker threads and its own timeout, so a slow or
+unreachable manager only delays the results of that manager: calls to it
+are reported as timed out and the other targets keep going. A timed out
+call keeps running in the background until the HTTP timeout of its client
+expires.
+"""
+# so that we don't import papi_client.papi_client instead of papi_client
+from __future__ import absolute_import
+
+import time
+
+import papi_client.errors
+import papi_client.loader
+import papi_client.papi_client
+import papi_client.workers
+
+
+class Error(papi_client.errors.Error):
+    """
+    Base class for all exceptions in this module
+    """
+
+
+class NoSuchTarget(Error):
+    """
+    The requested target is not part of the collection
+    """
+    def __init__(self, target):
+        Error.__init__(self, "No such target '%s'" % str(target))
+
+
+def _ordered_targets(targets):
+    """
+    (target names, dict of targets) of targets given as a dict, ordered by
+    name, or a sequence of pairs, in their order
+    """
+    if isinstance(targets, dict):
+        targets = sorted(targets.items())
+    names = []
+    by_name = {}
+    for name, collection in targets:
+        if name not in by_name:
+            names.append(name)
+        by_name[name] = collection
+    return names, by_name
+
+
+class TargetResult(object):
+    """
+    Outcome of a call on a single target
+
+    :ivar error: the exception raised by the call, or a
+        papi_client.workers.TimeoutError if it did not finish in time
+    """
+    def __init__(self, target, result=None, error=None, duration=None):
+        self.target = target
+        self.result = result
+        self.error = error
+        self.duration = duration
+
+    def ok(self):
+        return self.error is None
+
+    def timed_out(self):
+        return isinstance(self.error, papi_client.workers.TimeoutError)
+
+    def __repr__(self):
+        if self.ok():
+            return "<TargetResult %s: ok>" % self.target
+        return "<TargetResult %s: %s>" % (self.target, self.error)
+
+
+class MultiResult(dict):
+    """
+    TargetResult objects by target name, in the order of the targets
+    """
+    def __init__(self):
+        dict.__init__(self)
+        self._targets = []
+
+    def __setitem__(self, target, result):
+        if target not in self:
+            self._targets.append(target)
+        dict.__setitem__(self, target, result)
+
+    def __delitem__(self, target):
+        dict.__delitem__(self, target)
+        self._targets.remove(target)
+
+    def __iter__(self):
+        return iter(self._targets)
+
+    def keys(self):
+        return list(self._targets)
+
+    def values(self):
+        return [self[target] for target in self._targets]
+
+    def items(self):
+        return [(target, self[target]) for target in self._targets]
+
+    def iterkeys(self):
+        return iter(self._targets)
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def ok(self):
+        return all(r.ok() for r in self.values())
+
+    def results(self):
+        """
+        :return: dict mapping target to result of the successful calls
+        """
+        return dict((t, r.result) for t, r in self.items() if r.ok())
+
+    def errors(self):
+        """
+        :return: dict mapping target to exception of the failed calls
+        """
+        return dict((t, r.error) for t, r in self.items() if not r.ok())
+
+    def raise_for_errors(self):
+        """
+        Re-raise the error of the first failed target, if any.
+        """
+        for result in self.values():
+            if not result.ok():
+                raise result.error
+
+
+class MultiView(object):
+    """
+    Fan-out proxy for a view: calling a method of it calls that method of
+    the view on all targets.
+    """
+    def __init__(self, multi, name):
+        self._multi = multi
+        self._name = name
+
+    def name(self):
+        return self._name
+
+    def __getattr__(self, method):
+        if method.startswith("_"):
+            raise AttributeError(method)
+
+        def call(*args, **kwargs):
+            return self._multi.call(self._name, method, *args, **kwargs)
+        call.__name__ = method
+        return call
+
+
+class MultiPapiClientCollection(object):
+    """
+    PapiClientCollection-like object fanning calls out to several targets.
+
+    :param targets: sequence of (target name, PapiClientCollection) pairs,
+        or a dict
+    :param timeout: seconds to wait for a target before reporting a call to
+        it as timed out; None waits forever
+    :param timeouts: optional dict overriding timeout per target name
+    :param concurrency: calls in flight per target; a PapiClient logs in
+        on its first request, so only raise this above 1 for clients that
+        are already logged in
+    :param logger: python logger to which we will log
+    """
+    def __init__(self, targets, timeout=None, timeouts=None,
+                 concurrency=1, logger=None):
+        self._targets, self._collections = _ordered_targets(targets)
+        if not self._targets:
+            raise papi_client.papi_client.InvalidArgument("No targets given")
+        self._timeout = timeout
+        self._timeouts = timeouts or {}
+        self._logger = logger
+        self._pools = dict(
+            (target, papi_client.workers.WorkerPool(
+                workers=concurrency, name="papi-multi-%s" % target))
+            for target in self._targets)
+        self._views = {}
+
+    @classmethod
+    def from_config(cls, conf, sections, logger=None, views=None, **kwargs):
+        """
+        Build a collection with one target per configuration section.
+
+        A section may set "call_timeout" to override the timeout for its
+        target.
+
+        :param conf: ConfigParser object holding client configuration
+        :param sections: names of the sections, also used as target names
+        :param views: names of the views to load; all views if None
+        :param kwargs: passed to the constructor
+        """
+        targets = []
+        timeouts = dict(kwargs.pop("timeouts", None) or {})
+        for section in sections:
+            base_client = papi_client.papi_client.PapiClientFactory.\
+                client_from_config(conf, section, logger)
+            targets.append((section, papi_client.loader.PapiClientCollection(
+                base_client, conf, logger)))
+            if conf.has_option(section, "call_timeout"):
+                timeouts.setdefault(section,
+                                    conf.getfloat(section, "call_timeout"))
+        multi = cls(targets, timeouts=timeouts, logger=logger, **kwargs)
+        if views is None:
+            multi.load_all_views()
+        else:
+            for name in views:
+                multi.load_view(name)
+        return multi
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def close(self):
+        """
+        Stop the worker threads once outstanding calls are done.
+        """
+        for pool in self._pools.values():
+            pool.shutdown(wait=False)
+
+    def targets(self):
+        return list(self._targets)
+
+    def collection(self, target):
+        """
+        Get the PapiClientCollection of a single target.
+        """
+        try:
+            return self._collections[target]
+        except KeyError:
+            raise NoSuchTarget(target)
+
+    def view(self, name):
+        try:
+            return self._views[name]
+        except KeyError:
+            raise papi_client.loader.NoSuchView(name)
+
+    def list_views(self):
+        return sorted(self._views.keys())
+
+    def load_view(self, name):
+        if name in self._views:
+            raise papi_client.loader.DuplicateView(name)
+        for collection in self._collections.values():
+            collection.load_view(name)
+        self.__add_view(name)
+
+    def load_all_views(self):
+        for collection in self._collections.values():
+            collection.load_all_views()
+        # only views that every target could load
+        names = set.intersection(*[set(c.list_views())
+                                   for c in self._collections.values()])
+        for name in sorted(names):
+            if name not in self._views:
+                self.__add_view(name)
+
+    def __add_view(self, name):
+        view = MultiView(self, name)
+        self._views[name] = view
+        if hasattr(self, name):
+            if self._logger:
+                self._logger.warning("MultiPapiClientCollection already has "
+                                     "%s attribute: view will be accessible "
+                                     "through view() method", name)
+        else:
+            setattr(self, name, view)
+
+    def call(self, view, method, *args, **kwargs):
+        """
+        Call a method of a view on all targets.
+
+        :return: MultiResult
+        """
+        return self.fan_out(
+            lambda collection: getattr(collection.view(view), method)(
+                *args, **kwargs),
+            "%s.%s" % (view, method))
+
+    def fan_out(self, fn, description=None):
+        """
+        Run fn(collection) for the collection of every target in parallel.
+
+        :param description: name of the call for logging
+        :return: MultiResult
+        """
+        start = time.time()
+        futures = [(target, self._pools[target].submit(
+            self.__timed, fn, self._collections[target]))
+            for target in self._targets]
+
+        results = MultiResult()
+        for target, future in futures:
+            timeout = self._timeouts.get(target, self._timeout)
+            remaining = None
+            if timeout is not None:
+                remaining = max(0, start + timeout - time.time())
+            try:
+                result, duration = future.result(remaining)
+            except Exception as e:  # pylint: disable=W0703
+                results[target] = TargetResult(target, error=e,
+                                               duration=time.time() - start)
+            else:
+                results[target] = TargetResult(target, result=result,
+                                               duration=duration)
+
+        if self._logger:
+            for result in results.values():
+                if not result.ok():
+                    self._logger.error("%s on %s failed after %.1fs: %s",
+                                       description or "Call", result.target,
+                                       result.duration, result.error)
+        return results
+
+    @staticmethod
+    def __timed(fn, collection):
+        start = time.time()
+        return fn(collection), time.time() - start
+
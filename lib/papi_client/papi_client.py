@@ -11,9 +11,14 @@ Can be used as handle.
 from __future__ import absolute_import
 
 import copy
+import os
+import re
+import tempfile
+import threading
 import time
 import urlparse
 import requests
+import requests.adapters
 
 
 # Unused import - but used by others.
@@ -23,7 +28,10 @@ try:
 except ImportError:
     import json
 # pylint: enable=W0611
+import papi_client.breaker
 import papi_client.errors
+import papi_client.metrics
+import papi_client.retry
 
 
 # Duplicated from llutils.llapi
@@ -32,7 +40,10 @@ LLAPI_ERROR__CANNOT_SWITCH_TO_KEY = 3002
 LLAPI_ERROR__NO_KEY_SELECTED = 3003
 LLAPI_ERROR__AUTHENTICATION_ERROR = 3004
 
-# We retry once if we get one of these error codes:
+# bytes read at a time from streamed responses
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# We retry (see papi_client.retry) if we get one of these error codes:
 RETRY_ERROR_CODES = frozenset([
     LLAPI_ERROR__PERMISSION_DENIED,
     LLAPI_ERROR__CANNOT_SWITCH_TO_KEY,
@@ -53,6 +64,18 @@ class CommunicationError(Error):
     pass
 
 
+class CircuitOpenError(CommunicationError):
+    """
+    Raised without sending a request while the circuit breaker of the
+    manager is open; retry_in is the number of seconds until the next probe.
+    """
+    def __init__(self, url, retry_in):
+        CommunicationError.__init__(
+            self, "Circuit open for %s, retry in %.0fs" % (url, retry_in))
+        self.url = url
+        self.retry_in = retry_in
+
+
 class ApiError(Error):
 
     def __init__(self, error_msg, error_code=None):
@@ -97,6 +120,24 @@ class PapiClientFactory(object):
             verify_ssl = True
             timeout = 3
 
+            # optional HTTP connection pool tuning, see PapiClient
+            pool_connections = 10
+            pool_maxsize = 10
+            pool_block = False
+            keep_alive = True
+
+            # optional session renewal, see PapiClient
+            session_max_age = 1800
+            refresh_before = 60
+
+            # optional retry policy, see papi_client.retry.RetryPolicy
+            retry_max_attempts = 4
+            retry_backoff = 0.5
+
+            # optional circuit breaker, see papi_client.breaker
+            breaker_failures = 5
+            breaker_reset = 30
+
         :param conf: ConfigParser instance
         :param section: which section to use
         :param logger: log here
@@ -131,16 +172,126 @@ class PapiClientFactory(object):
                 "api_token": conf.get(section_name, "api_token"),
             }
 
+        # Connection pool settings are only passed on if configured, so
+        # that PapiClient defaults apply otherwise.
+        pool_options = {}
+        for option in ["pool_connections", "pool_maxsize",
+                       "session_max_age", "refresh_before"]:
+            if conf.has_option(section_name, option):
+                pool_options[option] = conf.getint(section_name, option)
+        for option in ["pool_block", "keep_alive"]:
+            if conf.has_option(section_name, option):
+                pool_options[option] = conf.getboolean(section_name, option)
+        retry_policy = papi_client.retry.RetryPolicy.from_config(
+            conf, section_name)
+        if retry_policy is not None:
+            pool_options["retry_policy"] = retry_policy
+        breaker_options = {}
+        if conf.has_option(section_name, "breaker_failures"):
+            breaker_options["failure_threshold"] = conf.getint(
+                section_name, "breaker_failures")
+        if conf.has_option(section_name, "breaker_reset"):
+            breaker_options["reset_timeout"] = conf.getfloat(
+                section_name, "breaker_reset")
+        if breaker_options:
+            pool_options["circuit_breaker"] = papi_client.breaker.get_breaker(
+                url, **breaker_options)
+
         return PapiClient(
             url=url,
             login_params=login_params,
             verify_ssl=verify_ssl,
             timeout=timeout,
             logger=logger,
-            proxies=proxies
+            proxies=proxies,
+            **pool_options
         )
 
 
+def _request_size(response):
+    """
+    :return: length of the body sent for response, 0 if unknown
+    """
+    body = getattr(getattr(response, "request", None), "body", None)
+    if isinstance(body, basestring):
+        return len(body)
+    return 0
+
+
+def _response_size(response):
+    """
+    :return: length of the body of response, 0 if unknown
+    """
+    content = getattr(response, "content", None)
+    if isinstance(content, basestring):
+        return len(content)
+    return 0
+
+
+def _range_validator(response):
+    """
+    :return: value for If-Range identifying the body of response, None if
+        it has no strong ETag or Last-Modified header
+    """
+    etag = response.headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return response.headers.get("Last-Modified")
+
+
+def _resume_offset(response, received, validator):
+    """
+    Check that response continues a download that broke off.
+
+    :param received: bytes received before
+    :return: bytes at the start of response to skip
+    :raises: Error if response is not the rest of the same body
+    """
+    if not received:
+        return 0
+    if response.status_code == 206:
+        match = re.match(r"bytes (\d+)-",
+                         response.headers.get("Content-Range", ""))
+        if match is None or int(match.group(1)) != received:
+            response.close()
+            raise Error("Cannot resume download at %d bytes: Content-Range "
+                        "%s" % (received, response.headers.get("Content-Range")))
+        return 0
+    # the server sent the whole body again
+    if validator is None or _range_validator(response) != validator:
+        response.close()
+        raise Error("Cannot resume download: response changed")
+    return received
+
+
+def _write_chunks(chunks, output):
+    """
+    Write chunks to output, a file-like object or path. A path is written
+    to a temporary file first, renamed once all chunks are written.
+
+    :return: number of bytes written
+    """
+    written = 0
+    if not isinstance(output, basestring):
+        for chunk in chunks:
+            output.write(chunk)
+            written += len(chunk)
+        return written
+
+    directory = os.path.dirname(os.path.abspath(output))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                written += len(chunk)
+        os.rename(tmp_path, output)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return written
+
+
 class KeyIds(object):
     def __init__(self, key_id, subkey_id=None):
         self._key_id = key_id
@@ -164,22 +315,68 @@ class PapiClient(object):
      - logout()
      - do_request()
 
-    Only interprets JSON responses, but supports XML with the raw option. 
-    Whenever there
-    is a CommunicationError or API erros related to permissions, a *single*
-    retry is attempted. This should help to transparently recover from
+    Only interprets JSON responses, but supports XML with the raw option.
+    Large raw responses can be streamed (stream=True) or written to a file
+    (output=...) chunk by chunk instead. Whenever there
+    is a CommunicationError or API erros related to permissions, the request
+    is retried as the papi_client.retry.RetryPolicy of the client allows:
+    by default a *single* retry is attempted, pass retry_policy (or set the
+    retry_* options of the configuration section) for more attempts with
+    exponential backoff, jitter and a RetryBudget capping retries at a ratio
+    of all requests. This should help to transparently recover from
     interrupted TCP connections or expired sessions.
 
     Either inherit from this class or use it as a handle to your client - the
     latter follows the "composition over inheritance" concept and will make
     testing easier.
+
+    HTTP connections are kept alive and pooled by the underlying
+    requests.Session. The pool survives re-logins and communication errors,
+    so a retry does not have to pay for a new TCP and TLS handshake; only
+    logout() tears it down. Use pool_stats() to check how often connections
+    are actually reused.
+
+    The client is safe to share between threads: only one of them logs in at
+    a time, and threads needing a new session while a login is in progress
+    wait for it and use its session instead of logging in again. If the
+    server expires sessions after a known time, pass it as session_max_age
+    so that the session is renewed before requests fail with it. Use
+    login_stats() to see how often and how long the client logs in.
+
+    Request durations, bytes, retries, logins and errors are recorded in
+    papi_client.metrics, see there.
     """
     def __init__(self, url, login_params, verify_ssl=True, timeout=60,
-                 proxies=None, logger=None):
+                 proxies=None, logger=None, pool_connections=None,
+                 pool_maxsize=None, pool_block=False, keep_alive=True,
+                 session_max_age=None, refresh_before=60, retry_policy=None,
+                 circuit_breaker=None, metrics=None):
         """
         Instantiate a PapiClient.
 
         :param login_params: POST parameters used during login
+        :param pool_connections: number of per-host connection pools to
+            cache (requests default if None)
+        :param pool_maxsize: maximum number of connections kept open per
+            host (requests default if None)
+        :param pool_block: if True, block when all pool_maxsize connections
+            to a host are in use instead of opening throw-away connections
+        :param keep_alive: if False, ask the server to close the connection
+            after every request
+        :param session_max_age: seconds after which the server expires a
+            session; requests log in again before sending once a session is
+            this old. None if unknown, to only log in again after a request
+            was denied.
+        :param refresh_before: seconds before session_max_age from which a
+            background thread renews the session while requests continue
+            to use the current one
+        :param retry_policy: papi_client.retry.RetryPolicy deciding which
+            failed requests are retried when; by default they are retried
+            once, immediately
+        :param circuit_breaker: papi_client.breaker.CircuitBreaker to fail
+            fast with while the manager is down; None to always send
+        :param metrics: papi_client.metrics.ClientMetrics to record
+            requests in; by default they go to papi_client.metrics.REGISTRY
         """
         if not url:
             raise InvalidArgument("url missing")
@@ -215,31 +412,139 @@ class PapiClient(object):
 
         self.__logger = logger
 
+        if pool_connections is not None and pool_connections < 1:
+            raise InvalidArgument("pool_connections must be positive")
+        if pool_maxsize is not None and pool_maxsize < 1:
+            raise InvalidArgument("pool_maxsize must be positive")
+        self.__pool_connections = pool_connections
+        self.__pool_maxsize = pool_maxsize
+        self.__pool_block = pool_block
+        self.__keep_alive = keep_alive
+        self.__logged_in = False
+        self.__login_handler = None
+
+        if session_max_age is not None and session_max_age <= 0:
+            raise InvalidArgument("session_max_age must be positive")
+        self.__session_max_age = session_max_age
+        self.__refresh_before = max(0, refresh_before or 0)
+        if retry_policy is None:
+            retry_policy = papi_client.retry.RetryPolicy()
+        self.__retry_policy = retry_policy
+        self.__circuit_breaker = circuit_breaker
+        if metrics is None:
+            metrics = papi_client.metrics.client_metrics()
+        self.__metrics = metrics
+
+        # Logins are single-flight: the generation is incremented by every
+        # login, so that threads which waited for the lock can tell that
+        # the session they were unhappy with has been replaced already.
+        self.__login_lock = threading.Lock()
+        self.__login_generation = 0
+        self.__session_started = None
+        self.__refreshing = False
+        self.__stats_lock = threading.Lock()
+        self.__login_stats = {
+            "logins": 0,
+            "failed_logins": 0,
+            "joined_logins": 0,
+            "background_refreshes": 0,
+            "login_seconds": 0.0,
+            "last_login_seconds": None,
+            "max_login_seconds": 0.0,
+        }
+
     def have_logger(self):
         return not self.__logger is None
 
     def get_logger(self):
         return self.__logger
 
-    def __log_request_duration(self, start, end):
+    def __log_request_duration(self, start, end, attempt=None, error=None):
         took_ms = int((end - start) * 1000)
-        if self.have_logger():
+        if not self.have_logger():
+            return
+        if attempt is None:
             self.__logger.debug("Request took %s ms", took_ms)
+        elif error is None:
+            self.__logger.debug("Request took %s ms (attempt %d)", took_ms,
+                                attempt)
+        else:
+            self.__logger.debug("Request failed after %s ms (attempt %d): %s",
+                                took_ms, attempt, error)
+
+    def __record_request(self, module, function, method, start,
+                         response=None, stream=False):
+        """
+        Record duration and size of a request; response is None if it
+        failed to get one. The body of streamed responses is counted as it
+        is read.
+        """
+        received = 0
+        if not stream:
+            received = _response_size(response)
+        self.__metrics.request(module, function, method, time.time() - start,
+                               _request_size(response), received)
+
+    def get_retry_policy(self):
+        return self.__retry_policy
+
+    def get_metrics(self):
+        return self.__metrics
+
+    def set_circuit_breaker(self, circuit_breaker):
+        """
+        :param circuit_breaker: papi_client.breaker.CircuitBreaker, or None
+            to always send requests
+        """
+        self.__circuit_breaker = circuit_breaker
+
+    def get_circuit_breaker(self):
+        return self.__circuit_breaker
+
+    def __check_circuit(self):
+        """
+        :raises: CircuitOpenError if requests should fail fast
+        """
+        breaker = self.__circuit_breaker
+        if breaker is not None and not breaker.allow():
+            self.__metrics.rejected()
+            raise CircuitOpenError(self.__url, breaker.retry_in())
 
-    def __handle_response(self, response, raw, __fmt=None):
+    def __record_outcome(self, error=None):
+        """
+        Report the outcome of a request to the circuit breaker: only
+        connection errors and server errors count as failures.
+        """
+        breaker = self.__circuit_breaker
+        if breaker is None:
+            return
+        if isinstance(error, CommunicationError):
+            response = papi_client.retry.http_response(error)
+            if response is None or response.status_code >= 500:
+                breaker.record_failure()
+                return
+        breaker.record_success()
+
+    def __handle_response(self, response, raw, __fmt=None, stream=False):
         """
         Check a response for issues and parse the return.
 
         :param: response requests.Response
+        :param stream: with raw, return the response itself, its body is
+            not read yet
         :return: if raw the data in the body, if not raw, the data field
         :raises: CommunicationError, ApiError
         """
         try:
             response.raise_for_status()
         except requests.RequestException as e:
+            if stream:
+                response.close()
             raise CommunicationError(e)
 
         if raw:
+            if stream:
+                return response
             return response.content
 
         try:
@@ -262,37 +567,283 @@ class PapiClient(object):
             raise Error("Response not json %s" % str(e))
 
 
+    def __new_session(self):
+        """
+        Create the requests.Session (and with it the connection pool) used
+        for all requests of this client.
+        """
+        session = requests.session()
+
+        if self.__pool_connections is not None or \
+                self.__pool_maxsize is not None or self.__pool_block:
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=self.__pool_connections or
+                requests.adapters.DEFAULT_POOLSIZE,
+                pool_maxsize=self.__pool_maxsize or
+                requests.adapters.DEFAULT_POOLSIZE,
+                pool_block=self.__pool_block
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+
+        if not self.__keep_alive:
+            session.headers["Connection"] = "close"
+
+        return session
+
+    def pool_stats(self):
+        """
+        Get statistics about the HTTP connections of this client.
+
+        :return: dict with the number of host pools, idle connections
+            currently kept open, connections established, requests sent and
+            requests that were sent over an already established connection.
+        """
+        stats = {
+            "pools": 0,
+            "open": 0,
+            "established": 0,
+            "requests": 0,
+            "reused": 0,
+        }
+        if self.__session is None:
+            return stats
+
+        for adapter in set(self.__session.adapters.values()):
+            managers = [getattr(adapter, "poolmanager", None)]
+            managers.extend(getattr(adapter, "proxy_manager", {}).values())
+            for manager in managers:
+                if manager is None:
+                    continue
+                for key in manager.pools.keys():
+                    try:
+                        pool = manager.pools[key]
+                    except KeyError:
+                        # evicted in the meantime
+                        continue
+                    stats["pools"] += 1
+                    if pool.pool is not None:
+                        stats["open"] += len([c for c in list(pool.pool.queue)
+                                              if c is not None])
+                    stats["established"] += pool.num_connections
+                    stats["requests"] += pool.num_requests
+
+        stats["reused"] = max(0, stats["requests"] - stats["established"])
+        return stats
+
+    def set_login_handler(self, handler):
+        """
+        Let handler decide how to establish a session whenever one is needed,
+        e.g. to share a session between processes.
+
+        :param handler: callable(client, login) which either calls login()
+            to log in or installs an existing session using set_cookies();
+            None to always log in
+        """
+        self.__login_handler = handler
+
+    def get_cookies(self):
+        """
+        Get the cookies of the current session.
+
+        :return: list of dicts with name, value, domain, path and expires
+            (seconds since the epoch or None); empty without a session
+        """
+        if self.__session is None:
+            return []
+        return [{"name": cookie.name, "value": cookie.value,
+                 "domain": cookie.domain, "path": cookie.path,
+                 "expires": cookie.expires}
+                for cookie in self.__session.cookies]
+
+    def set_cookies(self, cookies):
+        """
+        Continue a session established elsewhere instead of logging in.
+
+        :param cookies: as returned by get_cookies()
+        """
+        if self.__session is None:
+            self.__session = self.__new_session()
+        self.__session.cookies.clear()
+        for cookie in cookies:
+            self.__session.cookies.set(
+                cookie["name"], cookie["value"],
+                domain=cookie.get("domain") or "",
+                path=cookie.get("path") or "/",
+                expires=cookie.get("expires"))
+        self.__logged_in = bool(cookies)
+        self.__session_started = time.time()
+
     def login(self, raw=False):
         """
         Login using account-based or key-based methods.
 
         We *always* use a POST request and we *always* use JSON format.
+        If another thread is logging in already, wait for it and use its
+        session instead.
+        """
+        self.__relogin(self.__login_generation, clear=False, raw=raw)
+
+    def session_age(self):
+        """
+        :return: seconds since the current session was established, None
+            without a session
+        """
+        if not self.__is_logged_in() or self.__session_started is None:
+            return None
+        return time.time() - self.__session_started
+
+    def login_stats(self):
+        """
+        Get statistics about the logins of this client.
+
+        :return: dict with the number of logins, failed logins, logins other
+            threads waited for instead of logging in themselves
+            (joined_logins), background refreshes, total, last and maximum
+            seconds spent logging in and the current session age
+        """
+        with self.__stats_lock:
+            stats = dict(self.__login_stats)
+        stats["session_age"] = self.session_age()
+        return stats
+
+    def __count(self, name, value=1):
+        with self.__stats_lock:
+            self.__login_stats[name] += value
+
+    def __relogin(self, generation, clear=True, raw=False):
+        """
+        Log in, unless another thread logged in since generation was read.
+
+        :param generation: login generation the session in question belongs
+            to, read before it was used
+        :param clear: drop the cookies of the current session first
+        """
+        with self.__login_lock:
+            if generation != self.__login_generation and \
+                    self.__is_logged_in():
+                self.__count("joined_logins")
+                self.__metrics.login("joined")
+                return
+
+            if clear:
+                self.__logged_in = False
+                self.__session.cookies.clear()
+            start = time.time()
+            try:
+                if self.__login_handler is not None:
+                    self.__login_handler(self, lambda: self.__login(raw))
+                else:
+                    self.__login(raw)
+            except Exception:
+                self.__count("failed_logins")
+                self.__metrics.login("failure", time.time() - start)
+                raise
+            finally:
+                took = time.time() - start
+                with self.__stats_lock:
+                    self.__login_stats["login_seconds"] += took
+                    self.__login_stats["last_login_seconds"] = took
+                    self.__login_stats["max_login_seconds"] = max(
+                        took, self.__login_stats["max_login_seconds"])
+
+            self.__count("logins")
+            self.__metrics.login("success", took)
+            self.__login_generation += 1
+            if self.__session_started is None or \
+                    self.__session_started < start:
+                # the handler may have installed a session with set_cookies()
+                self.__session_started = time.time()
+
+    def __drop_session(self, generation):
+        """
+        Forget the cookies of a failed session, unless it has been replaced
         """
+        with self.__login_lock:
+            if generation == self.__login_generation:
+                self.__logged_in = False
+                self.__session.cookies.clear()
+
+    def __renew_if_old(self):
+        """
+        Renew the session if it is (about to be) expired by the server
+        """
+        if self.__session_max_age is None:
+            return
+        age = self.session_age()
+        if age is None:
+            return
+        if age >= self.__session_max_age:
+            self.__relogin(self.__login_generation)
+        elif age >= self.__session_max_age - self.__refresh_before:
+            self.__refresh_in_background()
+
+    def __refresh_in_background(self):
+        with self.__stats_lock:
+            if self.__refreshing:
+                return
+            self.__refreshing = True
+
+        generation = self.__login_generation
+
+        def refresh():
+            try:
+                # keep the cookies, requests are still using them
+                self.__relogin(generation, clear=False)
+                self.__count("background_refreshes")
+            except Error as e:
+                if self.have_logger():
+                    self.__logger.warning("Session refresh failed: %s", e)
+            finally:
+                with self.__stats_lock:
+                    self.__refreshing = False
+
+        thread = threading.Thread(target=refresh, name="papi-session-refresh")
+        thread.daemon = True
+        thread.start()
+
+    def __login(self, raw=False):
         if self.__session is None:
-            self.__session = requests.session()
+            self.__session = self.__new_session()
 
         login_url = "/".join([self.__url, "login"])
 
         if self.have_logger():
             self.__logger.debug("Logging in...")
 
+        self.__check_circuit()
         start = time.time()
         try:
-            response = self.__session.request(
-                method="POST",
-                url=login_url,
-                data=self.__login_params,
-                verify=self.__verify_ssl,
-                timeout=self.__timeout,
-                proxies=self.__proxies
-            )
-        except requests.RequestException as e:
-            raise CommunicationError(e)
-
-        end = time.time()
-        self.__log_request_duration(start, end)
-
-        self.__handle_response(response, raw)
+            try:
+                response = self.__session.request(
+                    method="POST",
+                    url=login_url,
+                    data=self.__login_params,
+                    verify=self.__verify_ssl,
+                    timeout=self.__timeout,
+                    proxies=self.__proxies
+                )
+            except requests.RequestException as e:
+                self.__record_request("", "login", "POST", start)
+                raise CommunicationError(e)
+
+            end = time.time()
+            self.__log_request_duration(start, end)
+            self.__record_request("", "login", "POST", start, response)
+
+            self.__handle_response(response, raw)
+        except ApiError as e:
+            self.__record_outcome(e)
+            self.__metrics.api_error("", "login", e.error_code)
+            raise
+        except Error as e:
+            self.__record_outcome(e)
+            if isinstance(e, CommunicationError):
+                self.__metrics.communication_error("", "login")
+            raise
+        self.__record_outcome()
+        self.__logged_in = True
+        self.__session_started = time.time()
 
         if self.have_logger():
             self.__logger.debug("Completed.")
@@ -302,15 +853,24 @@ class PapiClient(object):
         Log out and tear down the TCP connection.
         """
         ret = self.do_request("POST", module="", function="logout")
+        self.__logged_in = False
+        self.__session.close()
         self.__session = None
         return ret
 
     def __is_logged_in(self):
-        return self.__session is not None
+        return self.__session is not None and self.__logged_in
+
+    def is_logged_in(self):
+        """
+        Check whether we have a session; it may have expired on the server.
+        """
+        return self.__is_logged_in()
 
 
     def do_request(self, method, module, function, params=None, data=None,
-                   files=None, url=None, fmt="JSON", raw=False):
+                   files=None, url=None, fmt="JSON", raw=False, stream=False,
+                   output=None, chunk_size=DOWNLOAD_CHUNK_SIZE, resume=True):
         """
         Helper around requests.request() to provide some functionality that
         should ease writing a papi client.
@@ -324,6 +884,15 @@ class PapiClient(object):
         :param url: Override the URL as given in the constructor (testing)
         :param fmt: format to be returned by the API XML|JSON
         :param raw: return the raw body (required for non-json formats)
+        :param stream: with raw, return an iterator over chunks of the body
+            instead of the body, so that large responses are never held in
+            memory as a whole
+        :param output: with raw, write the body to this file-like object or
+            path instead of returning it, and return the number of bytes
+            written. A path is only created once the download is complete.
+        :param chunk_size: bytes read at a time with stream or output
+        :param resume: with stream or output, continue a download which
+            broke off where it stopped, see __iter_download()
         """
 
         fmt = fmt.lower().strip()
@@ -337,6 +906,11 @@ class PapiClient(object):
         if not method in ["POST", "GET"]:
             raise InvalidArgument("Only POST and GET supported")
 
+        if (stream or output is not None) and not raw:
+            raise InvalidArgument("Streaming requires raw=True")
+        if stream and output is not None:
+            raise InvalidArgument("Either stream or write to output")
+
         # We allow empty modules.
         module = module.strip(" /")
         function = function.strip(" /")
@@ -345,6 +919,8 @@ class PapiClient(object):
 
         if not self.__is_logged_in():
             self.login()
+        else:
+            self.__renew_if_old()
 
         url_parts = [url or self.__url]
         if module:
@@ -353,66 +929,195 @@ class PapiClient(object):
 
         url = "/".join(url_parts)
 
+        if not stream and output is None:
+            return self.__send(method, module, function, url, params, data,
+                               files, fmt, raw)
+
+        def send(headers=None):
+            return self.__send(method, module, function, url, params, data,
+                               files, fmt, raw, headers=headers, stream=True)
+
+        # the first request is sent right away, so that errors are raised
+        # here rather than by the first chunk
+        chunks = self.__iter_download(send(), send, method, module, function,
+                                      chunk_size, resume)
+        if stream:
+            return chunks
+        return _write_chunks(chunks, output)
 
-        # We try at most two times! And we only retry if there is a
-        # CommunicationError or an API error indicating permission issues.
-        for i in range(2):
+    def __send(self, method, module, function, url, params, data, files, fmt,
+               raw, headers=None, stream=False):
+        """
+        Send a request, retrying it as the retry policy allows.
+
+        :param headers: additional HTTP headers
+        :param stream: return the response without reading its body, once
+            its status is checked
+        """
+        extra = {}
+        if headers:
+            extra["headers"] = headers
+        if stream:
+            extra["stream"] = True
+
+        # We only retry if there is a CommunicationError or an API error
+        # indicating permission issues, as often and as late as the retry
+        # policy allows (by default once, immediately).
+        policy = self.__retry_policy
+        policy.request_sent()
+        attempt = 0
+        while True:
+            attempt += 1
             if self.have_logger():
                 self.__logger.debug("Doing %s request to %s", method, url)
 
+            # session this attempt is sent with
+            generation = self.__login_generation
+
+            self.__check_circuit()
+            start = time.time()
             try:
-                start = time.time()
-                response = self.__session.request(
-                    method=method,
-                    url=url,
-                    data=data,
-                    params=params,
-                    files=files,
-                    verify=self.__verify_ssl,
-                    timeout=self.__timeout,
-                    proxies=self.__proxies
-                )
+                try:
+                    response = self.__session.request(
+                        method=method,
+                        url=url,
+                        data=data,
+                        params=params,
+                        files=files,
+                        verify=self.__verify_ssl,
+                        timeout=self.__timeout,
+                        proxies=self.__proxies,
+                        **extra
+                    )
+                except requests.RequestException as e:
+                    self.__record_request(module, function, method, start)
+                    raise CommunicationError(e)
                 end = time.time()
-                self.__log_request_duration(start, end)
+                self.__log_request_duration(start, end, attempt)
+                self.__record_request(module, function, method, start,
+                                      response, stream)
 
-                return self.__handle_response(response, raw, fmt)
+                result = self.__handle_response(response, raw, fmt, stream)
+                self.__record_outcome()
+                return result
 
             except ApiError as e:
+                self.__record_outcome(e)
+                self.__metrics.api_error(module, function, e.error_code)
                 if self.have_logger():
                     self.__logger.error("ApiError: %s", str(e))
 
-                # Second time around? Just raise...
-                if i == 1:
-                    raise e
-
                 # Some errors say "Permission denied", but do not contain an
                 # error code... Check "Permission denied explicitly.
                 if e.error_code not in RETRY_ERROR_CODES and \
                         "Permission denied" not in e.error_msg:
                     raise e
 
+                # Rejected requests were not processed, so they can be
+                # retried whatever the method.
+                delay = policy.delay(attempt)
+                if not policy.should_retry(attempt, method, processed=False,
+                                           delay=delay):
+                    raise e
+
                 # If we received a "Permission denied" error, drop all
-                # cookies and login again. This will keep the connection
-                # established.
-                self.__session.cookies.clear()
+                # cookies and login again (below). This will keep the
+                # connection established.
 
             except CommunicationError as e:
-
-                # Reset the session.
-                self.__session = None
-
+                self.__record_outcome(e)
+                self.__metrics.communication_error(module, function)
+                self.__log_request_duration(start, time.time(), attempt, e)
                 if self.have_logger():
                     self.__logger.error("CommunicationError: %s", str(e))
 
-                # Second time around? Just raise...
-                if i == 1:
+                # Out of attempts? Just raise, the next request logs in on a
+                # fresh set of cookies.
+                delay = policy.delay(attempt, papi_client.retry.retry_after(e))
+                if not policy.should_retry(
+                        attempt, method,
+                        processed=not papi_client.retry.not_processed(e),
+                        delay=delay):
+                    self.__drop_session(generation)
                     raise e
 
+                # Log in again on a fresh set of cookies, but keep the
+                # session: broken connections are dropped by the pool
+                # itself, healthy ones stay open for the retry.
+
+            self.__metrics.retry(module, function)
             if self.have_logger():
-                self.__logger.debug("Retrying failed request...")
+                self.__logger.debug("Retrying failed request in %.1fs...",
+                                    delay)
+            if delay:
+                time.sleep(delay)
 
-            # Unconditional login for retry...
-            self.login()
+            # Login for retry, unless another thread has renewed the session
+            # since this attempt was sent
+            self.__relogin(generation)
+
+    def __iter_download(self, response, send, method, module, function,
+                        chunk_size, resume):
+        """
+        Iterate over the body of a streamed response.
+
+        If the connection breaks off, the request is sent again as the retry
+        policy allows. Once data has been received, the server is asked for
+        the rest only (Range with If-Range), which requires an ETag or
+        Last-Modified header on the response. A server ignoring the range
+        sends the whole body again, which is then skipped up to where it
+        broke off if it is unchanged.
+
+        :param response: first response, as returned by send()
+        :param send: send(headers) sends the request again
+        """
+        policy = self.__retry_policy
+        validator = _range_validator(response)
+        received = 0
+        failures = 0
+        skip = 0
+        try:
+            while True:
+                try:
+                    for chunk in response.iter_content(chunk_size):
+                        if skip:
+                            if len(chunk) <= skip:
+                                skip -= len(chunk)
+                                continue
+                            chunk = chunk[skip:]
+                            skip = 0
+                        received += len(chunk)
+                        yield chunk
+                    return
+                except requests.RequestException as e:
+                    error = CommunicationError(e)
+                finally:
+                    response.close()
+
+                failures += 1
+                self.__metrics.communication_error(module, function)
+                if self.have_logger():
+                    self.__logger.error("Download failed after %d bytes: %s",
+                                        received, error)
+                delay = policy.delay(failures)
+                if not resume or (received and validator is None) or \
+                        not policy.should_retry(failures, method, delay=delay):
+                    raise error
+
+                self.__metrics.retry(module, function)
+                if self.have_logger():
+                    self.__logger.debug("Resuming download at %d bytes in "
+                                        "%.1fs...", received, delay)
+                if delay:
+                    time.sleep(delay)
+                headers = None
+                if received:
+                    headers = {"Range": "bytes=%d-" % received,
+                               "If-Range": validator}
+                response = send(headers)
+                skip = _resume_offset(response, received, validator)
+        finally:
+            self.__metrics.received(module, function, received)
 
     @staticmethod
     def _get_key_params(key):
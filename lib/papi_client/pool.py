@@ -0,0 +1,267 @@
+#!/usr/bin/python
+"""
+Process-wide pool of ready to use PAPI clients.
+
+Building a PapiClientCollection means creating a base client, loading all
+views and usually logging in. Doing that once per request is wasteful, so
+long-running processes (e.g. mod_wsgi workers) can keep a small pool of
+ready collections around and borrow them per request instead.
+"""
+# so that we don't import papi_client.papi_client instead of papi_client
+from __future__ import absolute_import
+
+import contextlib
+import threading
+import time
+
+import papi_client.errors
+import papi_client.loader
+import papi_client.papi_client
+
+
+class Error(papi_client.errors.Error):
+    """
+    Base class for all exceptions in this module
+    """
+
+
+class PoolExhausted(Error):
+    """
+    No pooled object became available in time
+    """
+    def __init__(self, size, timeout):
+        Error.__init__(self, "All %s pooled clients busy after %ss" % (size,
+                                                                      timeout))
+
+
+def ping_collection(collection):
+    """
+    Default health check for pooled PapiClientCollection objects.
+
+    :return: True if the base client still answers a ping
+    """
+    try:
+        collection.base_client().ping()
+    except papi_client.errors.Error:
+        return False
+    return True
+
+
+class PapiClientPool(object):
+    """
+    Thread-safe pool of lazily created client objects.
+
+    Objects are created by the factory on demand, up to `size` objects in
+    total, and handed out through acquire()/release() or the borrow()
+    context manager. Idle objects that have not been checked for
+    `check_interval` seconds are passed through `health_check` before they
+    are handed out again; objects failing the check are discarded and
+    replaced.
+
+    :param factory: callable without arguments returning a new object
+    :param size: maximum number of objects alive at the same time
+    :param timeout: seconds acquire() waits for a free object before
+        raising PoolExhausted. None waits forever.
+    :param health_check: callable(obj) returning False if obj is unusable
+    :param check_interval: seconds after which an idle object is re-checked
+    :param logger: python logger to which we will log
+    """
+    def __init__(self, factory, size=4, timeout=None, health_check=None,
+                 check_interval=300, logger=None):
+        if size < 1:
+            raise papi_client.papi_client.InvalidArgument(
+                "Pool size must be positive")
+
+        self._factory = factory
+        self._size = size
+        self._timeout = timeout
+        self._health_check = health_check
+        self._check_interval = check_interval
+        self._logger = logger
+
+        self._cond = threading.Condition(threading.Lock())
+        # (object, last time it was known to be healthy), used as a stack
+        # so that recently used (warm) objects are handed out first
+        self._idle = []
+        self._created = 0
+        self._counters = {
+            "hits": 0,
+            "misses": 0,
+            "creations": 0,
+            "discards": 0,
+            "waits": 0,
+        }
+
+    @classmethod
+    def from_config(cls, conf, section_name, views=None, logger=None,
+                    **kwargs):
+        """
+        Create a pool of PapiClientCollection objects from a config section.
+
+        :param conf: ConfigParser instance
+        :param section_name: which section to use for the base client
+        :param views: names of the views to load; all views if None
+        :param kwargs: passed on to the pool constructor
+        """
+        def factory():
+            base_client = papi_client.papi_client.PapiClientFactory.\
+                client_from_config(conf, section_name, logger)
+            collection = papi_client.loader.PapiClientCollection(
+                base_client=base_client,
+                conf=conf,
+                logger=logger)
+            if views is None:
+                collection.load_all_views()
+            else:
+                for name in views:
+                    collection.load_view(name)
+            return collection
+
+        kwargs.setdefault("health_check", ping_collection)
+        return cls(factory, logger=logger, **kwargs)
+
+    def size(self):
+        return self._size
+
+    def acquire(self, timeout=None):
+        """
+        Take an object out of the pool, creating one if needed.
+
+        :param timeout: overrides the pool timeout for this call
+        :raises: PoolExhausted
+        """
+        if timeout is None:
+            timeout = self._timeout
+        deadline = None if timeout is None else time.time() + timeout
+
+        while True:
+            obj, checked = self.__take(deadline, timeout)
+            if obj is None:
+                return self.__create()
+
+            if self.__is_healthy(obj, checked):
+                return obj
+
+            self.__discard(obj)
+
+    def release(self, obj, discard=False):
+        """
+        Give an object back to the pool.
+
+        :param discard: drop the object instead of reusing it, e.g. because
+            it is in an unknown state after an error
+        """
+        if discard:
+            self.__discard(obj)
+            return
+
+        with self._cond:
+            self._idle.append((obj, time.time()))
+            self._cond.notify()
+
+    @contextlib.contextmanager
+    def borrow(self, timeout=None):
+        """
+        Context manager around acquire()/release().
+
+        Objects are discarded if a CommunicationError escapes the block, as
+        their connection state is unknown at that point.
+        """
+        obj = self.acquire(timeout)
+        try:
+            yield obj
+        except papi_client.papi_client.CommunicationError:
+            self.release(obj, discard=True)
+            raise
+        except:
+            self.release(obj)
+            raise
+        else:
+            self.release(obj)
+
+    def clear(self):
+        """
+        Drop all idle objects; borrowed objects are still returned normally.
+        """
+        with self._cond:
+            dropped = len(self._idle)
+            self._idle = []
+            self._created -= dropped
+            self._counters["discards"] += dropped
+            self._cond.notify_all()
+
+    def stats(self):
+        """
+        :return: dict with pool counters and current occupancy
+        """
+        with self._cond:
+            stats = dict(self._counters)
+            stats["size"] = self._size
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = self._created - len(self._idle)
+        return stats
+
+    def __take(self, deadline, timeout):
+        """
+        Get an idle (object, checked) pair, or (None, None) if the caller
+        is allowed to create a new object.
+        """
+        with self._cond:
+            waited = False
+            while True:
+                if self._idle:
+                    self._counters["hits"] += 1
+                    return self._idle.pop()
+
+                if self._created < self._size:
+                    self._created += 1
+                    self._counters["misses"] += 1
+                    return None, None
+
+                if not waited:
+                    self._counters["waits"] += 1
+                    waited = True
+
+                if deadline is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise PoolExhausted(self._size, timeout)
+                    self._cond.wait(remaining)
+
+    def __create(self):
+        try:
+            obj = self._factory()
+        except:
+            # give the slot back so that others can try again
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._counters["creations"] += 1
+        if self._logger:
+            self._logger.debug("Created pooled client %s", obj)
+        return obj
+
+    def __is_healthy(self, obj, checked):
+        if self._health_check is None:
+            return True
+        if time.time() - checked < self._check_interval:
+            return True
+        try:
+            return self._health_check(obj)
+        except Exception as e:  # pylint: disable=W0703
+            if self._logger:
+                self._logger.warning("Health check of %s failed: %s", obj, e)
+            return False
+
+    def __discard(self, obj):
+        with self._cond:
+            self._created -= 1
+            self._counters["discards"] += 1
+            self._cond.notify()
+        if self._logger:
+            self._logger.debug("Discarded pooled client %s", obj)
@@ -0,0 +1,222 @@
+#!/usr/bin/python
+"""
+Reconcile a feed of custom intelligence with what is on the manager.
+
+Re-importing a feed through PapiClientIntel.add_ip()/add_domain() sends
+every entry again, although most of them are usually already blacklisted
+with the same impact, source and comment. Reconciler fetches the current
+blacklist once (through list_ip/list_domain, or from a FeedMirror), keeps
+it in a dict keyed by ip/domain, and only sends what differs::
+
+    reconciler = Reconciler(client.intel, uploader=BulkUploader(client.intel))
+    report = reconciler.reconcile("ip", entries, key, delete=True)
+    logger.info("%s", report.counts())
+
+Updates are sent as adds, which replace the existing entry. Only the
+fields given in a new entry are compared, so a feed without comments does
+not update every entry that has one. Entries are consumed lazily; memory
+is bounded by the size of the current blacklist.
+"""
+# so that we don't import papi_client.papi_client instead of papi_client
+from __future__ import absolute_import
+
+import papi_client.bulk
+import papi_client.feed_sync
+import papi_client.papi_client
+
+
+# Fields of an entry that are compared to decide whether it needs updating
+COMPARED_FIELDS = ("impact", "source", "comment")
+
+KINDS = ("ip", "domain")
+
+
+class FeedDiff(object):
+    """
+    Difference between a new feed and the current blacklist
+
+    :param kind: "ip" or "domain"
+    :param current: dict mapping ip/domain to the current entry
+    :param fields: entry fields that are compared
+    """
+    def __init__(self, kind, current, fields=COMPARED_FIELDS):
+        if kind not in KINDS:
+            raise papi_client.papi_client.InvalidArgument(
+                "Unknown kind '%s', expected one of %s" % (
+                    kind, ", ".join(KINDS)))
+        self.kind = kind
+        self._current = current
+        self._fields = fields
+        self._seen = set()
+        self.adds = 0
+        self.updates = 0
+        self.unchanged = 0
+
+    def changed(self, entry):
+        """
+        Record a new entry and tell whether it needs to be sent.
+
+        :param entry: entry dictionary as for add_ip/add_domain
+        :return: True for new or updated entries
+        """
+        entry_id = entry[self.kind]
+        self._seen.add(entry_id)
+        existing = self._current.get(entry_id)
+        if existing is None:
+            self.adds += 1
+            return True
+        for field in self._fields:
+            if field in entry and entry[field] != existing.get(field):
+                self.updates += 1
+                return True
+        self.unchanged += 1
+        return False
+
+    def keep(self, entry_id):
+        """
+        Record an ip/domain of the new feed that is not sent, e.g. from an
+        invalid row, so that it is not among the deletions().
+        """
+        self._seen.add(entry_id)
+
+    def changes(self, entries):
+        """
+        Filter entries down to the ones that need to be sent.
+        """
+        for entry in entries:
+            if self.changed(entry):
+                yield entry
+
+    def deletions(self):
+        """
+        Ips/domains of the current blacklist not in the new feed. Only
+        meaningful once all entries of the new feed have been seen.
+        """
+        return sorted(entry_id for entry_id in self._current
+                      if entry_id not in self._seen)
+
+    def counts(self):
+        """
+        :return: dict with add, update and unchanged counts, and the
+            number of current entries missing from the new feed so far
+        """
+        return {
+            "add": self.adds,
+            "update": self.updates,
+            "unchanged": self.unchanged,
+            "missing": len(self._current) - len(
+                self._seen.intersection(self._current)),
+        }
+
+
+class ReconcileReport(object):
+    """
+    Outcome of Reconciler.reconcile()
+
+    :ivar diff: the FeedDiff
+    :ivar upload: BulkReport of the adds and updates
+    :ivar delete: BulkReport of the deletions, None if none were requested
+    """
+    def __init__(self, diff, upload, delete=None):
+        self.diff = diff
+        self.upload = upload
+        self.delete = delete
+
+    def ok(self):
+        return self.upload.ok() and (self.delete is None or
+                                     self.delete.ok())
+
+    def counts(self):
+        """
+        :return: dict with add, update, unchanged and delete counts
+        """
+        counts = self.diff.counts()
+        missing = counts.pop("missing")
+        counts["delete"] = missing if self.delete is not None else 0
+        return counts
+
+
+class Reconciler(object):
+    """
+    Send only the difference between a feed and the current blacklist.
+
+    :param intel_view: a `papi_client.api.intel.PapiClientIntel`
+    :param uploader: BulkUploader used for sending; a default one is
+        created if not given
+    :param mirror: optional FeedMirror to read the current blacklist from
+        instead of listing it
+    :param max_age: maximum age in seconds of the mirror before it is
+        synced
+    :param logger: python logger to which we will log
+    """
+    def __init__(self, intel_view, uploader=None, mirror=None, max_age=60,
+                 logger=None):
+        self._view = intel_view
+        self._uploader = uploader or papi_client.bulk.BulkUploader(
+            intel_view, logger=logger)
+        self._mirror = mirror
+        self._max_age = max_age
+        self._logger = logger
+
+    def current(self, kind, key=None):
+        """
+        :return: dict mapping ip/domain to the current entry
+        """
+        if self._mirror is not None:
+            entries = self._mirror.refresh(self._view, kind, key,
+                                           self._max_age)
+        elif kind == "ip":
+            entries = self._view.list_ip(key=key)
+        elif kind == "domain":
+            entries = self._view.list_domain(key=key)
+        else:
+            raise papi_client.papi_client.InvalidArgument(
+                "Unknown kind '%s', expected one of %s" % (
+                    kind, ", ".join(KINDS)))
+        return dict((entry[kind], entry) for entry in entries or [])
+
+    def diff(self, kind, key=None):
+        """
+        :return: FeedDiff against the current blacklist
+        """
+        current = self.current(kind, key)
+        if self._logger:
+            self._logger.debug("%d %s entries currently blacklisted for %s",
+                               len(current), kind,
+                               papi_client.feed_sync.scope_of(key))
+        return FeedDiff(kind, current)
+
+    def reconcile(self, kind, entries, key=None, delete=False):
+        """
+        Make the blacklist match the feed.
+
+        :param kind: "ip" or "domain"
+        :param entries: iterable of entry dictionaries
+        :param key: scope key as for the intel view methods
+        :param delete: also delete blacklisted entries that are not in the
+            feed, i.e. the feed is the complete blacklist for this scope
+        :return: ReconcileReport
+        """
+        diff = self.diff(kind, key)
+        changes = diff.changes(entries)
+        if kind == "ip":
+            upload = self._uploader.add_ip(changes, key)
+        else:
+            upload = self._uploader.add_domain(changes, key)
+
+        delete_report = None
+        if delete:
+            deletions = diff.deletions()
+            if kind == "ip":
+                delete_report = self._uploader.delete_ip(deletions, key)
+            else:
+                delete_report = self._uploader.delete_domain(deletions, key)
+
+        if self._mirror is not None:
+            self._mirror.invalidate(kind, key)
+        report = ReconcileReport(diff, upload, delete_report)
+        if self._logger:
+            self._logger.info("Reconciled %s feed for %s: %s", kind,
+                              papi_client.feed_sync.scope_of(key),
+                              report.counts())
+        return report
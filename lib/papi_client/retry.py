@@ -0,0 +1,275 @@
+#!/usr/bin/python
+"""
+Retry policies for PapiClient.do_request().
+
+A failed request is retried according to the RetryPolicy of its client::
+
+    policy = RetryPolicy(max_attempts=4, backoff=0.5, jitter=True,
+                         budget=RetryBudget(ratio=0.1))
+    client = PapiClient(url, login_params, retry_policy=policy)
+
+Delays grow exponentially with every attempt; with jitter a random delay up
+to that value is used, so that clients failing at the same time do not
+retry at the same time. A Retry-After header sent with the response extends
+the delay. The optional RetryBudget caps retries at a ratio of all requests,
+so that an unavailable manager does not get several times the usual load.
+
+Requests which the server did not process (rejected for authentication,
+throttled, or not connected at all) can always be retried. Other failed
+POST requests may have changed data on the server already, they are only
+retried if retry_non_idempotent is set.
+
+The default policy retries once, immediately, as PapiClient always did.
+"""
+# so that we don't import papi_client.papi_client instead of papi_client
+from __future__ import absolute_import
+
+import collections
+import email.utils
+import random
+import threading
+import time
+
+import requests
+
+import papi_client.errors
+
+
+# HTTP status codes of requests the server refused to process
+NOT_PROCESSED_STATUS = frozenset([429, 503])
+
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "OPTIONS"])
+
+
+class Error(papi_client.errors.Error):
+    """
+    Base class for all exceptions in this module
+    """
+    pass
+
+
+def http_response(error):
+    """
+    :return: requests.Response of the HTTP error wrapped by a
+        CommunicationError, None if there is none
+    """
+    cause = error.args[0] if getattr(error, "args", None) else None
+    return getattr(cause, "response", None)
+
+
+def not_processed(error):
+    """
+    Check whether the failed request was not processed by the server, so that
+    it is safe to send it again whatever its method.
+
+    :param error: CommunicationError
+    """
+    cause = error.args[0] if getattr(error, "args", None) else None
+    if isinstance(cause, requests.exceptions.ConnectTimeout):
+        return True
+    response = http_response(error)
+    return response is not None and \
+        response.status_code in NOT_PROCESSED_STATUS
+
+
+def retry_after(error, now=None):
+    """
+    Seconds the server asked us to wait before retrying, from the
+    Retry-After header of the response; None if there is none.
+    """
+    response = http_response(error)
+    if response is None:
+        return None
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+    if now is None:
+        now = time.time()
+    return max(0, email.utils.mktime_tz(parsed) - now)
+
+
+class RetryBudget(object):
+    """
+    Allows retries of at most ratio of the requests sent in the last window
+    seconds, but at least min_retries retries in that window.
+
+    :param ratio: retries allowed per request
+    :param min_retries: retries allowed per window regardless of requests
+    :param window: seconds over which requests and retries are counted
+    """
+    def __init__(self, ratio=0.2, min_retries=10, window=10):
+        if ratio < 0:
+            raise Error("ratio must not be negative")
+        if window <= 0:
+            raise Error("window must be positive")
+        self._ratio = ratio
+        self._min_retries = min_retries
+        self._window = window
+        self._lock = threading.Lock()
+        self._requests = collections.deque()
+        self._retries = collections.deque()
+        self._exhausted = 0
+
+    def __expire(self, now):
+        for events in (self._requests, self._retries):
+            while events and events[0] <= now - self._window:
+                events.popleft()
+
+    def request_sent(self):
+        with self._lock:
+            now = time.time()
+            self.__expire(now)
+            self._requests.append(now)
+
+    def acquire(self):
+        """
+        Take a retry from the budget.
+
+        :return: False if the budget is exhausted
+        """
+        with self._lock:
+            now = time.time()
+            self.__expire(now)
+            allowed = max(self._min_retries,
+                          int(self._ratio * len(self._requests)))
+            if len(self._retries) >= allowed:
+                self._exhausted += 1
+                return False
+            self._retries.append(now)
+            return True
+
+    def stats(self):
+        """
+        :return: dict with requests and retries in the current window and
+            the number of retries denied so far
+        """
+        with self._lock:
+            self.__expire(time.time())
+            return {"requests": len(self._requests),
+                    "retries": len(self._retries),
+                    "exhausted": self._exhausted}
+
+
+class RetryPolicy(object):
+    """
+    Decides whether and when a failed request is retried.
+
+    :param max_attempts: attempts per request including the first one
+    :param backoff: seconds to wait before the first retry, 0 to retry
+        immediately
+    :param multiplier: factor by which the delay grows for every retry
+    :param max_backoff: upper bound of the delay
+    :param jitter: if True, wait a random time up to the delay
+    :param budget: optional RetryBudget shared by all requests of the client
+    :param retry_non_idempotent: retry POST requests which may have been
+        processed by the server
+    :param honor_retry_after: wait at least as long as the server asked to
+        with Retry-After, up to max_retry_after seconds
+    :param max_retry_after: longest Retry-After honored; if the server asks
+        for more, the request is not retried
+    """
+    def __init__(self, max_attempts=2, backoff=0, multiplier=2,
+                 max_backoff=30, jitter=False, budget=None,
+                 retry_non_idempotent=True, honor_retry_after=True,
+                 max_retry_after=60):
+        if max_attempts < 1:
+            raise Error("max_attempts must be positive")
+        if backoff < 0 or max_backoff < 0:
+            raise Error("backoff must not be negative")
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.multiplier = multiplier
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.budget = budget
+        self.retry_non_idempotent = retry_non_idempotent
+        self.honor_retry_after = honor_retry_after
+        self.max_retry_after = max_retry_after
+
+    @classmethod
+    def from_config(cls, conf, section_name):
+        """
+        Create a policy from the retry_* options of a config section::
+
+            retry_max_attempts = 4
+            retry_backoff = 0.5
+            retry_max_backoff = 30
+            retry_jitter = True
+            retry_budget = 0.2
+            retry_non_idempotent = False
+
+        :return: RetryPolicy, or None if no retry option is set
+        """
+        options = {}
+        if conf.has_option(section_name, "retry_max_attempts"):
+            options["max_attempts"] = conf.getint(section_name,
+                                                  "retry_max_attempts")
+        for option in ["backoff", "max_backoff"]:
+            if conf.has_option(section_name, "retry_" + option):
+                options[option] = conf.getfloat(section_name,
+                                                "retry_" + option)
+        if conf.has_option(section_name, "retry_jitter"):
+            options["jitter"] = conf.getboolean(section_name, "retry_jitter")
+        if conf.has_option(section_name, "retry_budget"):
+            options["budget"] = RetryBudget(
+                ratio=conf.getfloat(section_name, "retry_budget"))
+        if conf.has_option(section_name, "retry_non_idempotent"):
+            options["retry_non_idempotent"] = conf.getboolean(
+                section_name, "retry_non_idempotent")
+        if not options:
+            return None
+        return cls(**options)
+
+    def request_sent(self):
+        """
+        Called for every request sent, to fill the retry budget
+        """
+        if self.budget is not None:
+            self.budget.request_sent()
+
+    def should_retry(self, attempt, method, processed=True, delay=0):
+        """
+        Check whether to retry after a failed attempt.
+
+        :param attempt: 1-based number of the attempt that failed
+        :param method: HTTP method of the request
+        :param processed: False if the server is known not to have
+            processed the request
+        :param delay: seconds the retry would be delayed
+        """
+        if attempt >= self.max_attempts:
+            return False
+        if processed and method.upper() not in IDEMPOTENT_METHODS and \
+                not self.retry_non_idempotent:
+            return False
+        if delay is None:
+            # Retry-After beyond max_retry_after
+            return False
+        if self.budget is not None and not self.budget.acquire():
+            return False
+        return True
+
+    def delay(self, attempt, retry_after=None):
+        """
+        Seconds to wait before the retry following the given attempt.
+
+        :return: delay, or None if the server asked to wait longer than
+            max_retry_after
+        """
+        delay = 0
+        if self.backoff:
+            delay = min(self.max_backoff,
+                        self.backoff * self.multiplier ** (attempt - 1))
+            if self.jitter:
+                delay = random.uniform(0, delay)
+        if retry_after is not None and self.honor_retry_after:
+            if retry_after > self.max_retry_after:
+                return None
+            delay = max(delay, retry_after)
+        return delay
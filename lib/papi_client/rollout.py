@@ -0,0 +1,409 @@
+#!/usr/bin/python
+"""
+Configuration rollout to many appliances.
+
+PapiClientApplianceMgmt.configure() starts a CONFIGURE action on a single
+appliance and returns right away; whether it worked is only known once
+get_action_status() says so. Rollout configures many appliances in waves
+and waits for their actions::
+
+    rollout = Rollout(client.appliance_mgmt, wave_size=20, concurrency=4,
+                      max_failure_rate=0.1)
+    report = rollout.run(uuids, settings={"sso_saml2_enabled1": False})
+    for result in report.failed():
+        logger.error("%r", result)
+
+The configure requests of a wave are sent by `concurrency` worker threads.
+The actions of all appliances are then tracked by the ActionTracker of the
+view (see `papi_client.actions`), which polls young actions often and old
+ones rarely and shares its requests with everybody else waiting for
+actions of that client. The next wave only starts once all actions of the
+current one completed or timed out. As soon as more than max_failure_rate of the
+appliances done so far failed, no further configure requests are sent and
+the remaining appliances are reported as skipped.
+"""
+# so that we don't import papi_client.papi_client instead of papi_client
+from __future__ import absolute_import
+
+import Queue
+import threading
+import time
+
+import papi_client.actions
+import papi_client.errors
+import papi_client.papi_client
+import papi_client.workers
+
+
+# States of an appliance
+PENDING = papi_client.actions.PENDING
+SUCCEEDED = papi_client.actions.SUCCEEDED
+FAILED = papi_client.actions.FAILED
+SKIPPED = "SKIPPED"
+
+
+class ApplianceResult(object):
+    """
+    Outcome of the rollout to a single appliance
+
+    :param index: 0-based position of the appliance in the rollout
+    :param wave: 0-based number of the wave of the appliance
+    """
+    def __init__(self, index, appliance_uuid, wave):
+        self.index = index
+        self.appliance_uuid = appliance_uuid
+        self.wave = wave
+        self.state = PENDING
+        self.action_uuid = None
+        self.status = None
+        self.error = None
+        self.started = None
+        self.finished = None
+
+    def ok(self):
+        return self.state == SUCCEEDED
+
+    def duration(self):
+        """
+        :return: seconds from the configure request until the action
+            completed, None if that did not happen
+        """
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
+
+    def __repr__(self):
+        return "<ApplianceResult %s: %s%s>" % (
+            self.appliance_uuid, self.state,
+            ": %s" % self.error if self.error is not None else "")
+
+
+class RolloutReport(object):
+    """
+    Per-appliance results of a rollout; safe to fill from several threads.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results = {}
+        self._stopped = None
+
+    def add(self, result):
+        with self._lock:
+            self._results[result.appliance_uuid] = result
+
+    def update(self, appliance_uuid, **fields):
+        """
+        Set fields of the result of an appliance.
+
+        :return: the ApplianceResult
+        """
+        with self._lock:
+            result = self._results[appliance_uuid]
+            for name, value in fields.iteritems():
+                setattr(result, name, value)
+            return result
+
+    def result(self, appliance_uuid):
+        with self._lock:
+            return self._results[appliance_uuid]
+
+    def results(self):
+        """
+        :return: list of ApplianceResult, in rollout order
+        """
+        with self._lock:
+            return sorted(self._results.itervalues(), key=lambda r: r.index)
+
+    def __with_state(self, state):
+        return [r for r in self.results() if r.state == state]
+
+    def succeeded(self):
+        return self.__with_state(SUCCEEDED)
+
+    def failed(self):
+        return self.__with_state(FAILED)
+
+    def skipped(self):
+        return self.__with_state(SKIPPED)
+
+    def ok(self):
+        return all(r.ok() for r in self.results())
+
+    def failure_rate(self):
+        """
+        :return: (failed, done) counts of the appliances whose action
+            completed or failed
+        """
+        with self._lock:
+            states = [r.state for r in self._results.itervalues()]
+        failed = states.count(FAILED)
+        return failed, failed + states.count(SUCCEEDED)
+
+    def stop(self, reason):
+        """
+        Mark the rollout stopped, keeping the first reason.
+
+        :return: True if it was not stopped before
+        """
+        with self._lock:
+            if self._stopped is not None:
+                return False
+            self._stopped = reason
+            return True
+
+    def stopped(self):
+        """
+        :return: the reason the rollout was stopped, None if it was not
+        """
+        with self._lock:
+            return self._stopped
+
+    def summary(self):
+        """
+        :return: dict with appliance counts per state
+        """
+        results = self.results()
+        summary = {
+            "appliances": len(results),
+            "waves": len(set(r.wave for r in results)),
+            "stopped": self.stopped(),
+        }
+        for state in [SUCCEEDED, FAILED, SKIPPED, PENDING]:
+            summary[state.lower()] = len([r for r in results
+                                          if r.state == state])
+        return summary
+
+
+class _TrackedActions(object):
+    """
+    ActionPoller-like adapter waiting for actions through an ActionTracker.
+
+    Callbacks run on the thread calling wait() rather than on the tracker
+    thread, and actions which did not complete after timeout seconds are
+    reported failed even if the tracker would wait longer for them.
+    """
+    def __init__(self, tracker, timeout, clock):
+        self._tracker = tracker
+        self._timeout = timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        # (user_id, action_uuid) -> (callback, deadline)
+        self._pending = {}
+        self._completed = Queue.Queue()
+
+    def add(self, action_uuid, callback, user_id=None):
+        key = (user_id, action_uuid)
+        with self._lock:
+            self._pending[key] = (callback, self._clock() + self._timeout)
+        try:
+            self._tracker.track(
+                action_uuid, user_id=user_id,
+                callback=lambda future: self._completed.put((key, future)))
+        except papi_client.actions.Error:
+            with self._lock:
+                del self._pending[key]
+            raise
+
+    def wait(self):
+        """
+        Call the callbacks of all actions as they complete or time out.
+        """
+        while True:
+            with self._lock:
+                if not self._pending:
+                    return
+                deadline = min(d for _, d in self._pending.itervalues())
+            try:
+                key, future = self._completed.get(
+                    timeout=max(0, deadline - self._clock()))
+            except Queue.Empty:
+                self.__time_out()
+                continue
+            with self._lock:
+                pending = self._pending.pop(key, None)
+            if pending is None:
+                # timed out already
+                continue
+            callback = pending[0]
+            error = future.exception()
+            if error is None:
+                callback(key[1], SUCCEEDED, future.result(), None)
+            else:
+                callback(key[1], FAILED, None, error)
+
+    def __time_out(self):
+        now = self._clock()
+        with self._lock:
+            expired = [(key, callback) for key, (callback, deadline)
+                       in self._pending.iteritems() if deadline <= now]
+            for key, _callback in expired:
+                del self._pending[key]
+        for (_user_id, action_uuid), callback in expired:
+            callback(action_uuid, FAILED, None,
+                     papi_client.actions.ActionTimeout(
+                         "Action %s did not complete after %ds" % (
+                             action_uuid, self._timeout)))
+
+
+class Rollout(object):
+    """
+    Send the same configure() to many appliances, in waves.
+
+    :param appliance_mgmt: a PapiClientApplianceMgmt
+    :param wave_size: appliances configured before waiting for their
+        actions to complete
+    :param concurrency: configure requests in flight at the same time
+    :param max_failure_rate: fraction of failed appliances above which the
+        rollout stops; None never stops
+    :param min_done: appliances which must be done before the failure rate
+        is looked at
+    :param action_timeout: seconds after which an action that did not
+        complete is reported failed
+    :param tracker: `papi_client.actions.ActionTracker` to wait for the
+        actions with; by default the one of the view,
+        appliance_mgmt.action_tracker()
+    :param min_poll_interval: see `papi_client.actions.ActionPoller`, only
+        used for views without an ActionTracker
+    :param max_poll_interval: as min_poll_interval
+    :param progress: optional callable(ApplianceResult) invoked when an
+        appliance is done; called from worker threads
+    :param logger: python logger to which we will log
+    :param clock: callable returning the current time in seconds
+    :param sleep: callable(seconds) used to wait between polls of views
+        without an ActionTracker
+    """
+    def __init__(self, appliance_mgmt, wave_size=10, concurrency=4,
+                 max_failure_rate=0.1, min_done=5, action_timeout=3600,
+                 tracker=None, min_poll_interval=2.0, max_poll_interval=60.0,
+                 progress=None, logger=None, clock=time.time,
+                 sleep=time.sleep):
+        if wave_size < 1:
+            raise papi_client.papi_client.InvalidArgument(
+                "wave_size must be positive")
+        if concurrency < 1:
+            raise papi_client.papi_client.InvalidArgument(
+                "concurrency must be positive")
+
+        self._api = appliance_mgmt
+        self._wave_size = wave_size
+        self._concurrency = concurrency
+        self._max_failure_rate = max_failure_rate
+        self._min_done = min_done
+        self._action_timeout = action_timeout
+        self._tracker = tracker
+        self._min_poll_interval = min_poll_interval
+        self._max_poll_interval = max_poll_interval
+        self._progress = progress
+        self._logger = logger
+        self._clock = clock
+        self._sleep = sleep
+
+    def run(self, appliances, **configure_args):
+        """
+        Configure all appliances.
+
+        :param appliances: appliance uuids, or a dict mapping appliance uuid
+            to the configure() arguments of that appliance, which override
+            configure_args
+        :param configure_args: configure() arguments for all appliances:
+            software_version, auto_update, settings, user_id
+        :return: RolloutReport
+        """
+        if isinstance(appliances, dict):
+            overrides = appliances
+            uuids = sorted(appliances)
+        else:
+            overrides = {}
+            uuids = list(appliances)
+
+        report = RolloutReport()
+        for index, uuid in enumerate(uuids):
+            report.add(ApplianceResult(index, uuid, index // self._wave_size))
+
+        poller = self.__poller()
+        pool = papi_client.workers.WorkerPool(workers=self._concurrency,
+                                              name="papi-rollout")
+        try:
+            for first in range(0, len(uuids), self._wave_size):
+                if report.stopped():
+                    break
+                futures = []
+                for uuid in uuids[first:first + self._wave_size]:
+                    args = dict(configure_args)
+                    args.update(overrides.get(uuid) or {})
+                    futures.append(pool.submit(self.__configure, report,
+                                               poller, uuid, args))
+                papi_client.workers.wait_all(futures)
+                poller.wait()
+                if self._logger:
+                    self._logger.info("Rollout wave %d done: %s",
+                                      first // self._wave_size,
+                                      report.summary())
+        finally:
+            pool.shutdown(wait=True)
+
+        for result in report.results():
+            if result.state == PENDING:
+                report.update(result.appliance_uuid, state=SKIPPED)
+
+        if self._logger:
+            self._logger.info("Rollout done: %s", report.summary())
+        return report
+
+    def __poller(self):
+        """
+        :return: object with the add() and wait() methods of an ActionPoller
+        """
+        tracker = self._tracker
+        if tracker is None and hasattr(self._api, "action_tracker"):
+            tracker = self._api.action_tracker()
+        if tracker is not None:
+            return _TrackedActions(tracker, self._action_timeout,
+                                   self._clock)
+        return papi_client.actions.ActionPoller(
+            self._api,
+            min_interval=self._min_poll_interval,
+            max_interval=self._max_poll_interval,
+            timeout=self._action_timeout,
+            logger=self._logger,
+            clock=self._clock,
+            sleep=self._sleep)
+
+    def __configure(self, report, poller, uuid, args):
+        # appliances of a wave whose requests did not go out before the
+        # rollout stopped are skipped
+        if report.stopped():
+            return
+        report.update(uuid, started=self._clock())
+        try:
+            action_uuid = papi_client.actions.action_uuid_of(
+                self._api.configure(uuid, **args))
+        except papi_client.errors.Error as e:
+            self.__done(report, uuid, FAILED, None, e)
+            return
+        report.update(uuid, action_uuid=action_uuid)
+
+        def done(_action_uuid, outcome, status, error):
+            self.__done(report, uuid, outcome, status, error)
+        try:
+            poller.add(action_uuid, done, user_id=args.get("user_id"))
+        except papi_client.actions.TrackerClosed as e:
+            self.__done(report, uuid, FAILED, None, e)
+
+    def __done(self, report, uuid, outcome, status, error):
+        result = report.update(uuid, state=outcome, status=status,
+                               error=error, finished=self._clock())
+        if self._logger:
+            if result.ok():
+                self._logger.debug("%r", result)
+            else:
+                self._logger.error("%r", result)
+        if self._progress:
+            self._progress(result)
+
+        failed, done = report.failure_rate()
+        if self._max_failure_rate is not None and done >= self._min_done and \
+                failed > self._max_failure_rate * done:
+            reason = "%d of %d appliances failed" % (failed, done)
+            if report.stop(reason) and self._logger:
+                self._logger.error("Stopping rollout: %s", reason)
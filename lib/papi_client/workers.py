@@ -0,0 +1,223 @@
+#!/usr/bin/python
+"""
+Minimal futures and worker thread pool for concurrent PAPI requests.
+
+The papi_client supports python 2.6 and 2.7, which ship neither asyncio
+nor concurrent.futures. PAPI calls are network bound, so a small pool of
+threads gives us the concurrency we need.
+"""
+# so that we don't import papi_client.papi_client instead of papi_client
+from __future__ import absolute_import
+
+import Queue
+import sys
+import threading
+import time
+
+import papi_client.errors
+
+
+class Error(papi_client.errors.Error):
+    """
+    Base class for all exceptions in this module
+    """
+
+
+class TimeoutError(Error):
+    """
+    A future did not complete in time
+    """
+
+
+class PoolShutdown(Error):
+    """
+    Work was submitted to a pool that has been shut down
+    """
+
+
+class Future(object):
+    """
+    Result of a call that is executed by a WorkerPool.
+    """
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._done = False
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def done(self):
+        with self._cond:
+            return self._done
+
+    def __wait(self, timeout):
+        with self._cond:
+            if not self._done:
+                self._cond.wait(timeout)
+            if not self._done:
+                raise TimeoutError("Result not available after %ss" % timeout)
+
+    def result(self, timeout=None):
+        """
+        Wait for the call to complete and return its result.
+
+        If the call raised an exception, it is re-raised here with its
+        original traceback.
+
+        :param timeout: seconds to wait, None waits forever
+        :raises: TimeoutError
+        """
+        self.__wait(timeout)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        """
+        Wait for the call to complete and return the exception it raised,
+        or None.
+        """
+        self.__wait(timeout)
+        if self._exc_info is not None:
+            return self._exc_info[1]
+        return None
+
+    def add_done_callback(self, fn):
+        """
+        Call fn(future) once the call completes; immediately if it already
+        has.
+        """
+        with self._cond:
+            if not self._done:
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def set_result(self, result):
+        self.__complete(result, None)
+
+    def set_exception(self, exc_info):
+        """
+        :param exc_info: as returned by sys.exc_info()
+        """
+        self.__complete(None, exc_info)
+
+    def __complete(self, result, exc_info):
+        with self._cond:
+            self._result = result
+            self._exc_info = exc_info
+            self._done = True
+            callbacks, self._callbacks = self._callbacks, []
+            self._cond.notify_all()
+        for fn in callbacks:
+            fn(self)
+
+
+def wait_all(futures, timeout=None):
+    """
+    Wait until all futures are done.
+
+    :param timeout: total seconds to wait, None waits forever
+    :raises: TimeoutError
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    for future in futures:
+        remaining = None
+        if deadline is not None:
+            remaining = max(0, deadline - time.time())
+        future.exception(remaining)
+
+
+class WorkerPool(object):
+    """
+    Fixed number of worker threads executing submitted calls.
+
+    :param workers: number of threads, i.e. the maximum number of calls
+        running at the same time
+    :param max_pending: if set, submit() blocks while this many calls are
+        queued but not started yet; this bounds memory for large inputs
+    :param name: prefix for thread names
+    :param logger: python logger to which we will log
+    """
+    def __init__(self, workers=8, max_pending=None, name="papi-worker",
+                 logger=None):
+        if workers < 1:
+            raise Error("Need at least one worker")
+
+        self._queue = Queue.Queue(max_pending or 0)
+        self._logger = logger
+        self._shutdown = False
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self.__work,
+                                      name="%s-%d" % (name, i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.shutdown(wait=True)
+
+    def workers(self):
+        return len(self._threads)
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Schedule fn(*args, **kwargs) to run on a worker thread.
+
+        :return: Future
+        """
+        if self._shutdown:
+            raise PoolShutdown("Cannot submit to a pool that was shut down")
+        future = Future()
+        self._queue.put((future, fn, args, kwargs))
+        return future
+
+    def map(self, fn, iterable):
+        """
+        Like the builtin map(), but calls run concurrently.
+
+        :return: list of results in the order of iterable
+        :raises: the first exception raised by any of the calls
+        """
+        futures = [self.submit(fn, item) for item in iterable]
+        return [future.result() for future in futures]
+
+    def shutdown(self, wait=True):
+        """
+        Stop accepting work and let the workers exit once the queue is empty.
+        """
+        if not self._shutdown:
+            self._shutdown = True
+            for _ in self._threads:
+                self._queue.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def __work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, fn, args, kwargs = item
+            try:
+                result = fn(*args, **kwargs)
+            except:  # pylint: disable=W0702
+                future.set_exception(sys.exc_info())
+            else:
+                future.set_result(result)
+
+
+def fan_out(fn, items, concurrency=8):
+    """
+    Call fn(item) for all items with at most `concurrency` calls in flight.
+
+    :return: list of Futures in the order of items, all of them done
+    """
+    with WorkerPool(workers=concurrency) as pool:
+        futures = [pool.submit(fn, item) for item in items]
+    return futures